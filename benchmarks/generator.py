@@ -0,0 +1,146 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import os
+import random
+from typing import Dict, List, Tuple
+
+
+# Kinds of trees, see `generate()`
+SCENARIOS = ("tiny", "huge", "deep", "duplicated", "renamed")
+
+# How much bigger every tree is at each scale
+SCALES: Dict[str, int] = {"small": 1, "medium": 10, "large": 100}
+
+# Modification time of every file and directory (2020-09-13), so the trees are
+# identical from one run to the next and old enough for the stat cache
+MTIME = 1_600_000_000
+
+# Size of the blocks in which the huge files are written
+BLOCK_SIZE = 1024 * 1024
+
+WORDS = (
+    "backup", "restore", "job", "project", "file", "chunk", "digest", "signature",
+    "archive", "pack", "index", "journal", "cache", "scan", "hash", "store",
+)
+
+
+def _text(rng: random.Random, size: int) -> bytes:
+    """Words picked at random, as source code or logs: it compresses well."""
+
+    words: List[str] = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words).encode()[:size]
+
+
+def _binary(rng: random.Random, size: int) -> bytes:
+    """Random bytes, as media or archives: it can't be compressed."""
+    return rng.getrandbits(size * 8).to_bytes(size, "little") if size > 0 else b""
+
+
+def _write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as afile:
+        afile.write(data)
+
+
+def _write_huge(rng: random.Random, path: str, size: int):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as afile:
+        while size > 0:
+            afile.write(_binary(rng, min(size, BLOCK_SIZE)))
+            size -= BLOCK_SIZE
+
+
+def _freeze(root: str):
+    """Give every file and directory of the tree the same modification time."""
+
+    for directory, _, files in os.walk(root, topdown=False):
+        for name in files:
+            os.utime(os.path.join(directory, name), (MTIME, MTIME))
+        os.utime(directory, (MTIME, MTIME))
+
+
+def tree_size(root: str) -> Tuple[int, int]:
+    """Number of files and bytes of a tree."""
+
+    files = size = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(directory, name))
+    return files, size
+
+
+def generate(root: str, scenario: str, scale: str, seed: int = 0) -> Tuple[int, int]:
+    """
+    Write the synthetic tree of a scenario into `root`.
+
+    - `tiny`: many files of up to 4 KiB in directories of 100 files.
+    - `huge`: a few files of 8 MiB (at the small scale) of random bytes.
+    - `deep`: directories nested 12 levels deep, with a few files at every level.
+    - `duplicated`: many files sharing 20 different contents.
+    - `renamed`: like `tiny`; `rename()` then moves half of its files.
+
+    The same `scenario`, `scale` and `seed` always give the same tree,
+    byte by byte and with the same modification times. Returns the
+    number of files and bytes written.
+    """
+
+    rng = random.Random(f"{seed}:{scenario}")
+    factor: int = SCALES[scale]
+
+    if scenario in ("tiny", "renamed"):
+        for i in range((1000 if scenario == "tiny" else 500) * factor):
+            _write(f"{root}/dir-{i // 100:04d}/file-{i:06d}.txt", _text(rng, rng.randint(0, 4096)))
+    elif scenario == "huge":
+        for i in range(2):
+            _write_huge(rng, f"{root}/huge-{i}.bin", 8 * 1024 * 1024 * factor)
+        _write(f"{root}/small.txt", _text(rng, 1024))
+    elif scenario == "deep":
+        for branch in range(10 * factor):
+            path = f"{root}/branch-{branch:04d}"
+            for level in range(12):
+                path += f"/level-{level:02d}"
+                for i in range(3):
+                    _write(f"{path}/file-{i}.txt", _text(rng, rng.randint(100, 2000)))
+    elif scenario == "duplicated":
+        contents = [_text(rng, rng.randint(1024, 16384)) for _ in range(20)]
+        for i in range(1000 * factor):
+            _write(f"{root}/dir-{i // 100:04d}/copy-{i:06d}.txt", rng.choice(contents))
+    else:
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+    _freeze(root)
+    return tree_size(root)
+
+
+def rename(root: str, seed: int = 0) -> int:
+    """
+    Move half of the files of a tree to a new directory, as a reorganization would.
+
+    The content of the files doesn't change, so a backup only has to
+    find it again. Returns the number of files moved.
+    """
+
+    rng = random.Random(f"{seed}:rename")
+    moved = 0
+
+    for directory, _, names in sorted(os.walk(root)):
+        for name in sorted(names):
+            if rng.random() < 0.5:
+                continue
+            destination = os.path.join(root, "renamed", os.path.relpath(directory, root))
+            os.makedirs(destination, exist_ok=True)
+            os.rename(os.path.join(directory, name), os.path.join(destination, "moved-" + name))
+            moved += 1
+
+    _freeze(root)
+    return moved
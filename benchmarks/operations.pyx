@@ -0,0 +1,108 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import hashlib
+import os
+import time
+from typing import Any, Dict
+
+# 3rd Party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.db cimport RunupDB
+from runup.interpreter cimport Interpreter_1
+from runup.utils cimport hashfile
+
+
+# The parts of RunUp that are not reachable from Python, timed from here
+
+
+cpdef tuple scan(Interpreter_1 interpreter, config: Dict[str, Any]):
+    """Scan the workspace of a project. Returns the number of files and their bytes."""
+
+    cdef long long files = 0
+    cdef long long size = 0
+
+    for _, _, stat_result in interpreter._working_directories(config):
+        files += 1
+        size += stat_result.st_size
+    return files, size
+
+
+cpdef long long hash_tree(str root):
+    """Hash every file of a tree with `hashfile()`. Returns the bytes hashed."""
+
+    cdef long long size = 0
+
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            hashfile(path, b"sha256")
+            size += os.path.getsize(path)
+    return size
+
+
+cdef tuple _signature(RunupDB db, int i):
+    """A signature made up for the content number `i`."""
+    return tuple([hashlib.new(algo, str(i).encode()).hexdigest() for algo in db.digests])
+
+
+cpdef dict db_operations(str context, int num_files):
+    """
+    Time the main operations of `RunupDB` on a repository.
+
+    Two jobs of `num_files` files are inserted and committed: in the
+    first one, half of the files have a content already inserted; in
+    the second one, a file out of ten has changed. They are then
+    listed, compared and selected as for a restoration. Returns the
+    `(seconds, rows)` of every operation.
+    """
+
+    cdef RunupDB db = RunupDB(context, False)
+    cdef dict results = {}
+    cdef int old_job, new_job
+    cdef int i, content
+
+    db.insert_backups(["bench"])
+    db.open()
+    started = time.perf_counter()
+    old_job = db.insert_job("bench")
+    for i in range(num_files):
+        db.insert_file(old_job, f"dir-{i // 100:04d}/file-{i:06d}", _signature(db, i // 2), i // 2)
+    db.finish_job(old_job, 0)
+    new_job = db.insert_job("bench")
+    for i in range(num_files):
+        content = -i - 1 if i % 10 == 0 else i // 2
+        db.insert_file(new_job, f"dir-{i // 100:04d}/file-{i:06d}", _signature(db, content), abs(content))
+    db.finish_job(new_job, 0)
+    results["insert"] = (time.perf_counter() - started, 2 * num_files)
+
+    started = time.perf_counter()
+    db.close(commit=True)
+    results["commit"] = (time.perf_counter() - started, 2 * num_files)
+
+    db.open(index=False)
+    try:
+        started = time.perf_counter()
+        rows = sum([1 for _ in db.job_files(new_job, [])])
+        results["list"] = (time.perf_counter() - started, rows)
+
+        started = time.perf_counter()
+        rows = sum([1 for _ in db.diff_jobs(old_job, new_job)])
+        results["diff"] = (time.perf_counter() - started, rows)
+    finally:
+        db.close(commit=False)
+
+    started = time.perf_counter()
+    rows = len(db.select_job(new_job, "bench"))
+    results["select"] = (time.perf_counter() - started, rows)
+
+    return results
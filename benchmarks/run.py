@@ -0,0 +1,316 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+from contextlib import redirect_stdout
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 3rd Party
+import click
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from benchmarks import operations
+from benchmarks.generator import SCALES, SCENARIOS, generate, rename
+from runup.cli import cli
+from runup.stats import format_size
+from runup.utils import memory_high_water
+from runup.version import RUNUP_VERSION
+from runup.yaml_parser import ParserYAML
+
+
+# Every benchmark: the trees of the generator, and the DB on its own
+BENCHMARKS = SCENARIOS + ("db",)
+
+# Files inserted in every job of the `db` benchmark at the small scale
+DB_FILES = 10000
+
+# Changes in time below this (in seconds) are noise, not regressions
+MIN_SECONDS = 0.01
+
+CONFIG = """
+version: '1.0'
+
+project:
+  bench:
+    include:
+      - './data'
+"""
+
+
+def _measure(func: Callable[[], Any], files: int, size: int) -> Dict[str, Any]:
+    """Run `func` and return its time, throughput and peak memory."""
+
+    memory_high_water(reset=True)
+    started = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        func()
+    seconds = time.perf_counter() - started
+    return _result(seconds, files, size, memory_high_water())
+
+
+def _result(seconds: float, files: int, size: int, peak_rss: int) -> Dict[str, Any]:
+    return {
+        "seconds": round(seconds, 6),
+        "files": files,
+        "bytes": size,
+        "files_per_s": round(files / seconds, 1) if seconds > 0 else None,
+        "mb_per_s": round(size / seconds / 1024 / 1024, 2) if seconds > 0 and size > 0 else None,
+        "peak_rss": peak_rss,
+    }
+
+
+def _repository(context: str):
+    """Initialize a repository for the project `bench`, backing up `data`."""
+
+    with open(f"{context}/runup.yaml", "w") as afile:
+        afile.write(CONFIG)
+    with redirect_stdout(io.StringIO()):
+        cli(["--context", context, "init"], standalone_mode=False)
+
+
+def run_scenario(scenario: str, scale: str, seed: int, workers: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Benchmark a tree of the generator, in a repository of its own.
+
+    The workspace is scanned (`_working_directories()`) and hashed
+    (`hashfile()`), then backed up (`create_backup()`) twice, the
+    second time without changes. The `renamed` tree is backed up once
+    more after moving half of its files. The last job is restored
+    (`restore_backup()`).
+    """
+
+    results: Dict[str, Dict[str, Any]] = {}
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as context:
+        files, size = generate(f"{context}/data", scenario, scale, seed)
+        _repository(context)
+        yaml_config, interpreter = ParserYAML(context=context, verbose=False).parse()
+        config = yaml_config["project"]["bench"]
+
+        results["scan"] = _measure(lambda: operations.scan(interpreter, config), files, 0)
+        results["hashfile"] = _measure(lambda: operations.hash_tree(f"{context}/data"), files, size)
+        results["backup"] = _measure(
+            lambda: interpreter.create_backup(yaml_config, "bench", workers=workers), files, size
+        )
+        results["backup_unchanged"] = _measure(
+            lambda: interpreter.create_backup(yaml_config, "bench", workers=workers), files, size
+        )
+        if scenario == "renamed":
+            rename(f"{context}/data", seed)
+            results["backup_renamed"] = _measure(
+                lambda: interpreter.create_backup(yaml_config, "bench", workers=workers), files, size
+            )
+
+        # Restored next to the repository (the location is relative to the working directory)
+        os.chdir(context)
+        try:
+            results["restore"] = _measure(
+                lambda: interpreter.restore_backup(yaml_config, "bench", "restored", 0, True, workers),
+                files,
+                size,
+            )
+        finally:
+            os.chdir(cwd)
+
+    return results
+
+
+def run_db(scale: str) -> Dict[str, Dict[str, Any]]:
+    """Benchmark the operations of `RunupDB` on an empty repository."""
+
+    with tempfile.TemporaryDirectory() as context:
+        _repository(context)
+        memory_high_water(reset=True)
+        timings = operations.db_operations(context, DB_FILES * SCALES[scale])
+        peak_rss = memory_high_water()
+
+    return {name: _result(seconds, rows, 0, peak_rss) for name, (seconds, rows) in timings.items()}
+
+
+def run(benchmarks: Tuple[str, ...], scale: str, seed: int, workers: int, repeat: int) -> Dict[str, Any]:
+    """
+    Run the benchmarks `repeat` times.
+
+    The fastest time of every operation is kept, as the others were
+    slowed down by something else. Returns the report.
+    """
+
+    results: Dict[str, Dict[str, Any]] = {}
+
+    for benchmark in benchmarks:
+        for _ in range(repeat):
+            if benchmark == "db":
+                timings = run_db(scale)
+            else:
+                timings = run_scenario(benchmark, scale, seed, workers)
+            for operation, result in timings.items():
+                key = f"{benchmark}/{operation}"
+                if key not in results or result["seconds"] < results[key]["seconds"]:
+                    results[key] = result
+
+    return {
+        "runup": RUNUP_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "seed": seed,
+        "workers": workers,
+        "results": results,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> Dict[str, str]:
+    """
+    Compare a report with a baseline of the same scale and seed.
+
+    An operation regressed if it is more than `tolerance` percent
+    slower, or used that much more memory. Returns the change of every
+    operation of the baseline, `REGRESSION` marking the regressions.
+    """
+
+    changes: Dict[str, str] = {}
+    limit = 1 + tolerance / 100
+
+    for key, current in report["results"].items():
+        previous: Optional[Dict[str, Any]] = baseline["results"].get(key)
+        if previous is None:
+            continue
+
+        change = "-"
+        if previous["seconds"] > 0:
+            change = f"{(current['seconds'] / previous['seconds'] - 1) * 100:+.1f}%"
+        slower = (
+            current["seconds"] > previous["seconds"] * limit
+            and current["seconds"] - previous["seconds"] > MIN_SECONDS
+        )
+        bigger = previous["peak_rss"] > 0 and current["peak_rss"] > previous["peak_rss"] * limit
+        if slower or bigger:
+            change += " REGRESSION" + (" (time)" if slower else "") + (" (memory)" if bigger else "")
+        changes[key] = change
+
+    return changes
+
+
+def _table(report: Dict[str, Any], changes: Dict[str, str]) -> List[str]:
+    """The lines of the report, one per operation."""
+
+    rows = [("Benchmark", "Seconds", "Files/s", "MB/s", "Peak RSS", "Baseline")]
+    for key, result in report["results"].items():
+        rows.append((
+            key,
+            f"{result['seconds']:.3f}",
+            "-" if result["files_per_s"] is None else f"{result['files_per_s']:.0f}",
+            "-" if result["mb_per_s"] is None else f"{result['mb_per_s']:.1f}",
+            "-" if result["peak_rss"] < 0 else format_size(result["peak_rss"]),
+            changes.get(key, ""),
+        ))
+
+    # The name on the left, the figures on the right
+    widths = [max([len(row[i]) for row in rows]) for i in range(len(rows[0]))]
+    return [
+        "  ".join([row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])])
+        .rstrip()
+        for row in rows
+    ]
+
+
+@click.command()
+@click.option(
+    "--scale",
+    type=click.Choice(list(SCALES)),
+    default="small",
+    help="Size of the trees: every scale is ten times the previous one. Default: small.",
+)
+@click.option(
+    "-b",
+    "--benchmark",
+    "benchmarks",
+    type=click.Choice(BENCHMARKS),
+    multiple=True,
+    help="Benchmark to run. Can be used multiple times. Default: all of them.",
+)
+@click.option("--seed", type=int, default=0, help="Seed of the generator of the trees. Default: 0.")
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(0),
+    default=0,
+    help="Number of threads of the backups and restorations. Zero (default) for the number of CPUs.",
+)
+@click.option(
+    "--repeat",
+    type=click.IntRange(1),
+    default=3,
+    help="Times every benchmark is run; the fastest one counts. Default: 3.",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="File where the results are written, in JSON, e.g. to be used as a baseline.",
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Results of a previous run (see --output) to compare with.",
+)
+@click.option(
+    "--tolerance",
+    type=click.FloatRange(0),
+    default=15,
+    help="Percentage of time or memory over the baseline that is a regression. Default: 15.",
+)
+def main(
+    scale: str,
+    benchmarks: Tuple[str, ...],
+    seed: int,
+    jobs: int,
+    repeat: int,
+    output: Optional[str],
+    baseline: Optional[str],
+    tolerance: float,
+):
+    """Time backups, restorations, hashing, scanning and the DB on synthetic trees."""
+
+    previous: Optional[Dict[str, Any]] = None
+    if baseline is not None:
+        with open(baseline) as afile:
+            previous = json.load(afile)
+        if previous["scale"] != scale or previous["seed"] != seed:
+            click.secho(
+                f"The baseline is of the scale `{previous['scale']}` and the seed {previous['seed']}.",
+                fg="red",
+            )
+            sys.exit(2)
+
+    report = run(benchmarks or BENCHMARKS, scale, seed, jobs, repeat)
+    changes = compare(report, previous, tolerance) if previous is not None else {}
+
+    for line in _table(report, changes):
+        click.echo(line)
+
+    if output is not None:
+        with open(output, "w") as afile:
+            json.dump(report, afile, indent=2)
+            afile.write("\n")
+
+    regressions = [key for key, change in changes.items() if "REGRESSION" in change]
+    if len(regressions) > 0:
+        click.secho(f"{len(regressions)} regressions: " + ", ".join(regressions), fg="red")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
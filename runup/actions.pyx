@@ -5,6 +5,7 @@
 import os
 from pathlib import Path
 from shutil import rmtree
+import signal
 import sys
 from typing import Dict, Optional, Union, Any
 
@@ -17,17 +18,27 @@ pyximport.install()
 # Own
 from runup.config cimport Config
 from runup.interpreter cimport Interpreter
+from runup.lock cimport RepositoryLock
+from runup.trace cimport Tracer, get_tracer
 from runup.utils cimport vCall, vResponse
 from runup.version import RUNUP_VERSION
 from runup.yaml_parser cimport ParserYAML
 
 
-cpdef void set_config(config: Config, context: str, verbose: bint):
+cpdef void set_config(config: Config, context: str, verbose: bint, trace: str = ""):
     """A simple backup system that only saves the files that has changed."""
 
+    cdef Tracer tracer
+
     config.context = context
     config.verbose = verbose
 
+    # Traced until the command ends
+    if trace != "":
+        tracer = get_tracer()
+        tracer.start(trace)
+        click.get_current_context().with_resource(tracer)
+
     if verbose:
         click.echo("-" * 10)
         click.echo(f"RunUp, version {RUNUP_VERSION}")
@@ -45,13 +56,13 @@ cpdef void set_config(config: Config, context: str, verbose: bint):
     vResponse(config.verbose, "ParserYAML.parse", config.interpreter)
 
 
-cpdef bint init(config: Config):
+cpdef bint init(config: Config, digests: tuple = (), storage: str = "zip"):
     """Initialize the backup system."""
 
     # Take actions
     if config.interpreter is not None:
         vCall(config.verbose, "Interpreter:set_environment")
-        env_set: bool = config.interpreter.set_environment()
+        env_set: bool = config.interpreter.set_environment(digests, storage)
         vResponse(config.verbose, "Interpreter:set_environment", env_set)
 
         if env_set:
@@ -62,13 +73,23 @@ cpdef bint init(config: Config):
         sys.exit(1)
 
 
-cpdef bint backup(config: Config, project: str):
+cpdef bint backup(
+    config: Config,
+    project: str,
+    rehash: bool = False,
+    paranoid: float = 0,
+    jobs: int = 0,
+    resume: bool = False,
+) except -1:
     """Create a backup based on he yaml file config."""
 
     # Take actions
     if config.interpreter is not None:
         vCall(config.verbose, "Interpreter:create_backup")
-        created: Optional[bool] = config.interpreter.create_backup(config.yaml, project)
+        with RepositoryLock(config.context, True, config.verbose):
+            created: Optional[bool] = config.interpreter.create_backup(
+                config.yaml, project, rehash, paranoid, jobs, resume
+            )
         vResponse(config.verbose, "Interpreter:create_backup", created)
         if created is True:
             return True
@@ -79,7 +100,15 @@ cpdef bint backup(config: Config, project: str):
         sys.exit(1)
 
 cpdef bint restore(
-    config: Config, project: str, location: str, job: int, clear_location: bool, force: bool
+    config: Config,
+    project: str,
+    location: str,
+    job: int,
+    clear_location: bool,
+    force: bool,
+    jobs: int = 0,
+    sync: bool = False,
+    paths: tuple = (),
 ):
     """Create a backup based on he yaml file config."""
 
@@ -89,19 +118,20 @@ cpdef bint restore(
         if clear_location:
             restored_backup_dir = str(f"{config.context}/{location}")
             for f in os.listdir(restored_backup_dir):
-                if Path.is_dir(Path(f)):
+                if Path.is_dir(Path(os.path.join(restored_backup_dir, f))):
                     if f == ".runup":
                         continue
-                    rmtree(f)
+                    rmtree(os.path.join(restored_backup_dir, f))
                 else:
                     if f == "runup.yaml":
                         continue
                     os.remove(os.path.join(restored_backup_dir, f))
 
         vCall(config.verbose, "Interpreter:restore_backup")
-        restored: bool = config.interpreter.restore_backup(
-            config.yaml, project, location, job, force
-        )
+        with RepositoryLock(config.context, False, config.verbose):
+            restored: bool = config.interpreter.restore_backup(
+                config.yaml, project, location, job, force, jobs, sync, list(paths)
+            )
         vResponse(config.verbose, "Interpreter:restore_backup", restored)
         if restored is None:
             return False
@@ -109,4 +139,139 @@ cpdef bint restore(
             return True
     else:
         # click.secho('Interpreter not detected on backup restore.', fg="red")
-        sys.exit(0)
\ No newline at end of file
+        sys.exit(0)
+
+
+cpdef bint export(config: Config, project: str, job: int, fmt: str, output):
+    """Write a backup of a project as a single archive."""
+
+    # Take actions
+    if config.interpreter is not None:
+        vCall(config.verbose, "Interpreter:export_backup")
+        with RepositoryLock(config.context, False, config.verbose):
+            exported: bool = config.interpreter.export_backup(config.yaml, project, job, fmt, output)
+        vResponse(config.verbose, "Interpreter:export_backup", exported)
+        return exported
+    else:
+        sys.exit(1)
+
+
+cpdef bint prune(
+    config: Config,
+    project: str,
+    keep_last: int,
+    keep_daily: int,
+    keep_weekly: int,
+    dry_run: bool = False,
+):
+    """Delete the jobs not kept by a retention policy."""
+
+    # Take actions
+    if config.interpreter is not None:
+        vCall(config.verbose, "Interpreter:prune_backups")
+        with RepositoryLock(config.context, not dry_run, config.verbose):
+            pruned: bool = config.interpreter.prune_backups(
+                config.yaml, project, keep_last, keep_daily, keep_weekly, dry_run
+            )
+        vResponse(config.verbose, "Interpreter:prune_backups", pruned)
+        return pruned
+    else:
+        sys.exit(1)
+
+
+cpdef bint watch(config: Config, project: str, timeout: float = 0):
+    """Record the changes of the projects, so backups only visit what changed."""
+
+    # Stop cleanly when asked to
+    signal.signal(signal.SIGTERM, _interrupt)
+
+    # Take actions
+    if config.interpreter is not None:
+        vCall(config.verbose, "Interpreter:watch_projects")
+        watched: bool = config.interpreter.watch_projects(config.yaml, project, timeout)
+        vResponse(config.verbose, "Interpreter:watch_projects", watched)
+        return watched
+    else:
+        sys.exit(1)
+
+
+cpdef bint jobs(config: Config, project: str):
+    """Show the summary of the jobs."""
+
+    # Take actions
+    if config.interpreter is not None:
+        vCall(config.verbose, "Interpreter:list_jobs")
+        with RepositoryLock(config.context, False, config.verbose):
+            listed: bool = config.interpreter.list_jobs(config.yaml, project)
+        vResponse(config.verbose, "Interpreter:list_jobs", listed)
+        return listed
+    else:
+        sys.exit(1)
+
+
+cpdef bint stats(config: Config, project: str):
+    """Show the totals of the jobs of the projects."""
+
+    # Take actions
+    if config.interpreter is not None:
+        vCall(config.verbose, "Interpreter:show_stats")
+        with RepositoryLock(config.context, False, config.verbose):
+            shown: bool = config.interpreter.show_stats(config.yaml, project)
+        vResponse(config.verbose, "Interpreter:show_stats", shown)
+        return shown
+    else:
+        sys.exit(1)
+
+
+cpdef bint ls(config: Config, project: str, job: int, patterns: tuple, details: bool = False):
+    """Show the files of a job."""
+
+    # Take actions
+    if config.interpreter is not None:
+        vCall(config.verbose, "Interpreter:list_files")
+        with RepositoryLock(config.context, False, config.verbose):
+            listed: bool = config.interpreter.list_files(
+                config.yaml, project, job, list(patterns), details
+            )
+        vResponse(config.verbose, "Interpreter:list_files", listed)
+        return listed
+    else:
+        sys.exit(1)
+
+
+cpdef bint diff(config: Config, project: str, old_job: int, new_job: int):
+    """Show the differences between two jobs."""
+
+    # Take actions
+    if config.interpreter is not None:
+        vCall(config.verbose, "Interpreter:compare_jobs")
+        with RepositoryLock(config.context, False, config.verbose):
+            compared: bool = config.interpreter.compare_jobs(config.yaml, project, old_job, new_job)
+        vResponse(config.verbose, "Interpreter:compare_jobs", compared)
+        return compared
+    else:
+        sys.exit(1)
+
+
+cpdef bint verify(
+    config: Config, project: str, job: int, sample: float = 0, time_limit: float = 0, workers: int = 0
+):
+    """Check the stored contents against their signatures."""
+
+    # Take actions
+    if config.interpreter is not None:
+        vCall(config.verbose, "Interpreter:verify_backups")
+        # Exclusive: when every content was last verified is written to the DB
+        with RepositoryLock(config.context, True, config.verbose):
+            verified: bool = config.interpreter.verify_backups(
+                config.yaml, project, job, sample, time_limit, workers
+            )
+        vResponse(config.verbose, "Interpreter:verify_backups", verified)
+        return verified
+    else:
+        sys.exit(1)
+
+
+def _interrupt(signum, frame):
+    """Turn a signal into a `KeyboardInterrupt`."""
+    raise KeyboardInterrupt()
@@ -0,0 +1,28 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+cdef class StatCache:
+
+    cdef str _dbname
+    cdef bint _verbose
+    cdef _conn
+    cdef list _pending
+    cdef long _job_start
+
+    cpdef void open(self)
+
+    cpdef void close(self)
+
+    cdef _flush(self)
+
+    cdef lookup(self, str project, str path, stat_result)
+
+    cdef void store(self, str project, str path, stat_result, tuple signature, int file_id)
+
+    cpdef void remap(self, list moved)
+
+    cpdef void forget_missing(self, str dbname)
@@ -0,0 +1,211 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+from pathlib import Path
+import sqlite3
+from sqlite3 import Error
+import time
+
+# 3rd Party
+import click
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.utils cimport vInfo
+
+
+# Bump this number every time the layout of the cache changes.
+# The cache is disposable, so an outdated cache is dropped and
+# rebuilt on the next backup instead of being migrated.
+CACHE_VERSION = 2
+
+# Entries kept in memory before they are written
+BATCH_SIZE = 10000
+
+# Files modified less than this number of seconds before the job
+# started are not cached, since a later write inside the same
+# timestamp granularity would not be detected ("racy" entries).
+RACY_WINDOW = 2
+
+
+cdef class StatCache:
+    """
+    Persistent cache of the stat information of the backed up files.
+
+    The cache lives in `.runup/statcache.db`, next to `runup.db`,
+    and maps the path of a file inside a project to the tuple
+    (size, mtime_ns, inode, ctime_ns) it had when it was hashed,
+    together with its signature and the `file_id` of the row that
+    holds its content. When the tuple still matches, the file is
+    known to be unchanged and hashing it again can be skipped.
+    """
+
+    def __init__(self, context: Path, bint verbose):
+
+        self._dbname = str(context) + "/.runup/statcache.db"
+        self._verbose = verbose
+        self._conn = None
+        self._pending = []
+        self._job_start = int(time.time())
+
+    cpdef void open(self):
+        """Open the cache, creating (or rebuilding) it if needed."""
+
+        vInfo(self._verbose, "Opening stat cache: %s", self._dbname)
+
+        try:
+            self._conn = sqlite3.connect(self._dbname, check_same_thread=False)
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != CACHE_VERSION:
+                vInfo(self._verbose, "Rebuilding outdated stat cache")
+                self._conn.execute("DROP TABLE IF EXISTS `stat_cache`")
+                self._conn.execute("""
+                    CREATE TABLE `stat_cache` (
+                        `project` TEXT NOT NULL,
+                        `path` TEXT NOT NULL,
+                        `size` INTEGER NOT NULL,
+                        `mtime_ns` INTEGER NOT NULL,
+                        `inode` INTEGER NOT NULL,
+                        `ctime_ns` INTEGER NOT NULL,
+                        `signature` TEXT NOT NULL,
+                        `file_id` INTEGER NOT NULL,
+                        PRIMARY KEY (`project`, `path`)
+                    ) WITHOUT ROWID;
+                """)
+                self._conn.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+                self._conn.commit()
+        except Error as e:
+            click.echo(e)
+            self._conn = None
+
+        self._job_start = int(time.time())
+
+    cpdef void close(self):
+        """Write the pending entries and close the cache."""
+
+        if self._conn is None:
+            return
+
+        try:
+            self._flush()
+            self._conn.commit()
+        except Error as e:
+            click.echo(e)
+        finally:
+            self._pending = []
+            self._conn.close()
+            self._conn = None
+
+    cdef _flush(self):
+        """Write the pending entries (they are committed on close)."""
+
+        if len(self._pending) > 0:
+            vInfo(self._verbose, "Updating %s stat cache entries", len(self._pending))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO stat_cache " + \
+                "(project, path, size, mtime_ns, inode, ctime_ns, signature, file_id) " + \
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self._pending,
+            )
+            self._pending = []
+
+    cdef lookup(self, str project, str path, stat_result):
+        """
+        Find a file in the cache.
+
+        Returns a tuple `(signature, file_id)` when the stat
+        information of the file has not changed, otherwise `None`.
+        """
+
+        if self._conn is None:
+            return None
+
+        row = self._conn.execute(
+            "SELECT size, mtime_ns, inode, ctime_ns, signature, file_id " + \
+            "FROM stat_cache WHERE project = ? AND path = ?",
+            (project, path),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        if (
+            row[0] != stat_result.st_size
+            or row[1] != stat_result.st_mtime_ns
+            or row[2] != stat_result.st_ino
+            or row[3] != stat_result.st_ctime_ns
+        ):
+            return None
+
+        return tuple(row[4].split(" ")), row[5]
+
+    cdef void store(self, str project, str path, stat_result, tuple signature, int file_id):
+        """Queue a cache entry to be written when the cache is closed."""
+
+        if self._conn is None:
+            return
+
+        # Racy entries: The file could still change without changing its stat info
+        if stat_result.st_mtime_ns // 1000000000 >= self._job_start - RACY_WINDOW:
+            vInfo(self._verbose, "Not caching recently modified file: %s", path)
+            return
+
+        self._pending.append((
+            project,
+            path,
+            stat_result.st_size,
+            stat_result.st_mtime_ns,
+            stat_result.st_ino,
+            stat_result.st_ctime_ns,
+            " ".join(signature),
+            file_id,
+        ))
+
+        if len(self._pending) >= BATCH_SIZE:
+            try:
+                self._flush()
+            except Error as e:
+                click.echo(e)
+
+    cpdef void remap(self, list moved):
+        """Point the entries to new rows, `moved` being a list of `(new_file_id, old_file_id)`."""
+
+        if self._conn is None or len(moved) == 0:
+            return
+
+        vInfo(self._verbose, "Remapping %s stat cache entries", len(moved))
+
+        try:
+            self._conn.executemany(
+                "UPDATE stat_cache SET file_id = ? WHERE file_id = ?",
+                moved,
+            )
+        except Error as e:
+            click.echo(e)
+
+    cpdef void forget_missing(self, str dbname):
+        """Drop the entries whose `file_id` no longer exists in the database `dbname`."""
+
+        if self._conn is None:
+            return
+
+        vInfo(self._verbose, "Dropping stale stat cache entries")
+
+        try:
+            self._flush()
+            self._conn.commit()
+            self._conn.execute("ATTACH DATABASE ? AS runup", (dbname,))
+            self._conn.execute(
+                "DELETE FROM stat_cache WHERE file_id NOT IN (SELECT file_id FROM runup.files)"
+            )
+            self._conn.commit()
+            self._conn.execute("DETACH DATABASE runup")
+        except Error as e:
+            click.echo(e)
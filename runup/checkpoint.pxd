@@ -0,0 +1,30 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+cdef list _entry(zinfo)
+
+cdef _zinfo(list entry)
+
+cpdef recover_zip(str path, long long offset, list entries)
+
+
+cdef class CheckpointJournal:
+
+    cdef str _path
+    cdef bint _verbose
+    cdef _file
+    cdef int _written
+
+    cpdef dict last(self)
+
+    cpdef open(self, bint resume)
+
+    cpdef append(self, int last_file, int last_chunk, long long stored, double elapsed, my_zip)
+
+    cpdef close(self)
+
+    cpdef remove(self)
@@ -0,0 +1,175 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import json
+import os
+import zipfile
+
+# 3rd Party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.utils cimport vInfo
+
+
+cdef list _entry(zinfo):
+    """What the central directory of a zip needs to know of an entry."""
+
+    return [
+        zinfo.filename,
+        zinfo.header_offset,
+        zinfo.CRC,
+        zinfo.compress_size,
+        zinfo.file_size,
+        zinfo.compress_type,
+        list(zinfo.date_time),
+        zinfo.external_attr,
+        zinfo.flag_bits,
+        zinfo.create_system,
+        zinfo.create_version,
+        zinfo.extract_version,
+        zinfo.extra.hex(),
+    ]
+
+
+cdef _zinfo(list entry):
+    """The `ZipInfo` of an entry, as written by `_entry()`."""
+
+    zinfo = zipfile.ZipInfo(entry[0], tuple(entry[6]))
+    (
+        zinfo.header_offset,
+        zinfo.CRC,
+        zinfo.compress_size,
+        zinfo.file_size,
+        zinfo.compress_type,
+    ) = entry[1:6]
+    (
+        zinfo.external_attr,
+        zinfo.flag_bits,
+        zinfo.create_system,
+        zinfo.create_version,
+        zinfo.extract_version,
+    ) = entry[7:12]
+    zinfo.extra = bytes.fromhex(entry[12])
+    return zinfo
+
+
+cpdef recover_zip(str path, long long offset, list entries):
+    """
+    Make a zip left unfinished by a crash valid again.
+
+    Everything after `offset` (the end of the last entry of `entries`
+    when they were recorded) is cut, and the central directory of
+    `entries` is written, so the zip holds exactly these entries.
+    """
+
+    with open(path, "r+b") as afile:
+        afile.truncate(offset)
+        afile.seek(offset)
+        archive = zipfile.ZipFile(afile, "w")
+        archive.filelist = entries
+        archive.NameToInfo = {zinfo.filename: zinfo for zinfo in entries}
+        archive.close()
+        afile.flush()
+        os.fsync(afile.fileno())
+
+
+cdef class CheckpointJournal:
+    """
+    Append-only journal of the checkpoints of a job.
+
+    It lives in `.runup/jobs/<job_id>.checkpoints` while the job is
+    written and is deleted once the job is finished. Every line is a
+    checkpoint, in JSON: the last file and chunk of the job whose data
+    was durable at that moment, the bytes stored and the seconds spent
+    so far and, for zips, the size of the zip and the entries written
+    since the previous checkpoint. A line cut by a crash is ignored.
+    """
+
+    def __init__(self, context, int job_id, bint verbose):
+
+        self._path = f"{context}/.runup/jobs/{job_id}.checkpoints"
+        self._verbose = verbose
+        self._file = None
+        self._written = 0
+
+    cpdef dict last(self):
+        """
+        The last checkpoint, `None` if there is none.
+
+        Its `entries` are the `ZipInfo` of all the entries written
+        until then, not only the ones of the last checkpoint.
+        """
+
+        cdef dict checkpoint = None
+        cdef list entries = []
+
+        if not os.path.exists(self._path):
+            return None
+
+        with open(self._path) as afile:
+            for line in afile:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                entries.extend(record["entries"])
+                checkpoint = record
+
+        if checkpoint is None:
+            return None
+
+        checkpoint["entries"] = [_zinfo(entry) for entry in entries]
+        self._written = len(entries)
+        return checkpoint
+
+    cpdef open(self, bint resume):
+        """Open the journal, emptying it unless the job is resumed."""
+
+        vInfo(self._verbose, "Opening checkpoint journal: %s", self._path)
+        self._file = open(self._path, "a" if resume else "w")
+        if not resume:
+            self._written = 0
+
+    cpdef append(self, int last_file, int last_chunk, long long stored, double elapsed, my_zip):
+        """
+        Record a checkpoint once the data of the job is durable.
+
+        `my_zip` is the zip of the job, `None` if it is stored in packs.
+        """
+
+        cdef list infolist = [] if my_zip is None else my_zip.infolist()
+
+        self._file.write(json.dumps({
+            "file": last_file,
+            "chunk": last_chunk,
+            "stored": stored,
+            "elapsed": elapsed,
+            "offset": None if my_zip is None else my_zip.fp.tell(),
+            "entries": [_entry(zinfo) for zinfo in infolist[self._written:]],
+        }) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._written = len(infolist)
+        vInfo(self._verbose, "Checkpoint: file %s, chunk %s", (last_file, last_chunk))
+
+    cpdef close(self):
+        """Close the journal, which is kept."""
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    cpdef remove(self):
+        """Delete the journal of a finished job."""
+
+        self.close()
+        if os.path.exists(self._path):
+            os.remove(self._path)
@@ -0,0 +1,19 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+cdef class Chunker:
+
+    cdef readonly Py_ssize_t min_size
+    cdef readonly Py_ssize_t avg_size
+    cdef readonly Py_ssize_t max_size
+    cdef unsigned long long _mask_s
+    cdef unsigned long long _mask_l
+
+    cdef Py_ssize_t cut(self, const unsigned char[:] data, Py_ssize_t start, Py_ssize_t end)
+
+
+cpdef tuple chunk_file(str fname, tuple algos, Chunker chunker)
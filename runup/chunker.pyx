@@ -0,0 +1,167 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# 3rd party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.utils cimport new_hasher
+
+
+# Values accepted by `project.*.chunking`
+CHUNKING_MODES = ("none", "cdc")
+
+# Files smaller than this are never chunked
+CHUNKING_MIN_FILE_SIZE = 8 * 1024 * 1024
+
+# Random values of the gear hash, one per byte value
+cdef unsigned long long GEAR[256]
+
+
+cdef void _init_gear():
+    """Fill the gear table with a fixed pseudo-random sequence (splitmix64)."""
+
+    cdef unsigned long long state = 0x52554E5550434443ULL  # "RUNUPCDC"
+    cdef unsigned long long z
+    cdef int i
+
+    for i in range(256):
+        state += 0x9E3779B97F4A7C15ULL
+        z = state
+        z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL
+        z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL
+        GEAR[i] = z ^ (z >> 31)
+
+
+_init_gear()
+
+
+cdef unsigned long long _high_mask(int bits):
+    """Mask of the `bits` most significant bits."""
+    return ((1ULL << bits) - 1) << (64 - bits)
+
+
+cdef class Chunker:
+    """
+    Content-defined chunker (FastCDC).
+
+    Cuts the data where a rolling gear hash of the last bytes matches
+    a mask, so the boundaries depend on the content and not on the
+    offsets: inserting or removing bytes only changes the chunks around
+    the edit. Before the average size a harder mask is used and after
+    it an easier one, which keeps the chunk sizes close to the average.
+    """
+
+    def __init__(
+        self,
+        Py_ssize_t min_size = 256 * 1024,
+        Py_ssize_t avg_size = 1024 * 1024,
+        Py_ssize_t max_size = 4 * 1024 * 1024,
+    ):
+        cdef int bits = avg_size.bit_length() - 1
+
+        if not 0 < min_size <= avg_size <= max_size:
+            raise ValueError("Chunk sizes must satisfy 0 < min <= avg <= max")
+
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        self._mask_s = _high_mask(bits + 2)
+        self._mask_l = _high_mask(max(bits - 2, 1))
+
+    cdef Py_ssize_t cut(self, const unsigned char[:] data, Py_ssize_t start, Py_ssize_t end):
+        """Length of the chunk starting at `start`, looking no further than `end`."""
+
+        cdef Py_ssize_t length = end - start
+        cdef Py_ssize_t normal
+        cdef Py_ssize_t i
+        cdef unsigned long long fp = 0
+
+        if length <= self.min_size:
+            return length
+
+        if length > self.max_size:
+            length = self.max_size
+        normal = self.avg_size if length > self.avg_size else length
+
+        i = self.min_size
+        while i < normal:
+            fp = (fp << 1) + GEAR[data[start + i]]
+            if not (fp & self._mask_s):
+                return i + 1
+            i += 1
+
+        while i < length:
+            fp = (fp << 1) + GEAR[data[start + i]]
+            if not (fp & self._mask_l):
+                return i + 1
+            i += 1
+
+        return length
+
+    def chunks(self, afile):
+        """
+        Iterate the chunks of an open binary file as `(offset, data)`.
+
+        `data` is a memoryview of an internal buffer: it is only valid
+        until the next iteration.
+        """
+
+        cdef bytearray buffer = bytearray(self.max_size * 4)
+        cdef const unsigned char[:] data = buffer
+        cdef Py_ssize_t pos = 0
+        cdef Py_ssize_t filled = 0
+        cdef Py_ssize_t length
+        cdef long long offset = 0
+        cdef bint eof = False
+
+        view = memoryview(buffer)
+
+        while True:
+            # Keep at least one maximum chunk in the buffer
+            if not eof and filled - pos < self.max_size:
+                buffer[:filled - pos] = buffer[pos:filled]
+                filled -= pos
+                pos = 0
+                while not eof and filled < len(buffer):
+                    length = afile.readinto(view[filled:])
+                    if length == 0:
+                        eof = True
+                    filled += length
+
+            if pos >= filled:
+                return
+
+            length = self.cut(data, pos, filled)
+            yield offset, view[pos:pos + length]
+            pos += length
+            offset += length
+
+
+cpdef tuple chunk_file(str fname, tuple algos, Chunker chunker):
+    """
+    Split a file into chunks, computing its signature on the way.
+
+    Returns a tuple `(signature, chunks)` where `chunks` is a list of
+    `(digest, offset, size)`. Chunks are identified by the first digest
+    of the repository. Only metadata is kept, so files of any size fit.
+    """
+
+    cdef list hashers = [new_hasher(algo) for algo in algos]
+    cdef list chunks = []
+
+    with open(fname, "rb", buffering=0) as afile:
+        for offset, data in chunker.chunks(afile):
+            for hasher in hashers:
+                hasher.update(data)
+            chunk_hasher = new_hasher(algos[0])
+            chunk_hasher.update(data)
+            chunks.append((chunk_hasher.hexdigest(), offset, len(data)))
+
+    return tuple([hasher.hexdigest() for hasher in hashers]), chunks
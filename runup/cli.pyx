@@ -6,7 +6,7 @@ import os
 from pathlib import Path
 from shutil import rmtree
 import sys
-from typing import Dict, Optional, Union, Any
+from typing import Dict, Optional, Tuple, Union, Any
 
 # 3rd Party
 import click
@@ -18,8 +18,10 @@ pyximport.install()
 from runup import actions
 from runup.config cimport Config
 from runup.editor import Editor
+from runup.export import EXPORT_FORMATS
 from runup.interpreter cimport Interpreter
 from runup.utils cimport vCall, vResponse
+from runup.utils import DEFAULT_STORAGE, STORAGE_BACKENDS, SUPPORTED_DIGESTS
 from runup.version import RUNUP_VERSION
 
 
@@ -37,39 +39,92 @@ pass_config = click.make_pass_decorator(Config, ensure=True)
 @click.option(
     "--verbose", is_flag=True, help="Show more information about the internal process."
 )
+@click.option(
+    "--trace",
+    type=click.Path(dir_okay=False, writable=True),
+    default="",
+    help="File where the counters and the time spent in every stage are written: "
+    + "as JSON lines, or for Prometheus if it ends with `.prom`.",
+)
 @click.version_option(version=RUNUP_VERSION, prog_name="RunUp")
 @pass_config
-def cli(config: Config, context: str, verbose: bint):
+def cli(config: Config, context: str, verbose: bint, trace: str):
     """Common CLI actions."""
 
     # Take action
     actions.set_config(
         config=config,
         context=context,
-        verbose=verbose
+        verbose=verbose,
+        trace=trace,
     )
 
 @cli.command()
+@click.option(
+    "-d",
+    "--digest",
+    type=click.Choice(SUPPORTED_DIGESTS),
+    multiple=True,
+    help="Digest used to sign the files. Can be used multiple times. "
+    + "Default: sha256 and sha512.",
+)
+@click.option(
+    "--storage",
+    type=click.Choice(STORAGE_BACKENDS),
+    default=DEFAULT_STORAGE,
+    help="Where the content of the files is stored: one zip per job "
+    + "or content-addressed packs. Default: zip.",
+)
 @pass_config
-def init(config: Config):
+def init(config: Config, digest: Tuple[str, ...], storage: str):
     """Initialize the backup system."""
 
     # Take action
-    result = actions.init(config)
+    result = actions.init(config, tuple(digest), storage)
     if result: 
         click.secho("RunUp has been initialized successfully.", fg="green")
 
 
 @cli.command()
 @click.argument("project", type=str, default="")
+@click.option(
+    "--rehash",
+    is_flag=True,
+    help="Hash every file, even if the stat cache says it has not changed.",
+)
+@click.option(
+    "--paranoid",
+    type=click.FloatRange(0, 100),
+    default=0,
+    help="Percentage of the unchanged files to be hashed anyway "
+    + "to confirm the stat cache is right.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(0),
+    default=0,
+    help="Number of threads used to hash and compress the files. "
+    + "Zero (default) to use `workers` from the YAML file or the number of CPUs.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Go on with the interrupted job of every project, "
+    + "from its last checkpoint, instead of starting a new one.",
+)
 @pass_config
-def backup(config: Config, project: str):
+def backup(config: Config, project: str, rehash: bool, paranoid: float, jobs: int, resume: bool):
     """Create a backup based on he yaml file config."""
 
     # Take action
     result = actions.backup(
         config=config,
-        project=project
+        project=project,
+        rehash=rehash,
+        paranoid=paranoid,
+        jobs=jobs,
+        resume=resume,
     )
     if result is True:
         click.secho("New backup created.", fg="green")
@@ -112,9 +167,38 @@ def editor(config: Config):
     is_flag=True,
     help="Make the restore without asking a confirmation.",
 )
+@click.option(
+    "--sync",
+    is_flag=True,
+    help="Only write the files that differ from the backup and delete "
+    + "the files that are not part of it.",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(0),
+    default=0,
+    help="Number of threads used to extract the files. "
+    + "Zero (default) to use `workers` from the YAML file or the number of CPUs.",
+)
+@click.option(
+    "--path",
+    "paths",
+    type=str,
+    multiple=True,
+    help="Only restore the files that match this pattern (e.g. 'etc/**'). "
+    + "Can be used multiple times.",
+)
 @pass_config
 def restore(
-    Config config, project: str, location: str, job: int, clear_location: bool, force: bool
+    Config config,
+    project: str,
+    location: str,
+    job: int,
+    clear_location: bool,
+    force: bool,
+    sync: bool,
+    jobs: int,
+    paths: tuple,
 ):
     """Create a backup based on he yaml file config."""
 
@@ -125,11 +209,222 @@ def restore(
         location=location, 
         job=job, 
         clear_location=clear_location, 
-        force=force
+        force=force,
+        jobs=jobs,
+        sync=sync,
+        paths=paths,
     )
     if result is False:
         click.secho("The backup has NOT been restored.", fg="red")
 
 
+
+@cli.command()
+@click.argument("project", type=str)
+@click.argument("output", type=click.File("wb"), default="-")
+@click.option(
+    "-j",
+    "--job",
+    type=int,
+    default=0,
+    help="Number of the job to be exported. Zero (default) to export the latest job.",
+)
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(list(EXPORT_FORMATS.keys())),
+    default="tar",
+    help="Format of the archive. Default: tar.",
+)
+@pass_config
+def export(config: Config, project: str, output, job: int, fmt: str):
+    """Write a backup as a single archive to OUTPUT (default: stdout)."""
+
+    # Take action
+    result = actions.export(
+        config=config,
+        project=project,
+        job=job,
+        fmt=fmt,
+        output=output,
+    )
+    if result is False:
+        click.secho("The backup has NOT been exported.", fg="red", err=True)
+
+
+@cli.command()
+@click.argument("project", type=str, default="")
+@click.option(
+    "--keep-last",
+    type=click.IntRange(0),
+    default=0,
+    help="Number of most recent jobs to keep.",
+)
+@click.option(
+    "--keep-daily",
+    type=click.IntRange(0),
+    default=0,
+    help="Number of days to keep the last job of.",
+)
+@click.option(
+    "--keep-weekly",
+    type=click.IntRange(0),
+    default=0,
+    help="Number of weeks to keep the last job of.",
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="Only show the jobs that would be deleted.",
+)
+@pass_config
+def prune(
+    config: Config,
+    project: str,
+    keep_last: int,
+    keep_daily: int,
+    keep_weekly: int,
+    dry_run: bool,
+):
+    """Delete the old jobs and the content that only they use."""
+
+    # Take action
+    result = actions.prune(
+        config=config,
+        project=project,
+        keep_last=keep_last,
+        keep_daily=keep_daily,
+        keep_weekly=keep_weekly,
+        dry_run=dry_run,
+    )
+    if result is False:
+        click.secho("The backups have NOT been pruned.", fg="red")
+
+
+@cli.command()
+@click.argument("project", type=str, default="")
+@click.option(
+    "--timeout",
+    type=click.FloatRange(0),
+    default=0,
+    help="Stop after this number of seconds. Zero (default) to run until interrupted.",
+)
+@pass_config
+def watch(config: Config, project: str, timeout: float):
+    """Record the changes of the projects, so backups only visit what changed (Linux)."""
+
+    # Take action
+    result = actions.watch(config=config, project=project, timeout=timeout)
+    if result is False:
+        click.secho("The projects are NOT being watched.", fg="red")
+
+
+@cli.command()
+@click.argument("project", type=str, default="")
+@pass_config
+def jobs(config: Config, project: str):
+    """Show the summary of the jobs of the projects."""
+
+    # Take action
+    result = actions.jobs(config=config, project=project)
+    if result is False:
+        click.secho("The jobs can NOT be shown.", fg="red")
+
+
+@cli.command()
+@click.argument("project", type=str, default="")
+@pass_config
+def stats(config: Config, project: str):
+    """Show the totals of the jobs of the projects: deduplication, compression and speed."""
+
+    # Take action
+    result = actions.stats(config=config, project=project)
+    if result is False:
+        click.secho("The statistics can NOT be shown.", fg="red")
+
+
+@cli.command()
+@click.argument("project", type=str)
+@click.argument("patterns", type=str, nargs=-1)
+@click.option(
+    "-j",
+    "--job",
+    type=int,
+    default=0,
+    help="Number of the job to be listed. Zero (default) to list the latest job.",
+)
+@click.option(
+    "-l",
+    "--long",
+    "details",
+    is_flag=True,
+    help="Show the size and the digest of the files too.",
+)
+@pass_config
+def ls(config: Config, project: str, patterns: tuple, job: int, details: bool):
+    """List the files of a job, or only the ones matching PATTERNS (e.g. 'src/**/*.py')."""
+
+    # Take action
+    result = actions.ls(config=config, project=project, job=job, patterns=patterns, details=details)
+    if result is False:
+        click.secho("The files can NOT be listed.", fg="red")
+
+
+@cli.command()
+@click.argument("project", type=str)
+@click.argument("old_job", type=int)
+@click.argument("new_job", type=int)
+@pass_config
+def diff(config: Config, project: str, old_job: int, new_job: int):
+    """Show the files added (+), removed (-) and modified (M) from OLD_JOB to NEW_JOB."""
+
+    # Take action
+    result = actions.diff(config=config, project=project, old_job=old_job, new_job=new_job)
+    if result is False:
+        click.secho("The jobs can NOT be compared.", fg="red")
+
+
+@cli.command()
+@click.argument("project", type=str, default="")
+@click.option(
+    "--job",
+    type=int,
+    default=0,
+    help="Number of the job to be verified. Zero (default) to verify every job.",
+)
+@click.option(
+    "--sample",
+    type=click.FloatRange(0, 100),
+    default=0,
+    help="Percentage of the contents to be verified. Zero (default) to verify all of them.",
+)
+@click.option(
+    "--time-limit",
+    type=click.FloatRange(0),
+    default=0,
+    help="Seconds after which no more contents are verified; the next "
+    + "verification goes on with the rest. Zero (default) for no limit.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(0),
+    default=0,
+    help="Number of threads used to read and hash the contents. "
+    + "Zero (default) to use `workers` from the YAML file or the number of CPUs.",
+)
+@pass_config
+def verify(config: Config, project: str, job: int, sample: float, time_limit: float, jobs: int):
+    """Check that the stored contents still match their signatures."""
+
+    # Take action
+    result = actions.verify(
+        config=config, project=project, job=job, sample=sample, time_limit=time_limit, workers=jobs
+    )
+    if result is True:
+        click.secho("The backups are intact.", fg="green")
+    else:
+        click.secho("The backups are NOT intact.", fg="red")
+
 if __name__ == "__main__":
     cli()
@@ -5,24 +5,128 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 
+# Own
+from runup.index cimport DigestIndex
+
+
 cdef class RunupDB:
 
     cdef str _dbname
+    cdef str _bloomname
     cdef bint _verbose
     cdef _conn
+    cdef bint _keep_open
+    cdef list _batch
+    cdef DigestIndex _index
+    cdef bint _schema_checked
+    cdef int _next_file_id
+    cdef int _uncommitted
+    cdef double _committed_at
+    cdef readonly int commits
+    cdef dict _jobs
+    cdef list _finished
+    cdef readonly tuple digests
+
+    cdef execute(self, str name, str query, tuple params=*)
+
+    cdef void executemany(self, str name, str query, list rows) except *
+
+    cdef void close_connection(self, bint commit) except *
+
+    cdef connect(self)
+
+    cdef _migrate(self)
+
+    cdef _migration(self, int version)
+
+    cpdef void open(self, bint index=*)
+
+    cdef void _load_index(self)
+
+    cpdef void close(self, bint commit=*) except *
+
+    cdef void flush(self) except *
 
-    cdef execute(self, str name, str query)
+    cdef void _queue_file(self, int file_id, int job_id, str path, tuple signature, file_loc, size) except *
 
-    cdef void close_connection(self, bint commit)
+    cdef bint checkpoint_due(self)
 
-    cdef void connect(self)
+    cdef checkpoint(self)
+
+    cdef tuple job_progress(self, int job_id)
 
     cdef void create_database(self)
 
-    cdef void insert_backup(self, str name)
+    cdef insert_backups(self, list names)
+
+    cdef str _columns(self, str table=*)
+
+    cdef str _hex_columns(self, str table)
+
+    cdef str _signature_match(self)
+
+    cdef tuple _binary(self, tuple signature)
+
+    cdef tuple insert_file(self, int job_id, str path_from_yaml_file, tuple signature, size)
 
-    cdef bint insert_file(self, int job_id, str path_from_pwd, str path_from_yaml_file)
+    cdef void insert_file_copy(
+        self, int job_id, str path_from_yaml_file, tuple signature, int file_loc, size
+    ) except *
+
+    cdef int _new_file_id(self)
     
     cdef int insert_job(self, str backup_name)
 
-    cdef select_job(self, int job, str project)
+    cdef void count_stored(self, int job_id, long long size)
+
+    cdef void finish_job(self, int job_id, double duration)
+
+    cdef list interrupted_jobs(self)
+
+    cdef int recover_job(self, int job_id, int last_file, int last_chunk)
+
+    cdef str job_state(self, int job_id)
+
+    cdef int resumable_job(self, str project)
+
+    cdef set resume_job(self, int job_id, long long stored)
+
+    cdef list select_summaries(self, str project)
+
+    cdef list select_totals(self, str project)
+
+    cdef int find_chunk(self, str digest)
+
+    cdef int insert_chunk(self, int job_id, str digest, long long size)
+
+    cdef void insert_file_chunks(self, int file_id, list chunk_ids) except *
+
+    cdef list select_chunks(self, int file_id)
+
+    cdef list select_contents(self, str project, int job_id)
+
+    cdef void mark_verified(self, list blob_ids, int when) except *
+
+    cdef int find_job(self, int job, str project)
+
+    cdef tuple _path_condition(self, list patterns)
+
+    cdef job_files(self, int job_id, list patterns)
+
+    cdef str _files_with_paths(self, bint paths_first)
+
+    cdef diff_jobs(self, int old_job, int new_job)
+
+    cdef select_job(self, int job, str project, list patterns=*)
+
+    cdef list select_jobs(self, str project)
+
+    cdef prune_jobs(self, list job_ids)
+
+    cdef list select_moved_files(self)
+
+    cpdef bint has_content(self, bytes key)
+
+    cdef int last_job(self, str project)
+
+    cdef int copy_files(self, int src_job, int dst_job, list dirty, list parents)
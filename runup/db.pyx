@@ -7,8 +7,10 @@
 
 # Built-in
 from pathlib import Path
+import re
 import sqlite3
 from sqlite3 import Error
+import sys
 import time
 from typing import Dict
 
@@ -22,7 +24,52 @@ pyximport.install()
 from libc.stdlib cimport malloc
 
 # Own
-from runup.utils cimport vInfo, hashfile
+from runup.index cimport BloomFilter, DigestIndex, load_bloom, signature_key
+from runup.scanner cimport path_filter
+from runup.utils cimport vInfo, read_repository_info
+
+
+# Files written to the DB at once
+BATCH_SIZE = 1000
+
+# Files written between two commits while the connection is held open,
+# and seconds between two commits if there are fewer files
+CHECKPOINT_SIZE = 50000
+CHECKPOINT_INTERVAL = 60
+
+# Version of the schema of `runup.db`, kept in its `user_version`.
+# Bump it, and add the step to `RunupDB._migration()`, every time the
+# schema changes: existing DBs are upgraded in place when opened.
+SCHEMA_VERSION = 6
+
+# Page cache of each connection (negative: in KiB) and bytes of the DB
+# read through a memory map instead of `read()` calls
+CACHE_SIZE = -64 * 1024
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Rows of each index sampled by `ANALYZE`, so it is fast on big DBs
+ANALYSIS_LIMIT = 1000
+
+# Repositories with up to this number of files load all the signatures
+# in memory at the start of the job. Bigger repositories use a Bloom
+# filter and search the DB for the signatures that are probably there.
+EAGER_INDEX_LIMIT = 1000000
+
+# First version of SQLite with `INSERT ... ON CONFLICT DO UPDATE`
+UPSERT_VERSION = (3, 24, 0)
+
+# Options of the SQL functions: SQLite optimizes the calls to the
+# deterministic ones, but Python can only declare them from 3.8 on
+FUNCTION_OPTIONS = {"deterministic": True} if sys.version_info >= (3, 8) else {}
+
+
+class SchemaError(Exception):
+    """The schema of the DB is not supported by this version of RunUp."""
+
+
+def _regexp(pattern, value):
+    """`REGEXP` operator of SQLite (compiled patterns are cached by `re`)."""
+    return value is not None and re.match(pattern, value) is not None
 
 
 cdef struct sql_dict_type:
@@ -35,25 +82,44 @@ cdef class RunupDB:
     Handle the database where the data is stored.
 
     The `.runup` files are SQLite3 databases containing the
-    path to the file, MD5 sign, SHA256 sign and ID of the backup
+    path to the file, its signature and ID of the backup
     where this file was found the first time.
+
+    Every content is a row of `blobs`, with its signature and size,
+    and every path a row of `paths`: the rows of `files` only hold
+    their ids. The signature is made of one binary column per digest
+    configured for the repository in `.runup/.version` (SHA256 and
+    SHA512 by default). Out of the DB, signatures are tuples of hex
+    strings, as returned by `hash_file()`.
     """
 
     def __init__(self, context: Path, bint verbose):
 
         self._dbname = str(context) + "/.runup/runup.db"
+        self._bloomname = str(context) + "/.runup/bloom"
         self._verbose = verbose
         self._conn = None
+        self._keep_open = False
+        self._batch = []
+        self._index = None
+        self._schema_checked = False
+        self._next_file_id = 0
+        self._uncommitted = 0
+        self._committed_at = 0
+        self.commits = 0
+        self._jobs = {}
+        self._finished = []
+        self.digests = read_repository_info(context)["digests"]
 
-    cdef execute(self, str name, str query):
+    cdef execute(self, str name, str query, tuple params = ()):
         """Execute a query."""
 
-        vInfo(self._verbose, "Executed query: " + name)
+        vInfo(self._verbose, "Executed query: %s", name)
 
         try:
             assert self._conn is not None
             c = self._conn.cursor()
-            c.execute(query)
+            c.execute(query, params)
             if query.lower().strip().startswith("insert into "):
                 return c.lastrowid
             elif query.lower().strip().startswith("insert or ignore into "):
@@ -63,175 +129,1262 @@ cdef class RunupDB:
             return c
         except Error as e:
             click.echo(e)
+
+    cdef void executemany(self, str name, str query, list rows) except *:
+        """Execute a query once per row."""
+
+        vInfo(self._verbose, "Executed query: %s (%s rows)", (name, len(rows)))
+
+        # Unlike `execute()`, errors are raised: the rows would be lost
+        assert self._conn is not None
+        self._conn.executemany(query, rows)
             
-    cdef void close_connection(self, bint commit):
-        """Close database connection"""
+    cdef void close_connection(self, bint commit) except *:
+        """
+        Close database connection.
+
+        Does nothing while the connection is held open by `open()`.
+        """
+
+        if self._keep_open:
+            return
 
-        vInfo(self._verbose, "Closing connection to: " + self._dbname)
-        if commit:
-            self._conn.commit()
-        self._conn.close()
+        vInfo(self._verbose, "Closing connection to: %s", self._dbname)
+        try:
+            if commit:
+                self._conn.commit()
+        finally:
+            # Whatever was not committed is rolled back
+            self._conn.close()
+            self._conn = None
         vInfo(self._verbose, "Connetion closed")
 
-    cdef void connect(self):
+    cdef connect(self):
         """Create a database connection to a `runup.db`."""
-        vInfo(self._verbose, "Creating connection to: " + self._dbname)
+
+        if self._conn is not None:
+            return
+
+        vInfo(self._verbose, "Creating connection to: %s", self._dbname)
 
         try:
-            self._conn = sqlite3.connect(self._dbname)
-            vInfo(self._verbose, "Database version: " + sqlite3.version)
+            # Shared by the threads of the projects of a backup, one at a time
+            self._conn = sqlite3.connect(self._dbname, check_same_thread=False)
+            vInfo(self._verbose, "Database version: %s", sqlite3.version)
+
+            # With WAL, readers don't block the writer and the other way
+            # around, and a commit only syncs the log: with `NORMAL`, a
+            # power loss can lose the last commits, never corrupt the DB
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("PRAGMA synchronous = NORMAL")
+            self._conn.execute(f"PRAGMA cache_size = {CACHE_SIZE}")
+            self._conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+            self._conn.create_function("regexp", 2, _regexp, **FUNCTION_OPTIONS)
         except Error as e:
             click.echo(e)
+            return
 
-    cdef void create_database(self):
-        """Create a database `runup.db`."""
+        if not self._schema_checked:
+            self._migrate()
+            self._schema_checked = True
 
-        
-        self.connect()
-        self.execute("Create backups", """
-            CREATE TABLE `backups` (
-                `name` TEXT PRIMARY KEY,
-                `running` INTEGER NOT NULL,
-                `execute` INTEGER NULL
-            );
-        """)
-        self.execute("Create jobs", """
-            CREATE TABLE `jobs` (
-                `job_id` INTEGER PRIMARY KEY,
-                `backup_name` TEXT NOT NULL,
-                `time_start` INTEGER NOT NULL,
-                `time_finish` INTEGER NULL,
-                `files_num` INTEGER NOT NULL,
-                FOREIGN KEY (`backup_name`)
-                REFERENCES `backups` (`backup_name`)
-                    ON UPDATE CASCADE
-                    ON DELETE CASCADE
-            );
-        """)
-        self.execute("Create files", """
-            CREATE TABLE `files` (
-                `file_id` INTEGER PRIMARY KEY,
-                `job_id` INTEGER NOT NULL,
-                `path` TEXT NOT NULL,
-                `sha256` TEXT NOT NULL,
-                `sha512` TEXT NOT NULL,
-                `file_loc` INTEGER NULL,
-                FOREIGN KEY (`job_id`)
-                    REFERENCES `jobs` (`job_id`)
-                        ON UPDATE CASCADE
-                        ON DELETE CASCADE,
-                FOREIGN KEY (`file_loc`)
-                    REFERENCES `jobs` (`file_loc`)
+    cdef _migrate(self):
+        """
+        Upgrade the schema of the DB to `SCHEMA_VERSION`.
+
+        Every step runs in its own transaction, along with the bump of
+        the version, so an interrupted upgrade goes on where it stopped.
+        DBs created before the schema was versioned are at version 0.
+        """
+
+        cdef int version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        cdef bint migrated = False
+
+        if version > SCHEMA_VERSION:
+            raise SchemaError(
+                f"The repository was created by a newer version of RunUp (schema {version})."
+            )
+
+        while version < SCHEMA_VERSION:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have upgraded it meanwhile
+                version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+                if version < SCHEMA_VERSION:
+                    vInfo(self._verbose, "Upgrading the database to schema %s", version + 1)
+                    self._migration(version + 1)
+                    version += 1
+                    self._conn.execute(f"PRAGMA user_version = {version}")
+                    migrated = True
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        # Statistics of the new indexes for the query planner
+        if migrated:
+            vInfo(self._verbose, "Analyzing the database")
+            self._conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+            self._conn.execute("ANALYZE")
+
+    cdef _migration(self, int version):
+        """Apply the step of the schema that leads to `version`."""
+
+        if version == 1:
+            # Initial schema. DBs at version 0 have part of it, depending
+            # on the version of RunUp that created them.
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS `backups` (
+                    `name` TEXT PRIMARY KEY,
+                    `running` INTEGER NOT NULL,
+                    `execute` INTEGER NULL
+                );
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS `jobs` (
+                    `job_id` INTEGER PRIMARY KEY,
+                    `backup_name` TEXT NOT NULL,
+                    `time_start` INTEGER NOT NULL,
+                    `time_finish` INTEGER NULL,
+                    `files_num` INTEGER NOT NULL,
+                    FOREIGN KEY (`backup_name`)
+                    REFERENCES `backups` (`backup_name`)
                         ON UPDATE CASCADE
                         ON DELETE CASCADE
-            );
-        """)
-        self.execute("Create signature index", """
-            CREATE INDEX `idx_signature` ON `files` (`sha256`, `sha512`);
-        """)
-        self.execute("Create job_id index", """
-        CREATE INDEX `idx_job_id` ON `files` (`job_id`);
-        """)
+                );
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS `files` (
+                    `file_id` INTEGER PRIMARY KEY,
+                    `job_id` INTEGER NOT NULL,
+                    `path` TEXT NOT NULL,
+                    """ + "".join([f"`{algo}` TEXT NOT NULL,\n" for algo in self.digests]) + """
+                    `file_loc` INTEGER NULL,
+                    FOREIGN KEY (`job_id`)
+                        REFERENCES `jobs` (`job_id`)
+                            ON UPDATE CASCADE
+                            ON DELETE CASCADE,
+                    FOREIGN KEY (`file_loc`)
+                        REFERENCES `jobs` (`file_loc`)
+                            ON UPDATE CASCADE
+                            ON DELETE CASCADE
+                );
+            """)
+            self._conn.execute("""
+                CREATE INDEX IF NOT EXISTS `idx_signature` ON `files` (""" + self._columns() + """);
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS `chunks` (
+                    `chunk_id` INTEGER PRIMARY KEY,
+                    `job_id` INTEGER NOT NULL,
+                    `digest` TEXT NOT NULL UNIQUE,
+                    `size` INTEGER NOT NULL,
+                    FOREIGN KEY (`job_id`)
+                        REFERENCES `jobs` (`job_id`)
+                            ON UPDATE CASCADE
+                            ON DELETE CASCADE
+                );
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS `file_chunks` (
+                    `file_id` INTEGER NOT NULL,
+                    `seq` INTEGER NOT NULL,
+                    `chunk_id` INTEGER NOT NULL,
+                    PRIMARY KEY (`file_id`, `seq`),
+                    FOREIGN KEY (`file_id`)
+                        REFERENCES `files` (`file_id`)
+                            ON UPDATE CASCADE
+                            ON DELETE CASCADE,
+                    FOREIGN KEY (`chunk_id`)
+                        REFERENCES `chunks` (`chunk_id`)
+                            ON UPDATE CASCADE
+                            ON DELETE CASCADE
+                ) WITHOUT ROWID;
+            """)
+            self._conn.execute("""
+                CREATE INDEX IF NOT EXISTS `idx_job_path` ON `files` (`job_id`, `path`);
+            """)
+
+        elif version == 2:
+            # The jobs of a project, newest first, without reading the table
+            self._conn.execute("""
+                CREATE INDEX `idx_backup_jobs` ON `jobs` (`backup_name`, `job_id`, `time_start`);
+            """)
+            # Copies of a content, looked up when the job that holds it is pruned
+            self._conn.execute("""
+                CREATE INDEX `idx_file_loc` ON `files` (`file_loc`) WHERE `file_loc` IS NOT NULL;
+            """)
+            # `idx_job_path` starts with `job_id` too
+            self._conn.execute("DROP INDEX IF EXISTS `idx_job_id`")
+
+        elif version == 3:
+            # Contents and paths are stored once, with binary digests,
+            # instead of in every row of every job
+            self._conn.execute("""
+                CREATE TABLE `blobs` (
+                    `blob_id` INTEGER PRIMARY KEY,
+                    """ + "".join([f"`{algo}` BLOB NOT NULL,\n" for algo in self.digests]) + """
+                    `size` INTEGER NULL
+                );
+            """)
+            self._conn.execute("""
+                CREATE UNIQUE INDEX `idx_blob_signature` ON `blobs` (""" + self._columns() + """);
+            """)
+            self._conn.execute("""
+                CREATE TABLE `paths` (
+                    `path_id` INTEGER PRIMARY KEY,
+                    `path` TEXT NOT NULL UNIQUE
+                );
+            """)
+            self._conn.execute("""
+                CREATE TABLE `files_v3` (
+                    `file_id` INTEGER PRIMARY KEY,
+                    `job_id` INTEGER NOT NULL,
+                    `path_id` INTEGER NOT NULL,
+                    `blob_id` INTEGER NOT NULL,
+                    `file_loc` INTEGER NULL,
+                    FOREIGN KEY (`job_id`)
+                        REFERENCES `jobs` (`job_id`)
+                            ON UPDATE CASCADE
+                            ON DELETE CASCADE,
+                    FOREIGN KEY (`path_id`)
+                        REFERENCES `paths` (`path_id`),
+                    FOREIGN KEY (`blob_id`)
+                        REFERENCES `blobs` (`blob_id`),
+                    FOREIGN KEY (`file_loc`)
+                        REFERENCES `files` (`file_id`)
+                );
+            """)
 
+            # SQLite has no `unhex()` before 3.41
+            self._conn.create_function("runup_unhex", 1, bytes.fromhex, **FUNCTION_OPTIONS)
+            self._conn.execute(
+                "INSERT OR IGNORE INTO blobs (" + self._columns() + ") " + \
+                "SELECT " + ", ".join([f"runup_unhex(`{algo}`)" for algo in self.digests]) + " " + \
+                "FROM files ORDER BY file_id"
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO paths (path) SELECT path FROM files ORDER BY file_id"
+            )
+            self._conn.execute(
+                "INSERT INTO files_v3 (file_id, job_id, path_id, blob_id, file_loc) " + \
+                "SELECT file_id, job_id, " + \
+                "(SELECT path_id FROM paths WHERE paths.path = files.path), " + \
+                "(SELECT blob_id FROM blobs WHERE " + \
+                " AND ".join([f"blobs.`{algo}` = runup_unhex(files.`{algo}`)" for algo in self.digests]) + \
+                "), file_loc FROM files"
+            )
+            self._conn.execute("DROP TABLE `files`")
+            self._conn.execute("ALTER TABLE `files_v3` RENAME TO `files`")
+
+            self._conn.execute("""
+                CREATE INDEX `idx_job_path` ON `files` (`job_id`, `path_id`);
+            """)
+            self._conn.execute("""
+                CREATE INDEX `idx_file_loc` ON `files` (`file_loc`) WHERE `file_loc` IS NOT NULL;
+            """)
+            # The rows that hold a content, and the ones that point to it
+            self._conn.execute("""
+                CREATE INDEX `idx_file_blob` ON `files` (`blob_id`);
+            """)
+
+        elif version == 4:
+            # Summary of every job, written when it finishes
+            for column in (
+                "`new_files` INTEGER NOT NULL DEFAULT 0",
+                "`new_bytes` INTEGER NULL",
+                "`deduped_bytes` INTEGER NULL",
+                "`stored_bytes` INTEGER NULL",
+                "`duration` REAL NULL",
+            ):
+                self._conn.execute("ALTER TABLE `jobs` ADD COLUMN " + column)
+            # Older jobs with files were finished; their sizes are unknown
+            self._conn.execute("""
+                UPDATE `jobs` SET
+                    `time_finish` = COALESCE(`time_finish`, `time_start`),
+                    `files_num` = (SELECT COUNT(*) FROM `files` WHERE `files`.`job_id` = `jobs`.`job_id`),
+                    `new_files` = (
+                        SELECT COUNT(*) FROM `files`
+                        WHERE `files`.`job_id` = `jobs`.`job_id` AND `files`.`file_loc` IS NULL
+                    )
+                WHERE EXISTS (SELECT 1 FROM `files` WHERE `files`.`job_id` = `jobs`.`job_id`);
+            """)
+
+        elif version == 5:
+            # `running` while a job is written, `interrupted` once the
+            # crash of its process has been cleaned up, then `finished`
+            self._conn.execute("""
+                ALTER TABLE `jobs` ADD COLUMN `state` TEXT NOT NULL DEFAULT 'finished';
+            """)
+            self._conn.execute("""
+                UPDATE `jobs` SET `state` = 'interrupted' WHERE `time_finish` IS NULL;
+            """)
+
+        elif version == 6:
+            # When every content was last verified (see `runup verify`)
+            self._conn.execute("""
+                ALTER TABLE `blobs` ADD COLUMN `verified` INTEGER NULL;
+            """)
+
+    cpdef void open(self, bint index=True):
+        """
+        Hold a connection open until `close()` is called.
+
+        All the writes done in between share the same transaction,
+        which is committed by `checkpoint()` and on close. The index
+        of signatures is only loaded if `index` is set.
+        """
+
+        self.connect()
+        self._keep_open = True
+        self._next_file_id = 0
+        self._uncommitted = 0
+        self._committed_at = time.monotonic()
+        self._finished = []
+        if index:
+            self._load_index()
+
+    cdef void _load_index(self):
+        """Prepare the index of signatures used to deduplicate the files of the job."""
+
+        cdef int max_id
+        cdef BloomFilter bloom
+
+        max_id = self.execute("Max file id", "SELECT COALESCE(MAX(file_id), 0) FROM files")[0][0]
+
+        if max_id <= EAGER_INDEX_LIMIT:
+            vInfo(self._verbose, "Loading signatures in memory")
+            self._index = DigestIndex(eager=True)
+            for row in self._conn.execute(
+                "SELECT files.file_id, " + self._columns("blobs") + " " + \
+                "FROM files JOIN blobs ON blobs.blob_id = files.blob_id " + \
+                "WHERE files.file_loc IS NULL ORDER BY files.file_id"
+            ):
+                self._index.add(b"".join(row[1:]), row[0], False)
+            return
+
+        bloom = load_bloom(self._bloomname)
+        if bloom is None or bloom.covered > max_id or bloom.items > bloom.capacity:
+            vInfo(self._verbose, "Building Bloom filter of signatures")
+            bloom = BloomFilter(2 * max_id)
+        if bloom.covered < max_id:
+            for row in self._conn.execute(
+                "SELECT " + self._columns("blobs") + " " + \
+                "FROM files JOIN blobs ON blobs.blob_id = files.blob_id " + \
+                "WHERE files.file_id > ? AND files.file_loc IS NULL",
+                (bloom.covered,)
+            ):
+                bloom.add(b"".join(row))
+            bloom.covered = max_id
+        self._index = DigestIndex(eager=False, bloom=bloom)
+
+    cpdef void close(self, bint commit=True) except *:
+        """
+        Write the pending files and close the connection.
+
+        If writing or committing them fails, everything since the last
+        commit is rolled back and the error raised.
+        """
+
+        if self._conn is None:
+            return
+
+        self._keep_open = False
+        try:
+            if commit:
+                self.flush()
+                self.executemany("Finish jobs",
+                    "UPDATE jobs SET time_finish = ?, files_num = ?, new_files = ?, new_bytes = ?, " + \
+                    "deduped_bytes = ?, stored_bytes = ?, duration = ?, state = 'finished' " + \
+                    "WHERE job_id = ?",
+                    self._finished
+                )
+                # Refresh the statistics that the writes made stale
+                self._conn.execute("PRAGMA optimize")
+            else:
+                self._conn.rollback()
+            self.close_connection(commit=commit)
+        except BaseException:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._index = None
+            raise
+        finally:
+            self._batch = []
+            self._finished = []
+
+        if commit and self._index is not None and self._index.bloom is not None:
+            self._index.bloom.covered = max(self._index.bloom.covered, self._next_file_id - 1)
+            self._index.bloom.save(self._bloomname)
+        self._index = None
+
+    cdef void flush(self) except *:
+        """Write the files waiting in the batch, with their new contents and paths."""
+
+        cdef dict blobs = {}
+
+        if len(self._batch) > 0:
+            for row in self._batch:
+                if blobs.get(row[3:-2]) is None:
+                    blobs[row[3:-2]] = row[-1]
+            if sqlite3.sqlite_version_info >= UPSERT_VERSION:
+                self.executemany("Insert blobs",
+                    "INSERT INTO blobs (" + self._columns() + ", size) " + \
+                    "VALUES (" + ", ".join(["?" for _ in self.digests]) + ", ?) " + \
+                    "ON CONFLICT (" + self._columns() + ") " + \
+                    "DO UPDATE SET size = COALESCE(blobs.size, excluded.size)",
+                    [signature + (size,) for signature, size in blobs.items()]
+                )
+            else:
+                self.executemany("Insert blobs",
+                    "INSERT OR IGNORE INTO blobs (" + self._columns() + ", size) " + \
+                    "VALUES (" + ", ".join(["?" for _ in self.digests]) + ", ?)",
+                    [signature + (size,) for signature, size in blobs.items()]
+                )
+                self.executemany("Size blobs",
+                    "UPDATE blobs SET size = ? WHERE size IS NULL AND " + self._signature_match(),
+                    [(size,) + signature for signature, size in blobs.items() if size is not None]
+                )
+            self.executemany("Insert paths",
+                "INSERT OR IGNORE INTO paths (path) VALUES (?)",
+                [(row[2],) for row in self._batch]
+            )
+            self.executemany("Insert files",
+                "INSERT INTO files (file_id, job_id, path_id, blob_id, file_loc) " + \
+                "VALUES (?, ?, (SELECT path_id FROM paths WHERE path = ?), " + \
+                "(SELECT blob_id FROM blobs WHERE " + self._signature_match() + "), ?)",
+                [row[:-1] for row in self._batch]
+            )
+            self._batch = []
+
+    cdef void _queue_file(self, int file_id, int job_id, str path, tuple signature, file_loc, size) except *:
+        """Add a file to the batch, writing it if the batch is full."""
+
+        self._batch.append(
+            (file_id, job_id, path) + self._binary(signature) + (file_loc, size)
+        )
+        self._uncommitted += 1
+
+        # Summary of the job: files, new files, new bytes, deduped bytes, stored bytes
+        counters = self._jobs.setdefault(job_id, [0, 0, 0, 0, 0])
+        counters[0] += 1
+        if file_loc is None:
+            counters[1] += 1
+            counters[2] += size or 0
+        else:
+            counters[3] += size or 0
+
+        if len(self._batch) >= BATCH_SIZE:
+            self.flush()
+
+    cdef bint checkpoint_due(self):
+        """If the files written since the last commit should be committed."""
+
+        return self._keep_open and (
+            self._uncommitted >= CHECKPOINT_SIZE
+            or (self._uncommitted > 0 and time.monotonic() - self._committed_at >= CHECKPOINT_INTERVAL)
+        )
+
+    cdef checkpoint(self):
+        """
+        Commit the files written so far, keeping the connection open.
+
+        The data of the files must be durable before, since a job
+        interrupted later goes on from what the DB holds.
+        """
+
+        vInfo(self._verbose, "Checkpoint")
+        self.flush()
+        self._conn.commit()
+        self._uncommitted = 0
+        self._committed_at = time.monotonic()
+        self.commits += 1
+
+    cdef tuple job_progress(self, int job_id):
+        """
+        What a job has written so far: `(last_file_id, last_chunk_id, stored_bytes)`.
+
+        Used by its checkpoints, once the data of these files and chunks is durable.
+        """
+
+        self.connect()
+        self.flush()
+        last_file = self.execute("Last file of the job",
+            "SELECT COALESCE(MAX(file_id), 0) FROM files WHERE job_id = ?", (job_id,)
+        )[0][0]
+        last_chunk = self.execute("Last chunk of the job",
+            "SELECT COALESCE(MAX(chunk_id), 0) FROM chunks WHERE job_id = ?", (job_id,)
+        )[0][0]
+        self.close_connection(commit=False)
+
+        return last_file, last_chunk, self._jobs.get(job_id, [0, 0, 0, 0, 0])[4]
+
+    cdef void create_database(self):
+        """Create a database `runup.db`."""
+
+        # Creating it is upgrading it from nothing
+        self.connect()
         self.close_connection(commit=True)
 
-    cdef void insert_backup(self, str name):
-        """Insert a backup"""
+    cdef insert_backups(self, list names):
+        """
+        Insert the backups that are not in the DB yet.
+
+        Being the first use of the DB by every command, it is where an
+        unsupported schema is reported.
+        """
 
         self.connect()
-        self.execute("Insert backup", 
+        self.executemany("Insert backups", 
             "INSERT OR IGNORE " + \
             "INTO backups (name, running, execute) " + \
-            "VALUES ('"+ name +"', 0, NULL)"
+            "VALUES (?, 0, NULL)",
+            [(name,) for name in names]
         )
         self.close_connection(commit=True)
 
-    cdef bint insert_file(self, int job_id, str path_from_pwd, str path_from_yaml_file):
+    cdef str _columns(self, str table=""):
+        """Columns of the signature, comma separated, optionally qualified by a table."""
+
+        if table != "":
+            table += "."
+        return ", ".join([f"{table}`{algo}`" for algo in self.digests])
+
+    cdef str _hex_columns(self, str table):
+        """Columns of the signature of a table, as lowercase hex strings."""
+        return ", ".join([f"lower(hex({table}.`{algo}`))" for algo in self.digests])
+
+    cdef str _signature_match(self):
+        """Condition matching the signature columns of `blobs` with as many parameters."""
+        return " AND ".join([f"blobs.`{algo}` = ?" for algo in self.digests])
+
+    cdef tuple _binary(self, tuple signature):
+        """Signature as stored in the DB, from its hex strings."""
+        return tuple([bytes.fromhex(digest) for digest in signature])
+
+    cdef tuple insert_file(self, int job_id, str path_from_yaml_file, tuple signature, size):
         """
         Insert a file into DB.
 
-        Returns a boolean indicatinf if the inserted
+        `size` is the size of the content, `None` for directories. Returns a tuple `(inserted_new, content_id)` where
+        `inserted_new` indicates if the content of the file is new
+        and `content_id` is the `file_id` of the row that holds it.
         """
 
-        cdef str sha256
-        cdef str sha512
         cdef bint inserted_new
-
-        sha256 = hashfile(path_from_pwd, b"sha256")
-        sha512 = hashfile(path_from_pwd, b"sha512")
+        cdef int content_id
+        cdef bytes key = signature_key(signature)
 
         self.connect()
 
-        # TODO: Do not execute this query if is a directory (empty sha256 and sha512)
-        result = self.execute("Search file: " + path_from_yaml_file, 
-            "SELECT file_id, sha256, sha512 " + \
-            "FROM files " + \
-            "WHERE sha256='"+sha256+"' AND sha512='"+sha512+"' " + \
-            "ORDER BY file_id ASC " + \
-            "LIMIT 1;"
-        )
+        if self._index is None:
+            self._index = DigestIndex(eager=False)
 
-        if len(result) == 0:
-            # Insert
-            self.execute("Insert new file: "+path_from_yaml_file, 
-                "INSERT INTO files (job_id, sha256, sha512, path) " + \
-                "VALUES ("+str(job_id)+", '"+sha256+"', '"+sha512+"', '"+path_from_yaml_file+"')"
+        content_id = self._index.get(key)
+
+        if content_id == 0 and self._index.needs_search(key):
+            # TODO: Do not execute this query if is a directory (empty signature)
+            result = self.execute("Search file: " + path_from_yaml_file, 
+                "SELECT MIN(files.file_id) " + \
+                "FROM blobs JOIN files ON files.blob_id = blobs.blob_id " + \
+                "WHERE " + self._signature_match() + ";",
+                self._binary(signature)
             )
+            if result[0][0] is not None:
+                content_id = result[0][0]
+                self._index.add(key, content_id, False)
+
+        if content_id == 0:
+            # Insert
+            content_id = self._new_file_id()
+            self._queue_file(content_id, job_id, path_from_yaml_file, signature, None, size)
+            self._index.add(key, content_id)
             inserted_new = True
         else:
             # Insert
-            self.execute("Insert existing file: "+path_from_yaml_file,
-                "INSERT INTO files (job_id, sha256, sha512, file_loc, path) " + \
-                "VALUES ("+str(job_id)+", '"+result[0][1]+"', '"+result[0][2]+"', "+str(result[0][0])+", '"+path_from_yaml_file+"')"
+            self._queue_file(
+                self._new_file_id(), job_id, path_from_yaml_file, signature, content_id, size
             )
             inserted_new = False
 
+        if not self._keep_open:
+            self.flush()
+            self._index = None
         self.close_connection(commit=True)
 
-        return inserted_new
+        return inserted_new, content_id
+
+    cdef void insert_file_copy(
+        self, int job_id, str path_from_yaml_file, tuple signature, int file_loc, size
+    ) except *:
+        """
+        Insert a file whose content is already stored.
+
+        Used when the signature of the file is already known (i.e.
+        from the stat cache), so the file is neither hashed nor searched.
+        """
+
+        self.connect()
+        self._queue_file(self._new_file_id(), job_id, path_from_yaml_file, signature, file_loc, size)
+        if not self._keep_open:
+            self.flush()
+        self.close_connection(commit=True)
+
+    cdef int _new_file_id(self):
+        """Reserve the id of the next file."""
+
+        if self._next_file_id == 0:
+            self._next_file_id = self.execute("Next file id",
+                "SELECT COALESCE(MAX(file_id), 0) + 1 FROM files"
+            )[0][0]
+
+        self._next_file_id += 1
+        return self._next_file_id - 1
 
     cdef int insert_job(self, str backup_name):
         """Insert a job"""
 
         cdef int id 
-        cdef str this_time 
-        
-        this_time = str(int(time.time()))
         
         self.connect()
         id = self.execute("Insert job", 
-            "INSERT INTO jobs (job_id, backup_name, time_start, time_finish, files_num)" + \
-            "VALUES (NULL, '" + backup_name + "', " + this_time + ", NULL, 0)"
+            "INSERT INTO jobs (job_id, backup_name, time_start, time_finish, files_num, state) " + \
+            "VALUES (NULL, ?, ?, NULL, 0, 'running')",
+            (backup_name, int(time.time()))
         )
         self.close_connection(commit=True)
 
         return id
 
-    cdef select_job(self, int job, str project):
-        """Select a job"""
+    cdef void count_stored(self, int job_id, long long size):
+        """Add the bytes written to the storage by a job to its summary."""
+        self._jobs.setdefault(job_id, [0, 0, 0, 0, 0])[4] += size
 
-        cdef str sql
+    cdef void finish_job(self, int job_id, double duration):
+        """
+        Mark a job as finished, with its summary.
+
+        The summary is counted while the files are inserted, so the
+        files are not read again. It is written by `close()`, in the
+        same transaction as the last files of every job of the backup:
+        a commit in between (`checkpoint()`) never makes a job finished
+        while another one could still lose the data it shares with it.
+        Jobs without a finish time were interrupted.
+        """
+
+        counters = self._jobs.pop(job_id, [0, 0, 0, 0, 0])
+        self._finished.append((int(time.time()), *counters, duration, job_id))
+
+    cdef list interrupted_jobs(self):
+        """
+        Jobs left `running` by a backup that crashed, as `(job_id, backup_name)`.
+
+        Backups hold the repository lock exclusively, so no other
+        process can be writing them.
+        """
+
+        self.connect()
+        rows = self.execute("Select running jobs",
+            "SELECT job_id, backup_name FROM jobs WHERE state = 'running' ORDER BY job_id"
+        )
+        self.close_connection(commit=False)
+
+        return [(job_id, name) for job_id, name in rows]
+
+    cdef int recover_job(self, int job_id, int last_file, int last_chunk):
+        """
+        Undo what an interrupted job wrote after its last checkpoint.
+
+        The files of the job after `last_file` and its chunks after
+        `last_chunk` may point to data that never reached the disk, so
+        they are deleted, and so are the files of other interrupted
+        jobs that depend on them. The job is left `interrupted`.
+        Returns the number of files of the job that are kept.
+        """
+
+        cdef int deleted = 1
+
+        self.connect()
+        self.execute("Delete files after the checkpoint",
+            "DELETE FROM files WHERE job_id = ? AND file_id > ?", (job_id, last_file)
+        )
+        self.execute("Delete chunks after the checkpoint",
+            "DELETE FROM chunks WHERE job_id = ? AND chunk_id > ?", (job_id, last_chunk)
+        )
+        # The copies of the deleted contents, and the files made of deleted chunks
+        while deleted > 0:
+            deleted = self._conn.execute(
+                "DELETE FROM files WHERE file_loc IS NOT NULL " + \
+                "AND file_loc NOT IN (SELECT file_id FROM files)"
+            ).rowcount
+            deleted += self._conn.execute(
+                "DELETE FROM files WHERE file_id IN (SELECT file_id FROM file_chunks " + \
+                "WHERE chunk_id NOT IN (SELECT chunk_id FROM chunks))"
+            ).rowcount
+            self._conn.execute(
+                "DELETE FROM file_chunks WHERE file_id NOT IN (SELECT file_id FROM files)"
+            )
+        self.execute("Interrupt job",
+            "UPDATE jobs SET state = 'interrupted' WHERE job_id = ?", (job_id,)
+        )
+        kept = self.execute("Count kept files",
+            "SELECT COUNT(*) FROM files WHERE job_id = ?", (job_id,)
+        )[0][0]
+        self.close_connection(commit=True)
+
+        return kept
+
+    cdef str job_state(self, int job_id):
+        """The state of a job, or an empty string if there is no such job."""
+
+        self.connect()
+        rows = self.execute("Select job state", "SELECT state FROM jobs WHERE job_id = ?", (job_id,))
+        self.close_connection(commit=False)
+
+        return rows[0][0] if len(rows) > 0 else ""
+
+    cdef int resumable_job(self, str project):
+        """The `job_id` of the latest job of a project if it was interrupted, otherwise zero."""
+
+        self.connect()
+        rows = self.execute("Select resumable job",
+            "SELECT job_id, state FROM jobs WHERE backup_name = ? ORDER BY job_id DESC LIMIT 1",
+            (project,)
+        )
+        self.close_connection(commit=False)
+
+        return rows[0][0] if len(rows) > 0 and rows[0][1] == "interrupted" else 0
+
+    cdef set resume_job(self, int job_id, long long stored):
+        """
+        Write an interrupted job again.
+
+        Its summary goes on from the files it already holds and the
+        `stored` bytes of its last checkpoint. Returns their paths.
+        """
+
+        self.connect()
+        self.execute("Resume job",
+            "UPDATE jobs SET state = 'running' WHERE job_id = ?", (job_id,)
+        )
+        files_num, new_files, new_bytes, deduped_bytes = self.execute("Summary of the job",
+            "SELECT COUNT(*), COUNT(*) - COUNT(files.file_loc), " + \
+            "COALESCE(SUM(CASE WHEN files.file_loc IS NULL THEN blobs.size END), 0), " + \
+            "COALESCE(SUM(CASE WHEN files.file_loc IS NOT NULL THEN blobs.size END), 0) " + \
+            "FROM files JOIN blobs ON blobs.blob_id = files.blob_id WHERE files.job_id = ?",
+            (job_id,)
+        )[0]
+        self._jobs[job_id] = [files_num, new_files, new_bytes, deduped_bytes, stored]
+        paths = {
+            path for (path,) in self._conn.execute(
+                "SELECT paths.path FROM files JOIN paths ON paths.path_id = files.path_id " + \
+                "WHERE files.job_id = ?",
+                (job_id,)
+            )
+        }
+        self.close_connection(commit=True)
+
+        return paths
+
+    cdef list select_summaries(self, str project):
+        """
+        Summary of the jobs of a project (or of every project, if empty), oldest first.
+
+        Rows of `(job_id, backup_name, time_start, time_finish, files_num,
+        new_files, new_bytes, deduped_bytes, stored_bytes, duration)`.
+        """
+
+        self.connect()
+        data = self.execute("Get job summaries",
+            "SELECT job_id, backup_name, time_start, time_finish, files_num, new_files, " + \
+            "new_bytes, deduped_bytes, stored_bytes, duration FROM jobs " + \
+            "WHERE ? = '' OR backup_name = ? ORDER BY job_id",
+            (project, project)
+        )
+        self.close_connection(commit=False)
+
+        return data
+
+    cdef list select_totals(self, str project):
+        """
+        Totals of the finished jobs of each project (or of one, if not empty).
+
+        Rows of `(backup_name, jobs, last_finish, files_num, new_bytes,
+        deduped_bytes, stored_bytes, duration)` where `files_num` is the
+        one of the latest job. Jobs of unknown sizes are left out of the
+        byte and time totals.
+        """
+
+        self.connect()
+        data = self.execute("Get totals",
+            "SELECT backup_name, COUNT(*), MAX(time_finish), " + \
+            "(SELECT files_num FROM jobs AS L WHERE L.backup_name = jobs.backup_name " + \
+            "AND L.time_finish IS NOT NULL ORDER BY L.job_id DESC LIMIT 1), " + \
+            "SUM(new_bytes), SUM(deduped_bytes), SUM(stored_bytes), SUM(duration) " + \
+            "FROM jobs WHERE time_finish IS NOT NULL AND (? = '' OR backup_name = ?) " + \
+            "GROUP BY backup_name ORDER BY backup_name",
+            (project, project)
+        )
+        self.close_connection(commit=False)
+
+        return data
+
+    cdef int find_chunk(self, str digest):
+        """The `chunk_id` of a stored chunk, or zero if it is not stored."""
+
+        self.connect()
+        result = self.execute("Search chunk",
+            "SELECT chunk_id FROM chunks WHERE digest = ?",
+            (digest,)
+        )
+        self.close_connection(commit=False)
+
+        return result[0][0] if len(result) > 0 else 0
+
+    cdef int insert_chunk(self, int job_id, str digest, long long size):
+        """Insert a chunk stored in the given job"""
+
+        cdef int id
+
+        self.connect()
+        id = self.execute("Insert chunk",
+            "INSERT INTO chunks (job_id, digest, size) VALUES (?, ?, ?)",
+            (job_id, digest, size)
+        )
+        self.close_connection(commit=True)
+
+        return id
+
+    cdef void insert_file_chunks(self, int file_id, list chunk_ids) except *:
+        """Record the ordered list of chunks of a file"""
+
+        self.connect()
+        self.executemany("Insert file chunks",
+            "INSERT INTO file_chunks (file_id, seq, chunk_id) VALUES (?, ?, ?)",
+            [(file_id, seq, chunk_id) for seq, chunk_id in enumerate(chunk_ids)]
+        )
+        self.close_connection(commit=True)
+
+    cdef list select_chunks(self, int file_id):
+        """Ordered list of `(job_id, digest, size)` of the chunks of a file"""
+
+        self.connect()
+        data = self.execute("Get file chunks",
+            "SELECT chunks.job_id, chunks.digest, chunks.size " + \
+            "FROM file_chunks JOIN chunks ON chunks.chunk_id = file_chunks.chunk_id " + \
+            "WHERE file_chunks.file_id = ? " + \
+            "ORDER BY file_chunks.seq",
+            (file_id,)
+        )
+        self.close_connection(commit=False)
+
+        return data
+
+    cdef list select_contents(self, str project, int job_id):
+        """
+        Stored contents to be verified, the least recently verified first.
+
+        Rows of `(blob_id, file_id, job_id, path, chunked, signature...)`
+        of the files that hold a content: the ones used by the job
+        `job_id`, or by the jobs of `project` if it is zero, or all of
+        them if `project` is empty too. Directories have no content,
+        and jobs still `running` are left alone.
+        """
+
+        cdef str condition = "1"
+        cdef tuple params = ()
+
+        if job_id > 0:
+            condition = "files.file_id IN (SELECT COALESCE(file_loc, file_id) FROM files WHERE job_id = ?)"
+            params = (job_id,)
+        elif project != "":
+            condition = (
+                "files.file_id IN (SELECT COALESCE(file_loc, file_id) FROM files " + \
+                "WHERE job_id IN (SELECT job_id FROM jobs WHERE backup_name = ?))"
+            )
+            params = (project,)
+
+        self.connect()
+        data = self.execute("Select contents",
+            "SELECT blobs.blob_id, files.file_id, files.job_id, paths.path, " + \
+            "EXISTS (SELECT 1 FROM file_chunks WHERE file_chunks.file_id = files.file_id), " + \
+            self._hex_columns("blobs") + " " + \
+            "FROM files " + \
+            "JOIN blobs ON blobs.blob_id = files.blob_id " + \
+            "JOIN paths ON paths.path_id = files.path_id " + \
+            "WHERE files.file_loc IS NULL AND " + condition + " " + \
+            f"AND length(blobs.`{self.digests[0]}`) > 0 " + \
+            "AND files.job_id NOT IN (SELECT job_id FROM jobs WHERE state = 'running') " + \
+            "ORDER BY blobs.verified IS NOT NULL, blobs.verified, files.file_id",
+            params
+        )
+        self.close_connection(commit=False)
+
+        return data
+
+    cdef void mark_verified(self, list blob_ids, int when) except *:
+        """Remember that the contents were found intact at `when` (a UNIX time)."""
+
+        self.connect()
+        self.executemany("Mark verified contents",
+            "UPDATE blobs SET verified = ? WHERE blob_id = ?",
+            [(when, blob_id) for blob_id in blob_ids]
+        )
+        self.close_connection(commit=True)
+
+    cdef int find_job(self, int job, str project):
+        """
+        The `job_id` of a job of a project, or zero if the project has no such job.
+
+        Job zero is the latest finished job of the project.
+        """
 
         self.connect()
-        # Select latest job from DB
         if job == 0:
-            job = self.execute("Select latest job",
-                "SELECT MAX(files.job_id) " + \
-                "FROM files " + \
-                "JOIN jobs ON jobs.job_id = files.job_id " + \
-                "WHERE jobs.backup_name = '"+project +"'"
+            job_id = self.execute("Select latest job",
+                "SELECT MAX(job_id) FROM jobs " + \
+                "WHERE backup_name = ? AND time_finish IS NOT NULL",
+                (project,)
             )[0][0]
+        else:
+            result = self.execute("Select job",
+                "SELECT job_id FROM jobs WHERE backup_name = ? AND job_id = ?",
+                (project, job)
+            )
+            job_id = result[0][0] if len(result) > 0 else None
+        self.close_connection(commit=False)
+
+        return job_id or 0
+
+    cdef tuple _path_condition(self, list patterns):
+        """
+        Condition of the paths of `paths` matching any of the patterns.
+
+        Each pattern is a range of the index of the paths, starting at its
+        literal prefix, where the regex of the pattern is checked. Returns
+        `(condition, params, indexed)` where `indexed` tells if every
+        pattern has a prefix: then the index of the paths finds the few
+        matching paths faster than reading all the files of the job.
+        """
+
+        cdef list conditions = []
+        cdef list params = []
+        cdef bint indexed = True
+
+        for pattern in patterns:
+            prefix, regex = path_filter(pattern)
+            if prefix == "":
+                conditions.append("paths.path REGEXP ?")
+                params.append(regex)
+                indexed = False
+            else:
+                # The strings that start with `prefix` sort before this one
+                conditions.append("(paths.path >= ? AND paths.path < ? AND paths.path REGEXP ?)")
+                params.extend([prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1), regex])
+
+        return "(" + " OR ".join(conditions) + ")", tuple(params), indexed
+
+    cdef job_files(self, int job_id, list patterns):
+        """
+        Iterable of `(path, size, digest)` of the files of a job, sorted by path.
+
+        Only the paths that match one of the `patterns` (see
+        `path_filter()`), if any. `digest` is the first one, in hex, and
+        is empty for directories. Must be called on a connection held by
+        `open()`, and iterated before closing it.
+        """
+
+        cdef str condition = "1"
+        cdef tuple params = ()
+        cdef bint indexed = False
 
-        if job is None:
-            return None
+        if len(patterns) > 0:
+            condition, params, indexed = self._path_condition(patterns)
+
+        return self._conn.execute(
+            "SELECT paths.path, blobs.size, lower(hex(blobs.`" + self.digests[0] + "`)) " + \
+            self._files_with_paths(indexed) + " " + \
+            "JOIN blobs ON blobs.blob_id = files.blob_id " + \
+            "WHERE files.job_id = ? AND " + condition + " ORDER BY paths.path",
+            (job_id,) + params
+        )
+
+    cdef str _files_with_paths(self, bint paths_first):
+        """
+        `FROM` clause joining `files` with their `paths`.
+
+        With `paths_first`, the paths are read first (SQLite doesn't
+        reorder a `CROSS JOIN`), so a condition on the paths is searched
+        in their index and only the files at those paths are read.
+        """
+
+        if paths_first:
+            return "FROM paths CROSS JOIN files ON files.path_id = paths.path_id"
+        return "FROM files JOIN paths ON paths.path_id = files.path_id"
+
+    cdef diff_jobs(self, int old_job, int new_job):
+        """
+        Iterable of `(change, path)` of the differences between two jobs, sorted by path.
+
+        `change` is `+` for the paths only in `new_job`, `-` for the
+        paths only in `old_job` and `M` for the paths whose content
+        differs. Every content has a single blob, so the contents are
+        compared by their `blob_id`. Must be called on a connection held
+        by `open()`, and iterated before closing it.
+        """
+
+        return self._conn.execute(
+            "SELECT change, paths.path FROM (" + \
+            "SELECT '+' AS change, N.path_id FROM files AS N WHERE N.job_id = ? AND NOT EXISTS " + \
+            "(SELECT 1 FROM files AS O WHERE O.job_id = ? AND O.path_id = N.path_id) " + \
+            "UNION ALL " + \
+            "SELECT '-', O.path_id FROM files AS O WHERE O.job_id = ? AND NOT EXISTS " + \
+            "(SELECT 1 FROM files AS N WHERE N.job_id = ? AND N.path_id = O.path_id) " + \
+            "UNION ALL " + \
+            "SELECT 'M', N.path_id FROM files AS N JOIN files AS O " + \
+            "ON O.job_id = ? AND O.path_id = N.path_id " + \
+            "WHERE N.job_id = ? AND O.blob_id != N.blob_id" + \
+            ") AS changes JOIN paths ON paths.path_id = changes.path_id ORDER BY paths.path",
+            (new_job, old_job, old_job, new_job, old_job, new_job)
+        )
+
+    cdef select_job(self, int job, str project, list patterns=None):
+        """
+        Select a job
+
+        Only the files whose path matches one of the `patterns` (see
+        `path_filter()`), if any, so only the jobs that hold their
+        content have to be read.
+        """
+
+        cdef str condition = "1"
+        cdef tuple params = ()
+        cdef bint indexed = False
+
+        # Select latest job from DB
+        job_id = self.find_job(job, project)
+        if job_id == 0:
+            return []
+
+        if patterns:
+            condition, params, indexed = self._path_condition(patterns)
+
+        self.connect()
 
         # Select data from DB
         data = self.execute("Get job info", 
-            "SELECT A.job_id, A.path, B.job_id, B.path " + \
-            "FROM files AS A JOIN jobs ON jobs.job_id = A.job_id " + \
-            "LEFT JOIN files AS B ON A.file_loc = B.file_id " + \
-            "WHERE jobs.backup_name = '"+project+"' AND A.job_id = "+str(job)
+            "SELECT files.job_id, paths.path, B.job_id, PB.path, " + \
+            "COALESCE(files.file_loc, files.file_id), " + \
+            "EXISTS (SELECT 1 FROM file_chunks WHERE file_chunks.file_id = COALESCE(files.file_loc, files.file_id)), " + \
+            self._hex_columns("blobs") + " " + \
+            self._files_with_paths(indexed) + " " + \
+            "JOIN blobs ON blobs.blob_id = files.blob_id " + \
+            "LEFT JOIN files AS B ON files.file_loc = B.file_id " + \
+            "LEFT JOIN paths AS PB ON PB.path_id = B.path_id " + \
+            "WHERE files.job_id = ? AND " + condition,
+            (job_id,) + params
         )
         self.close_connection(commit=True)
 
         return data
+
+    cdef list select_jobs(self, str project):
+        """List of `(job_id, time_start)` of the jobs of a project."""
+
+        self.connect()
+        data = self.execute("Get jobs",
+            "SELECT job_id, time_start FROM jobs WHERE backup_name = ? ORDER BY job_id",
+            (project,)
+        )
+        self.close_connection(commit=False)
+
+        return data
+
+    cdef prune_jobs(self, list job_ids):
+        """
+        Delete jobs, keeping the content that the other jobs still use.
+
+        A file stored in a deleted job that is still referenced (through
+        `file_loc`) by a kept job is handed over to the oldest row that
+        references it, which becomes its new original. Chunks are handed
+        over to the oldest job that uses them, and the ones nobody uses
+        are deleted.
+
+        Must be called on a connection held by `open()`. Returns an
+        iterable of `(src_job, src_name, dst_job, dst_name)` with the
+        entries that have to be copied between the zips of the jobs
+        before committing.
+        """
+
+        vInfo(self._verbose, "Pruning %s jobs", len(job_ids))
+
+        self.execute("Drop dead jobs", "DROP TABLE IF EXISTS temp.dead_jobs")
+        self.execute("Create dead jobs", "CREATE TEMP TABLE dead_jobs (job_id INTEGER PRIMARY KEY)")
+        self.executemany("Insert dead jobs",
+            "INSERT INTO dead_jobs (job_id) VALUES (?)",
+            [(job_id,) for job_id in job_ids]
+        )
+
+        # Files handed over: old original -> new original
+        self.execute("Drop moved files", "DROP TABLE IF EXISTS temp.moved_files")
+        self.execute("Create moved files",
+            "CREATE TEMP TABLE moved_files AS " + \
+            "SELECT O.file_id AS old_id, MIN(F.file_id) AS new_id " + \
+            "FROM files AS O JOIN files AS F ON F.file_loc = O.file_id " + \
+            "WHERE O.job_id IN (SELECT job_id FROM dead_jobs) " + \
+            "AND F.job_id NOT IN (SELECT job_id FROM dead_jobs) " + \
+            "GROUP BY O.file_id"
+        )
+        self.execute("Index moved files", "CREATE UNIQUE INDEX temp.idx_moved_old ON moved_files (old_id)")
+
+        self.execute("Drop moves", "DROP TABLE IF EXISTS temp.moves")
+        self.execute("Create moves",
+            "CREATE TEMP TABLE moves AS " + \
+            "SELECT O.job_id AS src_job, PO.path AS src_name, N.job_id AS dst_job, PN.path AS dst_name " + \
+            "FROM moved_files JOIN files AS O ON O.file_id = moved_files.old_id " + \
+            "JOIN files AS N ON N.file_id = moved_files.new_id " + \
+            "JOIN paths AS PO ON PO.path_id = O.path_id " + \
+            "JOIN paths AS PN ON PN.path_id = N.path_id"
+        )
+
+        self.execute("Point to the new originals",
+            "UPDATE files SET file_loc = " + \
+            "(SELECT new_id FROM moved_files WHERE old_id = files.file_loc) " + \
+            "WHERE file_loc IN (SELECT old_id FROM moved_files)"
+        )
+        self.execute("Set the new originals",
+            "UPDATE files SET file_loc = NULL WHERE file_id IN (SELECT new_id FROM moved_files)"
+        )
+        self.execute("Hand over chunk lists",
+            "UPDATE file_chunks SET file_id = " + \
+            "(SELECT new_id FROM moved_files WHERE old_id = file_chunks.file_id) " + \
+            "WHERE file_id IN (SELECT old_id FROM moved_files)"
+        )
+
+        # Delete the rows of the jobs
+        self.execute("Delete chunk lists",
+            "DELETE FROM file_chunks WHERE file_id IN " + \
+            "(SELECT file_id FROM files WHERE job_id IN (SELECT job_id FROM dead_jobs))"
+        )
+        self.execute("Delete files",
+            "DELETE FROM files WHERE job_id IN (SELECT job_id FROM dead_jobs)"
+        )
+        self.execute("Delete jobs",
+            "DELETE FROM jobs WHERE job_id IN (SELECT job_id FROM dead_jobs)"
+        )
+        self.execute("Delete unused blobs",
+            "DELETE FROM blobs WHERE blob_id NOT IN (SELECT blob_id FROM files)"
+        )
+        self.execute("Delete unused paths",
+            "DELETE FROM paths WHERE path_id NOT IN (SELECT path_id FROM files)"
+        )
+
+        # Chunks: delete the unused ones and hand over the used ones
+        self.execute("Delete chunks",
+            "DELETE FROM chunks WHERE chunk_id NOT IN (SELECT chunk_id FROM file_chunks)"
+        )
+        self.execute("Drop moved chunks", "DROP TABLE IF EXISTS temp.moved_chunks")
+        self.execute("Create moved chunks",
+            "CREATE TEMP TABLE moved_chunks AS " + \
+            "SELECT chunks.chunk_id, chunks.job_id AS old_job, chunks.digest, " + \
+            "MIN(files.job_id) AS new_job " + \
+            "FROM chunks JOIN file_chunks ON file_chunks.chunk_id = chunks.chunk_id " + \
+            "JOIN files ON files.file_id = file_chunks.file_id " + \
+            "WHERE chunks.job_id IN (SELECT job_id FROM dead_jobs) " + \
+            "GROUP BY chunks.chunk_id"
+        )
+        self.execute("Add chunk moves",
+            "INSERT INTO moves (src_job, src_name, dst_job, dst_name) " + \
+            "SELECT old_job, '.chunks/' || digest, new_job, '.chunks/' || digest FROM moved_chunks"
+        )
+        self.execute("Hand over chunks",
+            "UPDATE chunks SET job_id = " + \
+            "(SELECT new_job FROM moved_chunks WHERE moved_chunks.chunk_id = chunks.chunk_id) " + \
+            "WHERE chunk_id IN (SELECT chunk_id FROM moved_chunks)"
+        )
+
+        return self._conn.execute(
+            "SELECT src_job, src_name, dst_job, dst_name FROM moves ORDER BY src_job, dst_job"
+        )
+
+    cdef list select_moved_files(self):
+        """List of `(new_id, old_id)` of the files handed over by the last `prune_jobs()`."""
+        return self.execute("Get moved files", "SELECT new_id, old_id FROM moved_files")
+
+    cpdef bint has_content(self, bytes key):
+        """Check if a file or chunk with the given (binary) first digest is stored."""
+
+        self.connect()
+        found = len(self.execute("Search content",
+            "SELECT 1 FROM blobs WHERE `" + self.digests[0] + "` = ? LIMIT 1",
+            (key,)
+        )) > 0 or len(self.execute("Search content chunk",
+            "SELECT 1 FROM chunks WHERE digest = ? LIMIT 1",
+            (key.hex(),)
+        )) > 0
+        self.close_connection(commit=False)
+
+        return found
+
+    cdef int last_job(self, str project):
+        """The `job_id` of the latest finished job of a project, or zero if it has none."""
+
+        self.connect()
+        job_id = self.execute("Select latest job",
+            "SELECT MAX(job_id) FROM jobs WHERE backup_name = ? AND time_finish IS NOT NULL",
+            (project,)
+        )[0][0]
+        self.close_connection(commit=False)
+
+        return job_id or 0
+
+    cdef int copy_files(self, int src_job, int dst_job, list dirty, list parents):
+        """
+        Copy the files of a job into another one, except the changed ones.
+
+        The files are not read: the copies point to the content of the
+        originals. Files at a path of `dirty`, or inside one, and the
+        directories at a path of `parents` are not copied, since they
+        are backed up again. Returns the number of files copied.
+        """
+
+        cdef int copied
+
+        self.connect()
+        self.flush()
+
+        self.execute("Copy files",
+            "INSERT INTO files (job_id, path_id, blob_id, file_loc) " + \
+            "SELECT ?, path_id, blob_id, COALESCE(file_loc, file_id) " + \
+            "FROM files WHERE job_id = ? ORDER BY file_id",
+            (dst_job, src_job)
+        )
+
+        # "/" + 1 = "0": the paths inside a directory sort between both
+        self.executemany("Skip changed files",
+            "DELETE FROM files WHERE job_id = ? AND path_id IN " + \
+            "(SELECT path_id FROM paths WHERE path = ? OR (path > ? AND path < ?))",
+            [(dst_job, path, path + "/", path + "0") for path in dirty]
+        )
+        self.executemany("Skip changed directories",
+            "DELETE FROM files WHERE job_id = ? AND path_id = " + \
+            "(SELECT path_id FROM paths WHERE path = ?)",
+            [(dst_job, path) for path in parents]
+        )
+        copied, copied_bytes = self.execute("Count copied files",
+            "SELECT COUNT(*), COALESCE(SUM(blobs.size), 0) " + \
+            "FROM files JOIN blobs ON blobs.blob_id = files.blob_id WHERE files.job_id = ?",
+            (dst_job,)
+        )[0]
+
+        # The copies are part of the job, without storing anything
+        counters = self._jobs.setdefault(dst_job, [0, 0, 0, 0, 0])
+        counters[0] += copied
+        counters[3] += copied_bytes
+
+        # The ids were taken by the copies
+        self._next_file_id = 0
+        self.close_connection(commit=True)
+
+        return copied
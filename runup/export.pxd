@@ -0,0 +1,29 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Own
+from runup.packs cimport PackStore
+
+
+cdef class Exporter:
+
+    cdef str _context
+    cdef bint _verbose
+    cdef PackStore _packs
+    cdef dict _archives
+
+    cdef _tarinfo(self, int job_id, str src, str name, double now)
+
+    cpdef export(self, output, str fmt, list files, list chunked_files)
+
+
+cdef class ChunkStream:
+
+    cdef Exporter _exporter
+    cdef list _chunks
+    cdef Py_ssize_t _position
+    cdef _current
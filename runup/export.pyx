@@ -0,0 +1,168 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import stat
+import tarfile
+import time
+import zipfile
+
+# 3rd Party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.packs cimport PackStore
+from runup.restore import COPY_BUFFER
+from runup.utils cimport vInfo
+
+
+# Values accepted by `runup export --format`, and the `tarfile` mode of each one
+EXPORT_FORMATS = {
+    "tar": "w|",
+    "tar.gz": "w|gz",
+}
+
+
+cdef class ChunkStream:
+    """Read-only file object that concatenates the chunks of a file."""
+
+    def __init__(self, Exporter exporter, list chunks):
+
+        self._exporter = exporter
+        self._chunks = chunks
+        self._position = 0
+        self._current = None
+
+    def read(self, Py_ssize_t size=-1):
+        """Read up to `size` bytes, crossing chunk boundaries if needed."""
+
+        cdef list parts = []
+        cdef Py_ssize_t remaining = size
+
+        while remaining != 0:
+            if self._current is None:
+                if self._position == len(self._chunks):
+                    break
+                job_id, digest, _ = self._chunks[self._position]
+                self._position += 1
+                self._current = self._exporter.open_chunk(job_id, digest)
+
+            data = self._current.read(remaining)
+            if len(data) == 0:
+                self._current.close()
+                self._current = None
+                continue
+
+            parts.append(data)
+            if remaining > 0:
+                remaining -= len(data)
+
+        return b"".join(parts)
+
+
+cdef class Exporter:
+    """
+    Write a snapshot of a project as a single tar stream.
+
+    The data is copied straight from the jobs into the output, which
+    can be any writable binary file object (stdout, a pipe, a file...):
+    nothing is extracted to disk and nothing needs to be seekable.
+    The data comes from the `PackStore` on repositories that use packs.
+    """
+
+    def __init__(self, str context, bint verbose, PackStore packs=None):
+
+        self._context = context
+        self._verbose = verbose
+        self._packs = packs
+        self._archives = {}
+
+    def archive(self, int job_id):
+        """The `ZipFile` of a job, opened on first use."""
+
+        if job_id not in self._archives:
+            self._archives[job_id] = zipfile.ZipFile(f"{self._context}.runup/jobs/{job_id}")
+        return self._archives[job_id]
+
+    def open_chunk(self, int job_id, str digest):
+        """File object with the content of a chunk."""
+
+        if self._packs is not None:
+            return self._packs.open_blob(bytes.fromhex(digest))
+        return self.archive(job_id).open(f".chunks/{digest}")
+
+    cdef _tarinfo(self, int job_id, str src, str name, double now):
+        """
+        Header and file object of an entry. Entries without content are directories.
+
+        `src` is the path of the entry in its job, or its digest if
+        the content is in the packs (empty for directories).
+        """
+
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.mtime = now
+
+        if self._packs is not None:
+            if src == "":
+                tarinfo.type = tarfile.DIRTYPE
+                tarinfo.mode = 0o755
+                return tarinfo, None
+            tarinfo.size = self._packs.blob_size(bytes.fromhex(src))
+            tarinfo.mode = 0o644
+            return tarinfo, self._packs.open_blob(bytes.fromhex(src))
+
+        archive = self.archive(job_id)
+        try:
+            zinfo = archive.getinfo(src)
+        except KeyError:
+            tarinfo.type = tarfile.DIRTYPE
+            tarinfo.mode = 0o755
+            return tarinfo, None
+
+        tarinfo.size = zinfo.file_size
+        tarinfo.mtime = time.mktime(zinfo.date_time + (0, 0, -1))
+        tarinfo.mode = stat.S_IMODE(zinfo.external_attr >> 16) or 0o644
+        return tarinfo, archive.open(zinfo)
+
+    cpdef export(self, output, str fmt, list files, list chunked_files):
+        """
+        Write the files into `output` with the format `fmt`.
+
+        `files` is a list of `(job_id, src, name)` and `chunked_files`
+        a list of `(chunks, name)`. Files without content are exported
+        as directories.
+        """
+
+        cdef double now = time.time()
+
+        try:
+            with tarfile.open(
+                fileobj=output, mode=EXPORT_FORMATS[fmt], bufsize=COPY_BUFFER
+            ) as tar:
+                for job_id, src, name in files:
+                    tarinfo, source = self._tarinfo(job_id, src, name, now)
+                    if source is None:
+                        tar.addfile(tarinfo)
+                        continue
+
+                    vInfo(self._verbose, "Exporting file: %s", name)
+                    with source:
+                        tar.addfile(tarinfo, source)
+
+                for chunks, name in chunked_files:
+                    vInfo(self._verbose, "Exporting file: %s", name)
+                    tarinfo = tarfile.TarInfo(name)
+                    tarinfo.size = sum([size for _, _, size in chunks])
+                    tarinfo.mtime = now
+                    tarinfo.mode = 0o644
+                    tar.addfile(tarinfo, ChunkStream(self, chunks))
+        finally:
+            for archive in self._archives.values():
+                archive.close()
+            self._archives = {}
@@ -0,0 +1,42 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+cdef class BloomFilter:
+
+    cdef readonly unsigned long long capacity
+    cdef readonly unsigned long long num_bits
+    cdef readonly int num_hashes
+    cdef public unsigned long long covered
+    cdef readonly unsigned long long items
+    cdef bytearray _bits
+
+    cdef void _positions(self, bytes key, unsigned long long* h1, unsigned long long* h2)
+
+    cpdef void add(self, bytes key)
+
+    cpdef bint contains(self, bytes key)
+
+    cpdef void save(self, str path)
+
+
+cpdef BloomFilter load_bloom(str path)
+
+
+cdef class DigestIndex:
+
+    cdef readonly bint eager
+    cdef readonly BloomFilter bloom
+    cdef dict _ids
+
+    cpdef int get(self, bytes key)
+
+    cpdef void add(self, bytes key, int file_id, bint new=*)
+
+    cpdef bint needs_search(self, bytes key)
+
+
+cpdef bytes signature_key(tuple signature)
@@ -0,0 +1,172 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import hashlib
+from math import ceil, log
+import os
+import struct
+
+# 3rd Party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+
+# Header of the Bloom filter file:
+# magic, version, number of bits, number of hashes, covered file_id, items
+BLOOM_HEADER = struct.Struct("<4sBQBQQ")
+BLOOM_MAGIC = b"RUBF"
+BLOOM_VERSION = 1
+
+# Expected false positive rate of the Bloom filter
+BLOOM_FP_RATE = 0.01
+
+
+cdef class BloomFilter:
+    """
+    Probabilistic set of signatures.
+
+    When the filter says a signature is not in the set, it is
+    certainly not there. When it says it is, it probably is.
+    """
+
+    def __init__(self, unsigned long long capacity):
+
+        cdef unsigned long long num_bits
+
+        capacity = max(capacity, 1024)
+        num_bits = <unsigned long long>ceil(<double>capacity * -log(BLOOM_FP_RATE) / (log(2) ** 2))
+        num_bits = (num_bits + 7) // 8 * 8
+
+        self.capacity = capacity
+        self.num_bits = num_bits
+        self.num_hashes = max(1, round(num_bits / capacity * log(2)))
+        self.covered = 0
+        self.items = 0
+        self._bits = bytearray(num_bits // 8)
+
+    cdef void _positions(self, bytes key, unsigned long long* h1, unsigned long long* h2):
+        """Two independent hashes used to derive the positions of a key."""
+
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1[0] = int.from_bytes(digest[:8], "little")
+        h2[0] = int.from_bytes(digest[8:], "little") | 1
+
+    cpdef void add(self, bytes key):
+        """Add a key to the set."""
+
+        cdef unsigned long long h1, h2, pos
+        cdef int i
+        cdef unsigned char[:] bits = self._bits
+
+        self._positions(key, &h1, &h2)
+        for i in range(self.num_hashes):
+            pos = (h1 + i * h2) % self.num_bits
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.items += 1
+
+    cpdef bint contains(self, bytes key):
+        """Check if a key is (probably) in the set."""
+
+        cdef unsigned long long h1, h2, pos
+        cdef int i
+        cdef unsigned char[:] bits = self._bits
+
+        self._positions(key, &h1, &h2)
+        for i in range(self.num_hashes):
+            pos = (h1 + i * h2) % self.num_bits
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    cpdef void save(self, str path):
+        """Write the filter to disk, atomically."""
+
+        with open(path + ".tmp", "wb") as file:
+            file.write(BLOOM_HEADER.pack(
+                BLOOM_MAGIC, BLOOM_VERSION, self.num_bits, self.num_hashes, self.covered, self.items
+            ))
+            file.write(self._bits)
+        os.replace(path + ".tmp", path)
+
+
+cpdef BloomFilter load_bloom(str path):
+    """Read a filter written by `BloomFilter.save()`. `None` if missing or invalid."""
+
+    cdef BloomFilter bloom
+
+    try:
+        with open(path, "rb") as file:
+            header = file.read(BLOOM_HEADER.size)
+            magic, version, num_bits, num_hashes, covered, items = BLOOM_HEADER.unpack(header)
+            if magic != BLOOM_MAGIC or version != BLOOM_VERSION:
+                return None
+            bits = bytearray(file.read())
+    except (OSError, struct.error):
+        return None
+
+    if len(bits) * 8 != num_bits:
+        return None
+
+    bloom = BloomFilter.__new__(BloomFilter)
+    bloom.capacity = <unsigned long long>(num_bits * (log(2) ** 2) / -log(BLOOM_FP_RATE))
+    bloom.num_bits = num_bits
+    bloom.num_hashes = num_hashes
+    bloom.covered = covered
+    bloom.items = items
+    bloom._bits = bits
+    return bloom
+
+
+cdef class DigestIndex:
+    """
+    Job-scoped index from signatures to the `file_id` that holds them.
+
+    In eager mode every stored signature is loaded once, at the start
+    of the job, and lookups never leave the process. In lazy mode only
+    the signatures found during the job are kept, and a Bloom filter
+    tells which signatures are certainly new, so the DB only needs to
+    be searched for the ones that probably exist.
+    """
+
+    def __init__(self, bint eager, BloomFilter bloom=None):
+
+        self.eager = eager
+        self.bloom = bloom
+        self._ids = {}
+
+    cpdef int get(self, bytes key):
+        """The `file_id` of a signature, or zero if it is not known (yet)."""
+        return self._ids.get(key, 0)
+
+    cpdef void add(self, bytes key, int file_id, bint new=True):
+        """
+        Register a signature, unless it was already registered.
+
+        `new` signatures (not found in the DB) are added to the filter too.
+        """
+
+        if key in self._ids:
+            return
+        self._ids[key] = file_id
+        if new and self.bloom is not None:
+            self.bloom.add(key)
+
+    cpdef bint needs_search(self, bytes key):
+        """Check if the DB needs to be searched for a signature not found in memory."""
+
+        if self.eager:
+            return False
+        if self.bloom is None:
+            return True
+        return self.bloom.contains(key)
+
+
+cpdef bytes signature_key(tuple signature):
+    """Compact binary key of a signature."""
+    return bytes.fromhex("".join(signature))
@@ -5,6 +5,14 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 
+# Own
+from runup.cache cimport StatCache
+from runup.checkpoint cimport CheckpointJournal
+from runup.db cimport RunupDB
+from runup.journal cimport Journal
+from runup.packs cimport PackStore
+
+
 cdef class Interpreter:
 
     cdef _context
@@ -13,16 +21,152 @@ cdef class Interpreter:
     cdef bint _verbose
     cdef char* _version
 
-    cpdef bint create_backup(self, yaml_config, project)
+    cpdef bint create_backup(self, yaml_config, project, bint rehash=*, double paranoid=*, int workers=*, bint resume=*) except -1
     
-    cpdef restore_backup(self, yaml_config: Dict[str, Any], str project, str location, int job, bint force)
+    cpdef restore_backup(self, yaml_config: Dict[str, Any], str project, str location, int job, bint force, int workers=*, bint sync=*, list paths=*)
+
+    cpdef bint export_backup(self, yaml_config, str project, int job, str fmt, output)
+
+    cpdef bint prune_backups(self, yaml_config, str project, int keep_last, int keep_daily, int keep_weekly, bint dry_run=*)
+
+    cpdef bint watch_projects(self, yaml_config, str project, double timeout=*)
+
+    cpdef bint list_jobs(self, yaml_config, str project)
+
+    cpdef bint show_stats(self, yaml_config, str project)
+
+    cpdef bint list_files(self, yaml_config, str project, int job, list patterns, bint details=*)
+
+    cpdef bint compare_jobs(self, yaml_config, str project, int old_job, int new_job)
+
+    cpdef bint verify_backups(
+        self, yaml_config, str project, int job, double sample=*, double time_limit=*, int workers=*
+    )
     
 
 cdef class Interpreter_1(Interpreter):
 
-    cpdef bint create_backup(self, yaml_config, project)
+    cpdef bint create_backup(self, yaml_config, project, bint rehash=*, double paranoid=*, int workers=*, bint resume=*) except -1
     
-    cpdef restore_backup(self, yaml_config: Dict[str, Any], str project, str location, int job, bint force)
+    cpdef restore_backup(self, yaml_config: Dict[str, Any], str project, str location, int job, bint force, int workers=*, bint sync=*, list paths=*)
+
+    cpdef bint export_backup(self, yaml_config, str project, int job, str fmt, output)
+
+    cpdef bint prune_backups(self, yaml_config, str project, int keep_last, int keep_daily, int keep_weekly, bint dry_run=*)
+
+    cpdef bint watch_projects(self, yaml_config, str project, double timeout=*)
+
+    cpdef bint list_jobs(self, yaml_config, str project)
+
+    cpdef bint show_stats(self, yaml_config, str project)
+
+    cpdef bint list_files(self, yaml_config, str project, int job, list patterns, bint details=*)
+
+    cpdef bint compare_jobs(self, yaml_config, str project, int old_job, int new_job)
+
+    cpdef bint verify_backups(
+        self, yaml_config, str project, int job, double sample=*, double time_limit=*, int workers=*
+    )
+
+    cpdef _backup_project(
+        self,
+        RunupDB db,
+        StatCache cache,
+        PackStore packs,
+        Journal journal,
+        lock,
+        cancelled,
+        config: Dict[str, Any],
+        str backup,
+        tuple compression,
+        bint rehash,
+        double paranoid,
+        int workers,
+        list taken,
+        int resume_job,
+    )
+
+    cdef int _checkpoint(
+        self,
+        RunupDB db,
+        PackStore packs,
+        CheckpointJournal checkpoints,
+        my_zip,
+        lock,
+        int job_id,
+        double started,
+    ) except -1
+
+    cdef int _recover_jobs(self, RunupDB db) except -1
+
+    cdef void _write_entry(
+        self,
+        RunupDB db,
+        StatCache cache,
+        my_zip,
+        PackStore packs,
+        lock,
+        tuple compression,
+        str project,
+        int job_id,
+        tuple entry,
+    ) except *
+
+    cdef void _write_chunks(
+        self,
+        RunupDB db,
+        my_zip,
+        PackStore packs,
+        lock,
+        tuple compression,
+        int job_id,
+        int file_id,
+        str path_from_pwd,
+        list chunks,
+    ) except *
+
+    cdef _compression(self, config: Dict[str, Any])
+
+    cdef int _num_workers(self, config: Dict[str, Any], int workers)
+
+    cdef _restore_projects(
+        self,
+        yaml_config,
+        projects,
+        str context,
+        str location,
+        int job,
+        bint force,
+        int workers,
+        bint sync,
+        list paths,
+        PackStore packs,
+    )
+
+    cdef _move_entries(self, str context, moves)
+
+    cdef PackStore _open_packs(self)
+
+    cdef tuple _resolve_job(self, list job_data, PackStore packs)
+
+    cdef str _clean_path(self, str path)
+
+    cdef str _destination(self, str location, str path)
+
+    cdef set _sync_destination(
+        self,
+        RunupDB db,
+        config: Dict[str, Any],
+        str project,
+        str location,
+        dict signatures,
+        int workers,
+        list paths,
+    )
+
+    cdef _changed_directories(
+        self, RunupDB db, config: Dict[str, Any], int previous_job, int job_id, list dirty
+    )
 
     cdef _working_directories(self, config: Dict[str, Any])
 
@@ -7,10 +7,19 @@
 
 # Built-in
 from abc import ABC, abstractmethod
+from collections import deque
 from collections.abc import KeysView
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 import os
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple, Union
+import random
+import re
+import shutil
+import stat
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
 import zipfile
 
 # 3rd party
@@ -20,8 +29,50 @@ import pyximport  # type: ignore
 pyximport.install()
 
 # Own
+from runup.cache cimport StatCache
+from runup.checkpoint cimport CheckpointJournal, recover_zip
+from runup.chunker cimport Chunker
+from runup.chunker import CHUNKING_MIN_FILE_SIZE, CHUNKING_MODES, chunk_file
 from runup.db cimport RunupDB
-from runup.utils cimport vCall, vInfo, vResponse
+from runup.db import SchemaError
+from runup.export cimport Exporter
+from runup.journal cimport Journal, config_fingerprint
+from runup.packs cimport PackStore
+from runup.prune cimport jobs_to_keep
+from runup.restore cimport Restorer
+from runup.scanner cimport Scanner, path_filter
+from runup.stats cimport format_duration, format_size, format_speed, job_lines, stats_lines
+from runup.trace cimport Tracer, get_tracer
+from runup.verify cimport Verifier
+from runup.watch cimport Watcher
+from runup.utils cimport (
+    vCall,
+    vInfo,
+    vResponse,
+    compression_for,
+    copy_entry,
+    memory_high_water,
+    read_repository_info,
+    write_entry,
+    write_repository_info,
+)
+from runup.utils import (
+    COMPRESSION_METHODS,
+    DEFAULT_DIGESTS,
+    DEFAULT_STORAGE,
+    hash_file,
+    prepare_entry,
+)
+
+
+# Entries being hashed and compressed per worker while the previous ones
+# are written: with the workspace scanned lazily, this is what bounds the
+# memory used by a job, whatever the size of the tree
+PIPELINE_DEPTH = 2
+
+
+class BackupError(Exception):
+    """A file that could not be backed up: the backup is rolled back."""
 
 
 cdef class Interpreter:
@@ -42,18 +93,74 @@ cdef class Interpreter:
         self._verbose:bint = verbose
         self._version = version
 
-    cpdef bint create_backup(self, yaml_config, project):
+    cpdef bint create_backup(
+        self, yaml_config, project, bint rehash=False, double paranoid=0, int workers=0, bint resume=False
+    ) except -1:
         """Create a new backup."""
         raise NotImplementedError()
 
-    cpdef restore_backup(self, yaml_config, str project, str location, int job, bint force):
+    cpdef restore_backup(
+        self,
+        yaml_config,
+        str project,
+        str location,
+        int job,
+        bint force,
+        int workers=0,
+        bint sync=False,
+        list paths=None,
+    ):
         """Restore the specified backup."""
         raise NotImplementedError()
 
-    def set_environment(self) -> bool:
+    def set_environment(
+        self, digests: Optional[Tuple[str, ...]] = None, storage: str = DEFAULT_STORAGE
+    ) -> bool:
         """Create the backup enviroment."""
         raise NotImplementedError()
 
+    cpdef bint export_backup(self, yaml_config, str project, int job, str fmt, output):
+        """Write a backup as a single archive."""
+        raise NotImplementedError()
+
+    cpdef bint prune_backups(
+        self,
+        yaml_config,
+        str project,
+        int keep_last,
+        int keep_daily,
+        int keep_weekly,
+        bint dry_run=False,
+    ):
+        """Delete the jobs not kept by a retention policy."""
+        raise NotImplementedError()
+
+    cpdef bint watch_projects(self, yaml_config, str project, double timeout=0):
+        """Record the changes of the projects for the next backups."""
+        raise NotImplementedError()
+
+    cpdef bint list_jobs(self, yaml_config, str project):
+        """Show the summary of every job."""
+        raise NotImplementedError()
+
+    cpdef bint show_stats(self, yaml_config, str project):
+        """Show the totals of the jobs of every project."""
+        raise NotImplementedError()
+
+    cpdef bint list_files(self, yaml_config, str project, int job, list patterns, bint details=False):
+        """Show the files of a job."""
+        raise NotImplementedError()
+
+    cpdef bint compare_jobs(self, yaml_config, str project, int old_job, int new_job):
+        """Show the differences between two jobs."""
+        raise NotImplementedError()
+
+    cpdef bint verify_backups(
+        self, yaml_config, str project, int job, double sample=0, double time_limit=0, int workers=0
+    ):
+        """Check the stored contents against their signatures."""
+        raise NotImplementedError()
+
     def missing_parameter(self, yaml_config: Dict[str, Any]) -> Optional[str]:
         """Find the required parameters missing on YAML file"""
         raise NotImplementedError()
@@ -68,30 +175,28 @@ cdef class Interpreter:
 
         if prefix != "":
             prefix = str(f"{prefix}.")
-            vInfo(self._verbose, f"New prefix `{prefix}`")
+            vInfo(self._verbose, "New prefix `%s`", prefix)
 
         if type(search_area) == list:
             vInfo(self._verbose, "`search_area` is a list")
             for value in search_area:
-                vInfo(self._verbose, f"Testing parameter `{value}`")
+                vInfo(self._verbose, "Testing parameter `%s`", value)
                 if f"{prefix}*" in valid_parameters:
-                    vInfo(self._verbose, f"`{value}` has been found as `{prefix}*`")
+                    vInfo(self._verbose, "`%s` has been found as `%s*`", (value, prefix))
                     full_key = str(f"{prefix}*")
                 elif f"{prefix}{value}" in valid_parameters:
                     full_key = str(f"{prefix}{value}")
-                    vInfo(
-                        self._verbose, f"`{value}` has been found as `{prefix}{value}`"
-                    )
+                    vInfo(self._verbose, "`%s` has been found as `%s%s`", (value, prefix, value))
 
                 if len(full_key) > 0:
                     vInfo(
-                        self._verbose,
-                        f"The value of parameter `{full_key}` is type {type(value)}",
+                        self._verbose, "The value of parameter `%s` is type %s", (full_key, type(value))
                     )
                     if type(value) == self._valid_parameters[full_key]:
                         vInfo(
                             self._verbose,
-                            f"`{type(value)}` is a valid type for parameter `{full_key}`",
+                            "`%s` is a valid type for parameter `%s`",
+                            (type(value), full_key),
                         )
                     else:
                         click.echo(
@@ -100,29 +205,31 @@ cdef class Interpreter:
                         )
                         return full_key
                 else:
-                    vInfo(self._verbose, f"`{value}` is not a valid parameter")
+                    vInfo(self._verbose, "`%s` is not a valid parameter", value)
                     return full_key
 
         elif type(search_area) == dict:
             vInfo(self._verbose, "`search_area` is a dict")
             for key, values in search_area.items():
-                vInfo(self._verbose, f"Testing parameter `{key}`")
+                vInfo(self._verbose, "Testing parameter `%s`", key)
                 if f"{prefix}*" in valid_parameters:
-                    vInfo(self._verbose, f"`{key}` has been found as `{prefix}*`")
+                    vInfo(self._verbose, "`%s` has been found as `%s*`", (key, prefix))
                     full_key = str(f"{prefix}*")
                 elif f"{prefix}{key}" in valid_parameters:
                     full_key = str(f"{prefix}{key}")
-                    vInfo(self._verbose, f"`{key}` has been found as `{prefix}{key}`")
+                    vInfo(self._verbose, "`%s` has been found as `%s%s`", (key, prefix, key))
 
                 if len(full_key) > 0:
                     vInfo(
                         self._verbose,
-                        f"The value of parameter `{prefix}{key}` is type {type(values)}",
+                        "The value of parameter `%s%s` is type %s",
+                        (prefix, key, type(values)),
                     )
                     if type(values) == self._valid_parameters[full_key]:
                         vInfo(
                             self._verbose,
-                            f"`{type(values)}` is a valid type for parameter `{prefix}{key}`",
+                            "`%s` is a valid type for parameter `%s%s`",
+                            (type(values), prefix, key),
                         )
                     else:
                         click.echo(
@@ -132,7 +239,7 @@ cdef class Interpreter:
                         return full_key
 
                     if type(values) == dict or type(values) == list:
-                        vInfo(self._verbose, f"Analysing subparameters of `{key}`")
+                        vInfo(self._verbose, "Analysing subparameters of `%s`", key)
                         vCall(self._verbose, "Interpreter:validate_parameters")
                         next_prefix: str = str(
                             f"{prefix}*"
@@ -144,10 +251,10 @@ cdef class Interpreter:
                             self._verbose, "Interpreter:validate_parameters", result
                         )
                         if result is not None:
-                            vInfo(self._verbose, f"`{key}` has an invalid subparameter")
+                            vInfo(self._verbose, "`%s` has an invalid subparameter", key)
                             return result
                 else:
-                    vInfo(self._verbose, f"`{key}` is not a valid parameter")
+                    vInfo(self._verbose, "`%s` is not a valid parameter", key)
                     return full_key
 
         else:
@@ -176,6 +283,10 @@ cdef class Interpreter_1(Interpreter):
                 "version": str,
                 "project": dict,
                 "project.*": dict,
+                "project.*.chunking": str,
+                "project.*.compression": dict,
+                "project.*.compression.level": int,
+                "project.*.compression.method": str,
                 # 'project.*.cron': str,
                 # 'project.*.encrypt': list,
                 # 'project.*.encrypt.*': str,
@@ -184,20 +295,43 @@ cdef class Interpreter_1(Interpreter):
                 "project.*.include": list,
                 "project.*.include.*": str,
                 # 'project.*.password': str,
+                "project.*.workers": int,
             },
             verbose=verbose,
             version= b'1',
         )
 
-    cpdef bint create_backup(self, yaml_config, project):
-        """Create a new backup"""
+    cpdef bint create_backup(
+        self, yaml_config, project, bint rehash=False, double paranoid=0, int workers=0, bint resume=False
+    ) except -1:
+        """
+        Create a new backup
+
+        Files whose stat info matches the stat cache are not hashed
+        again unless `rehash` is set. `paranoid` is the percentage of
+        those cached files that are hashed anyway to confirm the cache.
+
+        The projects are backed up at the same time, each one on its
+        own thread (see `_backup_project()`). Either all of their jobs
+        are finished or none is. The jobs of a backup that crashed are
+        cut back to their last checkpoint first (see `_recover_jobs()`)
+        and, with `resume`, the interrupted job of a project goes on
+        from there instead of starting a new one. If a file can't be
+        backed up, every job is rolled back.
+        """
 
         cdef bint initiated = self._validate_prev_init(yaml_config)
         if not initiated:
             return False
+
+        cdef RunupDB db
+        cdef StatCache cache
+        cdef PackStore packs = None
+        cdef Journal journal = None
+        cdef dict resumed = {}
+        cdef int recovered
         
         backup_list = [] #: List[str] = []
-        working_directories: Dict[str, str]
 
         # Make context relative
         context: str = str(self._context)
@@ -209,50 +343,630 @@ cdef class Interpreter_1(Interpreter):
             backup_list = yaml_config["project"].keys()
         else:
             backup_list.append(project)
-        
-        # Create each backup
+
+        compression: Dict[str, Tuple[int, Optional[int]]] = {}
         for backup in backup_list:
+            if yaml_config["project"][backup].get("chunking", "none") not in CHUNKING_MODES:
+                click.echo(
+                    f"The chunking of the project `{backup}` must be one of: "
+                    + ", ".join(CHUNKING_MODES)
+                )
+                return False
+            compression[backup] = self._compression(yaml_config["project"][backup])
+            if compression[backup] is None:
+                return False
+
+        db = RunupDB(self._context, self._verbose)
+        cache = StatCache(self._context, self._verbose)
+
+        # Journal of `runup watch`, if it ever ran (a full scan is forced by `rehash`)
+        taken: List[str] = []
+        if os.path.exists(f"{context}.runup/journal.db") and not rehash and paranoid <= 0:
+            journal = Journal(self._context, self._verbose)
+
+        # The projects are backed up at the same time. They share one
+        # connection (and transaction), the stat cache and the packs,
+        # which are only used while holding `lock`.
+        lock = threading.Lock()
+        finished: List[int] = []
+        cancelled = threading.Event()
+        memory_high_water(reset=True)
+
+        try:
+            # What the backups that crashed left behind
+            vCall(self._verbose, "Interpreter_1:_recover_jobs")
+            recovered = self._recover_jobs(db)
+            vResponse(self._verbose, "Interpreter_1:_recover_jobs", recovered)
+
+            for backup in backup_list:
+                job_id = db.resumable_job(str(backup))
+                if job_id == 0:
+                    continue
+                if resume:
+                    click.echo(f"Resuming job {job_id} of `{backup}`.")
+                    resumed[str(backup)] = job_id
+                else:
+                    click.secho(
+                        f"Job {job_id} of `{backup}` was interrupted: "
+                        + "`runup backup --resume` goes on with it.",
+                        fg="yellow",
+                    )
 
-            working_directories = {}
-            vCall(self._verbose, "Interpreter_1:_working_directories")
-            working_directories.update(
-                self._working_directories(yaml_config["project"][backup])
-            )
-            vResponse(
+            cache.open()
+            if recovered > 0:
+                # The files cut from the interrupted jobs
+                cache.forget_missing(f"{context}.runup/runup.db")
+            db.open()
+
+            if read_repository_info(self._context)["storage"] == "packs":
+                packs = PackStore(self._context, db.digests[0], self._verbose)
+                packs.open()
+
+            if journal is not None:
+                journal.open()
+
+            with ThreadPoolExecutor(max_workers=len(backup_list)) as projects:
+                futures = [
+                    projects.submit(
+                        self._backup_project,
+                        db, cache, packs, journal, lock, cancelled,
+                        yaml_config["project"][backup], str(backup), compression[backup],
+                        rehash, paranoid, workers, taken, resumed.get(str(backup), 0),
+                    )
+                    for backup in backup_list
+                ]
+                try:
+                    for future in as_completed(futures):
+                        finished.append(future.result())
+                except BaseException:
+                    # Stop the other projects before rolling back
+                    cancelled.set()
+                    raise
+        except BaseException as e:
+            if packs is not None:
+                packs.close()
+            db.close(commit=False)
+            # The files rolled back, if the stat cache learned about them
+            cache.forget_missing(f"{context}.runup/runup.db")
+            # The jobs are gone, and the changes taken with them
+            if journal is not None:
+                journal.invalidate(taken)
+            if isinstance(e, BackupError):
+                click.secho(str(e), fg="red")
+                return False
+            raise
+        else:
+            try:
+                # The blobs must be durable before the DB references them
+                with get_tracer().span("commit"):
+                    if packs is not None:
+                        packs.close()
+                    db.close(commit=True)
+            except BaseException:
+                # Nothing was committed: the checkpoints and the zips are
+                # kept, so the jobs are recovered by the next backup
+                cache.forget_missing(f"{context}.runup/runup.db")
+                if journal is not None:
+                    journal.invalidate(taken)
+                raise
+            for job_id in finished:
+                if packs is None:
+                    os.replace(f"{context}.runup/jobs/{job_id}.partial", f"{context}.runup/jobs/{job_id}")
+                CheckpointJournal(self._context, job_id, self._verbose).remove()
+            # The projects share the process, so their jobs share the peak
+            vInfo(
                 self._verbose,
-                "Interpreter_1:_working_directories",
-                working_directories,
+                "Peak memory of the backup (process-wide, all projects): %.1f MiB",
+                (memory_high_water() / 1024 / 1024,),
             )
+        finally:
+            cache.close()
+            if journal is not None:
+                journal.close()
 
-            # Create DB backup
-            db: RunupDB = RunupDB(self._context, self._verbose)
-            vCall(self._verbose, "RunupDB:insert_job")
-            job_id: bool = db.insert_job(str(backup))
-            vResponse(self._verbose, "RunupDB:insert_job", job_id)
-            
-            # Zip File
-            with zipfile.ZipFile(f"{context}.runup/jobs/{job_id}", "w") as my_zip:
-
-                for path_from_pwd, path_from_yaml_file in working_directories.items():
-
-                    vCall(self._verbose, "RunupDB:insert_file")
-                    inserted_new: bool = db.insert_file(
-                        job_id, 
+        return True
+
+    cpdef _backup_project(
+        self,
+        RunupDB db,
+        StatCache cache,
+        PackStore packs,
+        Journal journal,
+        lock,
+        cancelled,
+        config: Dict[str, Any],
+        str backup,
+        tuple compression,
+        bint rehash,
+        double paranoid,
+        int workers,
+        list taken,
+        int resume_job,
+    ):
+        """
+        Create the job of a project, on its own thread.
+
+        Hashing and compression run on a pool of `workers` threads
+        (`project.*.workers` or the number of CPUs by default), while
+        this thread writes the entries, in order, to the job and DB.
+        The zip is written as `<job_id>.partial` and renamed once the
+        job is committed (see `create_backup()`). Every time the DB is
+        committed, the job records a checkpoint (see `_checkpoint()`).
+
+        If `resume_job` is set, that interrupted job goes on instead of
+        a new one: the files it already holds are skipped. Returns the
+        `job_id`, or `None` (leaving the job incomplete) if `cancelled`
+        is set because another project failed.
+        """
+
+        cdef Chunker chunker = None
+        cdef CheckpointJournal checkpoints
+        cdef Tracer tracer = get_tracer()
+        cdef int num_workers
+        cdef int committed = db.commits
+        cdef double started = time.monotonic()
+        cdef set done = set()
+
+        working_directories: Iterator[Tuple[str, str, os.stat_result]]
+
+        # Make context relative
+        context: str = str(self._context)
+        if not context.endswith(os.sep):
+            context += os.sep
+
+        with lock:
+            previous_job: int = db.last_job(backup)
+            dirty = None
+
+            if resume_job > 0:
+                job_id: int = resume_job
+                checkpoints = CheckpointJournal(self._context, job_id, self._verbose)
+                checkpoint = checkpoints.last()
+                if checkpoint is not None:
+                    started -= checkpoint["elapsed"]
+
+                vCall(self._verbose, "RunupDB:resume_job")
+                done = db.resume_job(job_id, 0 if checkpoint is None else checkpoint["stored"])
+                vResponse(self._verbose, "RunupDB:resume_job", len(done))
+            else:
+                # Create DB backup
+                vCall(self._verbose, "RunupDB:insert_job")
+                job_id = db.insert_job(backup)
+                vResponse(self._verbose, "RunupDB:insert_job", job_id)
+                checkpoints = CheckpointJournal(self._context, job_id, self._verbose)
+
+                # Paths changed since the previous job, if a watcher saw all of them
+                if journal is not None:
+                    dirty = journal.take(backup, config_fingerprint(config), time.time())
+                    taken.append(backup)
+
+            checkpoints.open(resume_job > 0)
+
+            # Files are backed up while the workspace is being scanned
+            if dirty is not None and previous_job > 0 and "" not in dirty:
+                vCall(self._verbose, "Interpreter_1:_changed_directories")
+                working_directories = self._changed_directories(
+                    db, config, previous_job, job_id, dirty
+                )
+            else:
+                vCall(self._verbose, "Interpreter_1:_working_directories")
+                working_directories = self._working_directories(config)
+
+        num_workers = self._num_workers(config, workers)
+        vInfo(self._verbose, "Using %s workers", num_workers)
+
+        # Time spent finding the files, hashing them, looking for their
+        # content in the DB, storing them and committing (see `Tracer`)
+        working_directories = tracer.iterate("scan", working_directories)
+        timed_chunk_file = tracer.wrap("hash", chunk_file)
+        timed_prepare_entry = tracer.wrap("hash", prepare_entry)
+
+        if config.get("chunking", "none") == "cdc":
+            chunker = Chunker()
+
+        # Entries waiting to be written, in the order they were found
+        pending: deque = deque()
+        entries = 0
+
+        compress_type, compresslevel = compression
+
+        # Zip File (the content goes to the packs if the repository uses them)
+        partial: str = f"{context}.runup/jobs/{job_id}.partial"
+        if packs is None:
+            if resume_job > 0 and os.path.exists(f"{context}.runup/jobs/{job_id}"):
+                os.replace(f"{context}.runup/jobs/{job_id}", partial)
+            archive = zipfile.ZipFile(
+                partial,
+                "a" if resume_job > 0 else "w",
+                compression=compress_type,
+                compresslevel=compresslevel,
+            )
+        else:
+            archive = nullcontext()
+
+        with archive as my_zip, ThreadPoolExecutor(max_workers=num_workers) as pool:
+
+            for path_from_pwd, path_from_yaml_file, stat_result in working_directories:
+
+                if cancelled.is_set():
+                    checkpoints.close()
+                    return None
+
+                if path_from_yaml_file in done:
+                    continue
+
+                cached = None
+                if stat.S_ISREG(stat_result.st_mode) and not rehash:
+                    with lock:
+                        cached = cache.lookup(backup, path_from_yaml_file, stat_result)
+
+                chunked = (
+                    chunker is not None
+                    and stat.S_ISREG(stat_result.st_mode)
+                    and stat_result.st_size >= CHUNKING_MIN_FILE_SIZE
+                )
+
+                if cached is not None and (paranoid <= 0 or random.random() * 100 >= paranoid):
+                    prepared = None
+                elif chunked:
+                    prepared = pool.submit(timed_chunk_file, path_from_pwd, db.digests, chunker)
+                else:
+                    prepared = pool.submit(
+                        timed_prepare_entry,
                         path_from_pwd,
-                        path_from_yaml_file
+                        path_from_yaml_file,
+                        stat_result,
+                        db.digests,
+                        compress_type,
+                        compresslevel,
                     )
-                    vResponse(self._verbose, "RunupDB:insert_file", inserted_new)
-                    
-                    if inserted_new:
-                        vInfo(self._verbose, f"Zipping file: {path_from_pwd}")
-                        my_zip.write(path_from_pwd, path_from_yaml_file)
-                    else:
-                        vInfo(self._verbose, f"Not zipping file: {path_from_pwd}")
 
-        return True
+                entries += 1
+                pending.append(
+                    (path_from_pwd, path_from_yaml_file, stat_result, cached, prepared, chunked)
+                )
+                if len(pending) >= num_workers * PIPELINE_DEPTH:
+                    self._write_entry(
+                        db, cache, my_zip, packs, lock, compression,
+                        backup, job_id, pending.popleft(),
+                    )
+                    if db.commits != committed or db.checkpoint_due():
+                        committed = self._checkpoint(
+                            db, packs, checkpoints, my_zip, lock, job_id, started
+                        )
+
+            while len(pending) > 0:
+                if cancelled.is_set():
+                    checkpoints.close()
+                    return None
+                self._write_entry(
+                    db, cache, my_zip, packs, lock, compression,
+                    backup, job_id, pending.popleft(),
+                )
+                if db.commits != committed or db.checkpoint_due():
+                    committed = self._checkpoint(
+                        db, packs, checkpoints, my_zip, lock, job_id, started
+                    )
+
+            # Everything is written: a crash from now on loses nothing
+            self._checkpoint(db, packs, checkpoints, my_zip, lock, job_id, started)
+            tracer.count("files", entries)
+
+            vInfo(self._verbose, "Job %s: %s entries", (job_id, entries))
+
+            if my_zip is not None:
+                original_size = sum([zinfo.file_size for zinfo in my_zip.infolist()])
+                stored_size = sum([zinfo.compress_size for zinfo in my_zip.infolist()])
+                vInfo(
+                    self._verbose,
+                    "Job %s: %s bytes stored in %s bytes (ratio %.2f)",
+                    (job_id, original_size, stored_size, original_size / max(stored_size, 1)),
+                )
+                with lock:
+                    db.count_stored(job_id, stored_size)
+
+        checkpoints.close()
+
+        # The zip is complete, and gets its final name once the job is committed
+        if packs is None:
+            with open(partial, "rb") as afile:
+                os.fsync(afile.fileno())
+
+        with lock:
+            db.finish_job(job_id, time.monotonic() - started)
+
+        return job_id
+
+    cdef int _checkpoint(
+        self,
+        RunupDB db,
+        PackStore packs,
+        CheckpointJournal checkpoints,
+        my_zip,
+        lock,
+        int job_id,
+        double started,
+    ) except -1:
+        """
+        Record a checkpoint of a job, and commit the DB if it is time to.
+
+        What the job wrote is made durable (the zip is synced, or the
+        packs) before the checkpoint is recorded, and the checkpoint is
+        recorded before the DB is committed: an interrupted job always
+        goes on from data that is on the disk. Returns the number of
+        commits of the DB so far.
+        """
+
+        cdef Tracer tracer = get_tracer()
+
+        with tracer.span("commit"):
+            if my_zip is not None:
+                my_zip.fp.flush()
+                os.fsync(my_zip.fp.fileno())
+
+            with lock:
+                if packs is not None:
+                    packs.sync()
+                last_file, last_chunk, stored = db.job_progress(job_id)
+                checkpoints.append(last_file, last_chunk, stored, time.monotonic() - started, my_zip)
+                tracer.count("checkpoints")
+                if db.checkpoint_due():
+                    db.checkpoint()
+                return db.commits
+
+    cdef int _recover_jobs(self, RunupDB db) except -1:
+        """
+        Clean up the jobs left `running` by a backup that crashed.
+
+        Every such job is cut back to its last checkpoint, in its zip
+        first and then in the DB. The zip gets a central directory and
+        its final name again, so the job can be restored with `--job`
+        or resumed. The zips of the jobs that were committed get their
+        final names too. Returns the number of jobs recovered.
+        """
+
+        cdef list interrupted = db.interrupted_jobs()
+
+        # Make context relative
+        context: str = str(self._context)
+        if not context.endswith(os.sep):
+            context += os.sep
+
+        # Once per project, in the order of their jobs
+        for name in dict.fromkeys([job[1] for job in interrupted]):
+            click.secho(f"The previous backup of `{name}` was interrupted.", fg="yellow")
+
+        for job_id, project in interrupted:
+            checkpoint = CheckpointJournal(self._context, job_id, self._verbose).last()
+            if checkpoint is None:
+                checkpoint = {"file": 0, "chunk": 0, "offset": 0, "entries": []}
+
+            for path in (f"{context}.runup/jobs/{job_id}.partial", f"{context}.runup/jobs/{job_id}"):
+                if os.path.exists(path):
+                    recover_zip(path, checkpoint["offset"] or 0, checkpoint["entries"])
+                    os.replace(path, f"{context}.runup/jobs/{job_id}")
+                    break
+
+            kept = db.recover_job(job_id, checkpoint["file"], checkpoint["chunk"])
+            vInfo(self._verbose, "Job %s of `%s` recovered with %s files", (job_id, project, kept))
+
+        # Jobs committed by a backup that crashed before renaming their zips
+        for name in os.listdir(f"{context}.runup/jobs"):
+            if name.endswith(".partial") and db.job_state(int(name[:-8])) == "finished":
+                os.replace(f"{context}.runup/jobs/{name}", f"{context}.runup/jobs/{name[:-8]}")
+                CheckpointJournal(self._context, int(name[:-8]), self._verbose).remove()
+
+        return len(interrupted)
+
+    cdef void _write_entry(
+        self,
+        RunupDB db,
+        StatCache cache,
+        my_zip,
+        PackStore packs,
+        lock,
+        tuple compression,
+        str project,
+        int job_id,
+        tuple entry,
+    ) except *:
+        """
+        Write a file to the job (or the packs) and the DB once it has been prepared.
+
+        The DB, the stat cache and the packs are only used while holding
+        `lock`; the zip of the job belongs to the thread of the project.
+        Raises `BackupError` if the file can't be read or written.
+        """
+
+        cdef Tracer tracer = get_tracer()
+
+        path_from_pwd, path_from_yaml_file, stat_result, cached, prepared, chunked = entry
+        size = stat_result.st_size if not stat.S_ISDIR(stat_result.st_mode) else None
+
+        try:
+            if prepared is None:
+                vInfo(self._verbose, "Unchanged file (stat cache): %s", path_from_pwd)
+                tracer.count("unchanged_files")
+                with lock, tracer.span("dedup"):
+                    db.insert_file_copy(job_id, path_from_yaml_file, cached[0], cached[1], size)
+                return
+
+            zinfo = data = chunks = None
+            if chunked:
+                signature, chunks = prepared.result()
+            else:
+                signature, zinfo, data = prepared.result()
+            tracer.count("hashed_bytes", size or 0)
+
+            with lock:
+                vCall(self._verbose, "RunupDB:insert_file")
+                with tracer.span("dedup"):
+                    inserted_new, content_id = db.insert_file(job_id, path_from_yaml_file, signature, size)
+                vResponse(self._verbose, "RunupDB:insert_file", inserted_new)
+
+                if stat.S_ISREG(stat_result.st_mode):
+                    cache.store(project, path_from_yaml_file, stat_result, signature, content_id)
+            tracer.count("new_contents" if inserted_new else "duplicate_contents")
+
+            if cached is not None and cached[0] != signature:
+                click.secho(
+                    f"Warning: `{path_from_yaml_file}` changed without changing its stat info.",
+                    fg="yellow",
+                )
+
+            if inserted_new and packs is not None:
+                vInfo(self._verbose, "Packing file: %s", path_from_pwd)
+                if chunks is not None:
+                    self._write_chunks(
+                        db, my_zip, packs, lock, compression, job_id, content_id, path_from_pwd, chunks
+                    )
+                elif zinfo is not None:
+                    with lock, tracer.span("write"):
+                        db.count_stored(
+                            job_id,
+                            packs.put(
+                                bytes.fromhex(signature[0]), data, zinfo.compress_type, zinfo.file_size
+                            ),
+                        )
+                elif stat.S_ISREG(stat_result.st_mode):
+                    with lock, tracer.span("write"):
+                        db.count_stored(
+                            job_id,
+                            packs.put_file(
+                                bytes.fromhex(signature[0]),
+                                path_from_pwd,
+                                compression_for(path_from_pwd, None, compression[0]),
+                                compression[1],
+                            ),
+                        )
+            elif inserted_new:
+                vInfo(self._verbose, "Zipping file: %s", path_from_pwd)
+                if chunks is not None:
+                    self._write_chunks(
+                        db, my_zip, packs, lock, compression, job_id, content_id, path_from_pwd, chunks
+                    )
+                else:
+                    with tracer.span("write"):
+                        if zinfo is not None:
+                            write_entry(my_zip, zinfo, data)
+                        elif stat.S_ISREG(stat_result.st_mode):
+                            my_zip.write(
+                                path_from_pwd,
+                                path_from_yaml_file,
+                                compress_type=compression_for(path_from_pwd, None, compression[0]),
+                            )
+                        else:
+                            my_zip.write(path_from_pwd, path_from_yaml_file)
+            else:
+                vInfo(self._verbose, "Not zipping file: %s", path_from_pwd)
+        except OSError as e:
+            raise BackupError(f"Could not back up `{path_from_yaml_file}`: {e}") from e
+
+    cdef void _write_chunks(
+        self,
+        RunupDB db,
+        my_zip,
+        PackStore packs,
+        lock,
+        tuple compression,
+        int job_id,
+        int file_id,
+        str path_from_pwd,
+        list chunks,
+    ) except *:
+        """Store the chunks of a file that are not stored yet and record its chunk list."""
+
+        cdef list chunk_ids = []
+        cdef int chunk_id
+        cdef Tracer tracer = get_tracer()
+
+        with open(path_from_pwd, "rb") as afile:
+            for digest, offset, size in chunks:
+                # Held until the chunk is stored, so no other project stores it too
+                with lock:
+                    with tracer.span("dedup"):
+                        chunk_id = db.find_chunk(digest)
+                    if chunk_id == 0:
+                        vInfo(self._verbose, "Zipping chunk: %s", digest)
+                        tracer.count("new_chunks")
+                        with tracer.span("write"):
+                            afile.seek(offset)
+                            data = afile.read(size)
+                            if packs is not None:
+                                db.count_stored(
+                                    job_id,
+                                    packs.put_data(
+                                        bytes.fromhex(digest),
+                                        data,
+                                        compression_for(path_from_pwd, data, compression[0]),
+                                        compression[1],
+                                    ),
+                                )
+                            else:
+                                my_zip.writestr(
+                                    f".chunks/{digest}",
+                                    data,
+                                    compress_type=compression_for(path_from_pwd, data, compression[0]),
+                                )
+                            chunk_id = db.insert_chunk(job_id, digest, size)
+                chunk_ids.append(chunk_id)
+
+        with lock:
+            db.insert_file_chunks(file_id, chunk_ids)
+
+    cdef _compression(self, config: Dict[str, Any]):
+        """
+        Compression method and level of a project.
+
+        Returns `None` (after showing the reason) if they are not valid.
+        """
+
+        settings: Dict[str, Any] = config.get("compression", {})
+        method: str = settings.get("method", "stored")
+        level: Optional[int] = settings.get("level", None)
+
+        if method not in COMPRESSION_METHODS:
+            click.echo(
+                "The compression method must be one of: " + ", ".join(COMPRESSION_METHODS.keys())
+            )
+            return None
+
+        if level is not None and (
+            (method == "deflate" and not 0 <= level <= 9)
+            or (method == "bzip2" and not 1 <= level <= 9)
+        ):
+            click.echo(f"Invalid compression level {level} for the method `{method}`.")
+            return None
+
+        return COMPRESSION_METHODS[method], level
+
+    cdef int _num_workers(self, config: Dict[str, Any], int workers):
+        """Number of threads used to hash and compress the files."""
+
+        if workers > 0:
+            return workers
+        if "workers" in config and config["workers"] > 0:
+            return config["workers"]
+        return os.cpu_count() or 1
+
+    cpdef restore_backup(
+        self,
+        yaml_config,
+        str project,
+        str location,
+        int job,
+        bint force,
+        int workers=0,
+        bint sync=False,
+        list paths=None,
+    ):
+        """
+        Restore a backup
 
-    cpdef restore_backup(self, yaml_config, str project, str location, int job, bint force):
-        """Restore a backup"""
+        With `paths`, only the files that match one of the patterns (see
+        `path_filter()`) are restored, and only the jobs that hold them
+        are read.
+        """
 
         initiated: bool = self._validate_prev_init(yaml_config)
         if not initiated:
@@ -268,18 +982,52 @@ cdef class Interpreter_1(Interpreter):
         if not context.endswith(os.sep):
             context += os.sep
 
+        packs: PackStore = self._open_packs()
+        try:
+            self._restore_projects(
+                yaml_config, projects, context, location, job, force, workers, sync, paths or [], packs
+            )
+        finally:
+            if packs is not None:
+                packs.close()
+
+        return True
+
+    cdef _restore_projects(
+        self,
+        yaml_config,
+        projects,
+        str context,
+        str location,
+        int job,
+        bint force,
+        int workers,
+        bint sync,
+        list paths,
+        PackStore packs,
+    ):
+        """Restore the projects, one after another."""
+
         for project_name in projects:
 
             # Read DB backup
             db: RunupDB = RunupDB(self._context, self._verbose)
+            job_id: int = db.find_job(job, project_name)
+            if job_id == 0:
+                click.secho(
+                    f'The project "{project_name}" is not part of the job {job}.',
+                    fg="red",
+                )
+                continue
+
             vCall(self._verbose, "RunupDB:select_job")
-            job_data = db.select_job(job, project_name)
-            vResponse(self._verbose, "RunupDB:select_job", job_data)
+            job_data = db.select_job(job_id, project_name, paths)
+            vResponse(self._verbose, "RunupDB:select_job", len(job_data))
 
             if len(job_data) == 0:
                 click.secho(
-                    f'The project "{project_name}" is not part of the job {job}.',
-                    fg="red",
+                    f'No file of the project "{project_name}" matches the paths.',
+                    fg="yellow",
                 )
                 continue
 
@@ -294,62 +1042,654 @@ cdef class Interpreter_1(Interpreter):
                 if confirmation == "n" or confirmation == "no":
                     continue
 
-            # Dictionary with location of data.
-            # ------------------------------------------------------
-            # The key is the id of the job where the file is located
-            # and the value is another dictionary where its key is
-            # the path of the destination file and the value is the
-            # path of the file in the job.
-            restoration_source: Dict[str, Dict[str, str]] = {}
+            sources, chunked_files, signatures = self._resolve_job(job_data, packs)
+            num_workers: int = self._num_workers(yaml_config["project"][project_name], workers)
+
+            # Files already identical at the destination
+            up_to_date: Set[str] = set()
+            if sync:
+                up_to_date = self._sync_destination(
+                    db,
+                    yaml_config["project"][project_name],
+                    str(project_name),
+                    location,
+                    signatures,
+                    num_workers,
+                    paths,
+                )
 
-            for (
-                job_if_original,
-                path_if_original,
-                job_if_copy,
-                path_if_copy,
-            ) in job_data:
-                if job_if_copy is not None:
-                    if job_if_copy not in restoration_source:
-                        restoration_source[job_if_copy] = {}
-                    restoration_source[job_if_copy][path_if_original] = path_if_copy
-                else:
-                    if job_if_original not in restoration_source:
-                        restoration_source[job_if_original] = {}
-                    restoration_source[job_if_original][
-                        path_if_original
-                    ] = path_if_original
-
-            for job_id, file_dict in restoration_source.items():
-                with zipfile.ZipFile(f"{context}.runup/jobs/{job_id}") as myzip:
-                    for dst, src in file_dict.items():
-
-                        while src.startswith("./"):
-                            src = src[2:]
-
-                        while dst.startswith("./"):
-                            dst = dst[2:]
-                        dst = str(f"{location.strip('/')}/{dst}")
-
-                        # Try to get File info
-                        try:
-                            src_info = myzip.getinfo(src)
-                        # If is an empty directory
-                        except KeyError:
-                            dst = f"{context}{dst}"
-                            if not os.path.exists(dst):
-                                os.mkdir(dst)
-                        # else
-                        else:
-                            src_info.filename = dst
-                            myzip.extract(src_info)
+            # Destination paths
+            files: List[Tuple[int, str, str]] = [
+                (job_id, src, self._destination(location, path))
+                for job_id, src, path in sources
+                if path not in up_to_date
+            ]
+
+            chunks: List[Tuple[List[Any], str]] = []
+            for dst, file_id in chunked_files.items():
+                if dst not in up_to_date:
+                    chunks.append((db.select_chunks(file_id), self._destination(location, dst)))
+
+            vInfo(self._verbose, "Restoring %s files", len(files) + len(chunks))
+            Restorer(context, self._verbose, packs).restore(files, chunks, num_workers)
 
             click.secho(
                 f'A backup for the project "{project_name}" has been restored.',
                 fg="green",
             )
 
+    cpdef bint export_backup(self, yaml_config, str project, int job, str fmt, output):
+        """Write the files of a job, wherever they are stored, as a single archive."""
+
+        initiated: bool = self._validate_prev_init(yaml_config)
+        if not initiated:
+            return False
+
+        # Make context relative
+        context: str = str(self._context)
+        if not context.endswith(os.sep):
+            context += os.sep
+
+        db: RunupDB = RunupDB(self._context, self._verbose)
+        vCall(self._verbose, "RunupDB:select_job")
+        job_data = db.select_job(job, project)
+        vResponse(self._verbose, "RunupDB:select_job", job_data)
+
+        if len(job_data) == 0:
+            click.secho(f'The project "{project}" is not part of the job {job}.', fg="red", err=True)
+            return False
+
+        packs: PackStore = self._open_packs()
+        try:
+            sources, chunked_files, _ = self._resolve_job(job_data, packs)
+
+            files: List[Tuple[int, str, str]] = [
+                (job_id, src, self._clean_path(path)) for job_id, src, path in sources
+            ]
+
+            chunks: List[Tuple[List[Any], str]] = []
+            for path, file_id in chunked_files.items():
+                chunks.append((db.select_chunks(file_id), self._clean_path(path)))
+
+            vInfo(self._verbose, "Exporting %s files", len(files) + len(chunks))
+            Exporter(context, self._verbose, packs).export(output, fmt, files, chunks)
+        finally:
+            if packs is not None:
+                packs.close()
+
+        return True
+
+    cpdef bint prune_backups(
+        self,
+        yaml_config,
+        str project,
+        int keep_last,
+        int keep_daily,
+        int keep_weekly,
+        bint dry_run=False,
+    ):
+        """
+        Delete the jobs not kept by the retention policy and their unused content.
+
+        Content of a deleted job still used by a kept job is handed over
+        to the oldest job that uses it (in the DB and, with one zip per
+        job, by copying the entries between the zips without
+        recompressing them) before the job is deleted. With packs, the
+        packs that became mostly garbage are rewritten.
+        """
+
+        initiated: bool = self._validate_prev_init(yaml_config)
+        if not initiated:
+            return False
+
+        if keep_last <= 0 and keep_daily <= 0 and keep_weekly <= 0:
+            click.echo("At least one of --keep-last, --keep-daily or --keep-weekly is required.")
+            return False
+
+        if project != "":
+            projects = [project]
+        else:
+            projects = yaml_config["project"].keys()
+
+        # Make context relative
+        context: str = str(self._context)
+        if not context.endswith(os.sep):
+            context += os.sep
+
+        db: RunupDB = RunupDB(self._context, self._verbose)
+        dead_jobs: List[int] = []
+        for project_name in projects:
+            vCall(self._verbose, "RunupDB:select_jobs")
+            jobs = db.select_jobs(str(project_name))
+            vResponse(self._verbose, "RunupDB:select_jobs", jobs)
+
+            keep = jobs_to_keep(jobs, keep_last, keep_daily, keep_weekly)
+            dead = [job_id for job_id, _ in jobs if job_id not in keep]
+            click.echo(
+                f'Project "{project_name}": keeping {len(keep)} jobs, pruning {len(dead)}'
+                + (" (" + ", ".join([str(job_id) for job_id in dead]) + ")" if dead else "")
+            )
+            dead_jobs.extend(dead)
+
+        if dry_run or len(dead_jobs) == 0:
+            return True
+
+        use_packs: bool = read_repository_info(self._context)["storage"] == "packs"
+
+        db.open(index=False)
+        try:
+            moves = db.prune_jobs(dead_jobs)
+            if not use_packs:
+                self._move_entries(context, moves)
+            moved_files = db.select_moved_files()
+        except BaseException:
+            db.close(commit=False)
+            raise
+        else:
+            db.close(commit=True)
+
+        # Nothing references the deleted jobs anymore
+        for job_id in dead_jobs:
+            for suffix in ("", ".partial", ".checkpoints"):
+                if os.path.exists(f"{context}.runup/jobs/{job_id}{suffix}"):
+                    os.remove(f"{context}.runup/jobs/{job_id}{suffix}")
+        if os.path.exists(f"{context}.runup/bloom"):
+            os.remove(f"{context}.runup/bloom")
+
+        cache: StatCache = StatCache(self._context, self._verbose)
+        cache.open()
+        cache.remap(moved_files)
+        cache.forget_missing(f"{context}.runup/runup.db")
+        cache.close()
+
+        if use_packs:
+            packs: PackStore = self._open_packs()
+            db.open(index=False)
+            try:
+                # The bound method, not the C function of the typed `db`
+                removed, freed = packs.repack((<object>db).has_content)
+            finally:
+                db.close(commit=False)
+                packs.close()
+            if removed > 0:
+                click.echo(f"{removed} packs have been rewritten, {freed} bytes freed.")
+
+        click.secho(f"{len(dead_jobs)} jobs have been pruned.", fg="green")
+        return True
+
+    cpdef bint watch_projects(self, yaml_config, str project, double timeout=0):
+        """
+        Watch the projects and record their changes in the journal.
+
+        Runs until interrupted, or for `timeout` seconds if it is not
+        zero. Meanwhile, the backups only visit the changed paths.
+        """
+
+        initiated: bool = self._validate_prev_init(yaml_config)
+        if not initiated:
+            return False
+
+        if project != "":
+            projects = [project]
+        else:
+            projects = yaml_config["project"].keys()
+
+        watcher: Watcher = Watcher(
+            self._context,
+            {str(name): yaml_config["project"][name] for name in projects},
+            self._verbose,
+        )
+        try:
+            watcher.start()
+            watcher.run(None, timeout)
+        except KeyboardInterrupt:
+            pass
+        except OSError as e:
+            click.secho(f"Can't watch the projects: {e}", fg="red")
+            return False
+        finally:
+            watcher.close()
+
+        return True
+
+    cpdef bint list_jobs(self, yaml_config, str project):
+        """
+        Show the summary of the jobs of a project (or of every project).
+
+        The summaries are written when the jobs finish, so the files of
+        the jobs are not read.
+        """
+
+        initiated: bool = self._validate_prev_init(yaml_config)
+        if not initiated:
+            return False
+
+        db: RunupDB = RunupDB(self._context, self._verbose)
+        vCall(self._verbose, "RunupDB:select_summaries")
+        summaries: List[Tuple[Any, ...]] = db.select_summaries(project)
+        vResponse(self._verbose, "RunupDB:select_summaries", len(summaries))
+
+        if len(summaries) == 0:
+            click.echo("There are no jobs yet.")
+            return True
+
+        for line in job_lines(summaries):
+            click.echo(line)
+        return True
+
+    cpdef bint show_stats(self, yaml_config, str project):
+        """Show the totals of the finished jobs of a project (or of every project)."""
+
+        initiated: bool = self._validate_prev_init(yaml_config)
+        if not initiated:
+            return False
+
+        db: RunupDB = RunupDB(self._context, self._verbose)
+        vCall(self._verbose, "RunupDB:select_totals")
+        totals: List[Tuple[Any, ...]] = db.select_totals(project)
+        vResponse(self._verbose, "RunupDB:select_totals", len(totals))
+
+        if len(totals) == 0:
+            click.echo("There are no jobs yet.")
+            return True
+
+        for line in stats_lines(totals):
+            click.echo(line)
+        return True
+
+    cpdef bint list_files(self, yaml_config, str project, int job, list patterns, bint details=False):
+        """
+        Show the files of a job of a project, sorted by path.
+
+        Only the files that match one of the `patterns`, if any (see
+        `path_filter()`). Directories end with `/`. With `details`, the
+        size and the start of the first digest are shown too. Nothing is
+        extracted: the files are listed from the DB, as they are read.
+        """
+
+        initiated: bool = self._validate_prev_init(yaml_config)
+        if not initiated:
+            return False
+
+        db: RunupDB = RunupDB(self._context, self._verbose)
+        job_id: int = db.find_job(job, project)
+        if job_id == 0:
+            click.secho(f'The project "{project}" is not part of the job {job}.', fg="red")
+            return False
+
+        db.open(index=False)
+        try:
+            for path, size, digest in db.job_files(job_id, patterns):
+                if digest == "":
+                    path += "/"
+                if details:
+                    click.echo(f"{'-' if size is None else size:>12}  {digest[:16]:<16}  {path}")
+                else:
+                    click.echo(path)
+        finally:
+            db.close(commit=False)
+
+        return True
+
+    cpdef bint compare_jobs(self, yaml_config, str project, int old_job, int new_job):
+        """
+        Show the paths added (`+`), removed (`-`) and modified (`M`) from a job to another one.
+
+        The differences are computed by the DB and shown as they are read.
+        """
+
+        cdef int added = 0
+        cdef int removed = 0
+        cdef int modified = 0
+
+        initiated: bool = self._validate_prev_init(yaml_config)
+        if not initiated:
+            return False
+
+        db: RunupDB = RunupDB(self._context, self._verbose)
+        old_id: int = db.find_job(old_job, project)
+        new_id: int = db.find_job(new_job, project)
+        for job, job_id in ((old_job, old_id), (new_job, new_id)):
+            if job_id == 0:
+                click.secho(f'The project "{project}" is not part of the job {job}.', fg="red")
+                return False
+
+        db.open(index=False)
+        try:
+            for change, path in db.diff_jobs(old_id, new_id):
+                click.echo(f"{change} {path}")
+                if change == "+":
+                    added += 1
+                elif change == "-":
+                    removed += 1
+                else:
+                    modified += 1
+        finally:
+            db.close(commit=False)
+
+        click.echo(f"{added} added, {removed} removed, {modified} modified.")
         return True
 
+    cpdef bint verify_backups(
+        self, yaml_config, str project, int job, double sample=0, double time_limit=0, int workers=0
+    ):
+        """
+        Check that the stored contents still match their signatures.
+
+        Every content used by the job `job` of `project`, by any job of
+        `project` or, if it is empty, by any job at all, is read back
+        and hashed (see `Verifier`), the least recently verified first.
+        `sample` is the percentage of them that is checked (all of them
+        if zero) and `time_limit` the seconds after which no more are
+        started, so a scrub limited in time goes on where the previous
+        one stopped. The contents found intact are remembered as
+        verified. Returns `False` if any content is damaged.
+        """
+
+        cdef PackStore packs
+        cdef dict counts = {"ok": 0, "mismatched": 0, "missing": 0, "unreadable": 0}
+        cdef long long read_bytes = 0
+        cdef double started
+
+        initiated: bool = self._validate_prev_init(yaml_config)
+        if not initiated:
+            return False
+
+        # Make context relative
+        context: str = str(self._context)
+        if not context.endswith(os.sep):
+            context += os.sep
+
+        db: RunupDB = RunupDB(self._context, self._verbose)
+        job_id: int = 0
+        if job > 0:
+            job_id = db.find_job(job, project)
+            if job_id == 0:
+                click.secho(f'The project "{project}" is not part of the job {job}.', fg="red")
+                return False
+
+        vCall(self._verbose, "RunupDB:select_contents")
+        rows = db.select_contents(project, job_id)
+        vResponse(self._verbose, "RunupDB:select_contents", len(rows))
+        if 0 < sample < 100:
+            rows = [row for row in rows if random.random() * 100 < sample]
+
+        contents: List[Tuple[Any, ...]] = [
+            (
+                blob_id,
+                content_job,
+                self._clean_path(path),
+                tuple(signature),
+                db.select_chunks(file_id) if chunked else None,
+            )
+            for blob_id, file_id, content_job, path, chunked, *signature in rows
+        ]
+
+        started = time.monotonic()
+        packs = self._open_packs()
+        try:
+            results = Verifier(context, db.digests, self._verbose, packs).verify(
+                contents, self._num_workers(yaml_config["project"].get(project, {}), workers), time_limit
+            )
+        finally:
+            if packs is not None:
+                packs.close()
+
+        for content, status, size, detail in results:
+            counts[status] += 1
+            read_bytes += size
+            if status != "ok":
+                click.secho(
+                    f"{status.capitalize()}: {content[2]} (job {content[1]})"
+                    + (f": {detail}" if detail != "" else ""),
+                    fg="red",
+                )
+
+        db.mark_verified(
+            [content[0] for content, status, _, _ in results if status == "ok"], int(time.time())
+        )
+
+        duration: float = time.monotonic() - started
+        click.echo(
+            f"{len(results)} contents verified ({format_size(read_bytes)}) in "
+            + f"{format_duration(duration)}, {format_speed(read_bytes, duration)}: "
+            + f"{counts['ok']} intact, {counts['mismatched']} mismatched, "
+            + f"{counts['missing']} missing, {counts['unreadable']} unreadable."
+        )
+        if len(results) < len(contents):
+            click.echo(f"{len(contents) - len(results)} contents left for the next verification.")
+
+        return counts["ok"] == len(results)
+
+    cdef _move_entries(self, str context, moves):
+        """
+        Copy entries between the zips of the jobs, as listed by `RunupDB.prune_jobs()`.
+
+        Entries missing from their job (directories and chunked files)
+        and entries already copied are skipped.
+        """
+
+        src_job = None
+        src_zip = None
+        targets: Dict[int, zipfile.ZipFile] = {}
+
+        try:
+            for job_id, src_name, dst_job, dst_name in moves:
+                if job_id != src_job:
+                    if src_zip is not None:
+                        src_zip.close()
+                    src_job = job_id
+                    src_zip = zipfile.ZipFile(f"{context}.runup/jobs/{job_id}")
+
+                try:
+                    zinfo = src_zip.getinfo(self._clean_path(src_name))
+                except KeyError:
+                    continue
+
+                if dst_job not in targets:
+                    targets[dst_job] = zipfile.ZipFile(f"{context}.runup/jobs/{dst_job}", "a")
+                arcname: str = self._clean_path(dst_name)
+                if arcname in targets[dst_job].NameToInfo:
+                    continue
+
+                vInfo(self._verbose, "Moving %s from job %s to job %s", (src_name, job_id, dst_job))
+                copy_entry(src_zip, zinfo, targets[dst_job], arcname)
+        finally:
+            if src_zip is not None:
+                src_zip.close()
+            for target in targets.values():
+                target.close()
+
+    cdef PackStore _open_packs(self):
+        """The `PackStore` of the repository, open. `None` if it stores one zip per job."""
+
+        cdef PackStore packs = None
+        cdef dict info = read_repository_info(self._context)
+
+        if info["storage"] == "packs":
+            packs = PackStore(self._context, info["digests"][0], self._verbose)
+            packs.open()
+        return packs
+
+    cdef tuple _resolve_job(self, list job_data, PackStore packs):
+        """
+        Find where the content of every file of a job is stored.
+
+        Returns a tuple `(sources, chunked_files, signatures)` where
+        `sources` is a list of `(job_id, src, path)` with the files that
+        are not chunked: `src` is the path of the content in the job
+        `job_id` or, if the repository uses packs, its digest.
+        """
+
+        # Dictionary with location of data.
+        # ------------------------------------------------------
+        # The key is the id of the job where the file is located
+        # and the value is another dictionary where its key is
+        # the path of the destination file and the value is the
+        # path of the file in the job.
+        restoration_source: Dict[str, Dict[str, str]] = {}
+
+        # Files stored as chunks. The key is the destination path
+        # and the value is the `file_id` of its list of chunks.
+        chunked_files: Dict[str, int] = {}
+
+        # Signature of every file of the job, by destination path.
+        signatures: Dict[str, Tuple[str, ...]] = {}
+
+        for row in job_data:
+            (
+                job_if_original,
+                path_if_original,
+                job_if_copy,
+                path_if_copy,
+                content_id,
+                chunked,
+            ) = row[:6]
+            signatures[path_if_original] = tuple(row[6:])
+            if chunked:
+                chunked_files[path_if_original] = content_id
+            elif job_if_copy is not None:
+                if job_if_copy not in restoration_source:
+                    restoration_source[job_if_copy] = {}
+                restoration_source[job_if_copy][path_if_original] = path_if_copy
+            else:
+                if job_if_original not in restoration_source:
+                    restoration_source[job_if_original] = {}
+                restoration_source[job_if_original][
+                    path_if_original
+                ] = path_if_original
+
+        if packs is not None:
+            sources = [
+                (0, signature[0], path)
+                for path, signature in signatures.items()
+                if path not in chunked_files
+            ]
+        else:
+            sources = [
+                (job_id, self._clean_path(src), path)
+                for job_id, file_dict in restoration_source.items()
+                for path, src in file_dict.items()
+            ]
+
+        return sources, chunked_files, signatures
+
+    cdef str _clean_path(self, str path):
+        """Path without the leading `./`."""
+
+        while path.startswith("./"):
+            path = path[2:]
+        return path
+
+    cdef str _destination(self, str location, str path):
+        """Path where a file of the project is restored."""
+        return str(f"{location.strip('/')}/{self._clean_path(path)}").lstrip("/")
+
+    cdef set _sync_destination(
+        self,
+        RunupDB db,
+        config: Dict[str, Any],
+        str project,
+        str location,
+        dict signatures,
+        int workers,
+        list paths,
+    ):
+        """
+        Compare the destination with the job before a "sync" restoration.
+
+        Files with the signature they have in the job are left alone:
+        when their stat info matches the stat cache they are not even
+        read, otherwise they are hashed. Files and directories that are
+        not part of the job are deleted, except the excluded ones and,
+        when only some `paths` are restored, the ones that don't match.
+
+        Returns the set of paths (as stored in the DB) that do not need
+        to be restored.
+        """
+
+        cdef set up_to_date = set()
+        cdef set wanted = set()
+        cdef set parents = set()
+        cdef list to_hash = []
+        cdef list filters = [re.compile(path_filter(pattern)[1]) for pattern in paths]
+        cdef StatCache cache = StatCache(self._context, self._verbose)
+
+        # Compare the files of the job
+        cache.open()
+        try:
+            for path, signature in signatures.items():
+                dst = self._destination(location, path)
+                wanted.add(os.path.normpath(dst))
+
+                # Directories have an empty signature
+                if signature[0] == "":
+                    if os.path.isdir(dst):
+                        up_to_date.add(path)
+                    elif os.path.lexists(dst):
+                        os.remove(dst)
+                    continue
+
+                if os.path.isdir(dst) and not os.path.islink(dst):
+                    shutil.rmtree(dst)
+                    continue
+                if not os.path.isfile(dst):
+                    if os.path.lexists(dst):
+                        os.remove(dst)
+                    continue
+
+                cached = cache.lookup(project, path, os.stat(dst))
+                if cached is not None and cached[0] == signature:
+                    vInfo(self._verbose, "Unchanged file (stat cache): %s", dst)
+                    up_to_date.add(path)
+                else:
+                    to_hash.append((path, dst, signature))
+        finally:
+            cache.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            hashes = pool.map(hash_file, [dst for _, dst, _ in to_hash], [db.digests] * len(to_hash))
+            for (path, dst, signature), current in zip(to_hash, hashes):
+                if current == signature:
+                    vInfo(self._verbose, "Unchanged file: %s", dst)
+                    up_to_date.add(path)
+
+        # Delete what is not part of the job
+        for dst in wanted:
+            parent = os.path.dirname(dst)
+            while parent != "" and parent not in parents:
+                parents.add(parent)
+                parent = os.path.dirname(parent)
+
+        # Directories are listed before their content: delete them in reverse order
+        scanner: Scanner = Scanner(
+            os.path.normpath(self._destination(location, ".")), config.get("exclude", []), self._verbose
+        )
+        unwanted_dirs: List[str] = []
+        for inc in config["include"]:
+            root = os.path.normpath(self._destination(location, inc))
+            if not os.path.isdir(root) or root not in parents | wanted:
+                continue
+            for full_path, path, stat_result in scanner.scan([inc], all_dirs=True):
+                if full_path in wanted or full_path in parents:
+                    continue
+                if filters and not any([regex.match(path) for regex in filters]):
+                    continue
+                if stat.S_ISDIR(stat_result.st_mode):
+                    unwanted_dirs.append(full_path)
+                else:
+                    vInfo(self._verbose, "Deleting file: %s", full_path)
+                    os.remove(full_path)
+
+        for full_path in reversed(unwanted_dirs):
+            # Directories with excluded content are kept
+            if len(os.listdir(full_path)) == 0:
+                vInfo(self._verbose, "Deleting directory: %s", full_path)
+                os.rmdir(full_path)
+
+        vInfo(self._verbose, "%s files already up to date", len(up_to_date))
+        return up_to_date
+
     def missing_parameter(
         self, yaml_config: Dict[str, Any], search_area: Optional[List[str]] = None
     ) -> Optional[str]:
@@ -359,7 +1699,7 @@ cdef class Interpreter_1(Interpreter):
             search_area = self._required_parameters
 
         for parameter in search_area:
-            vInfo(self._verbose, f"Analysing parameter `{parameter}`")
+            vInfo(self._verbose, "Analysing parameter `%s`", parameter)
             vCall(self._verbose, "Interpreter_1:missing_parameter_part")
             missing_part: Optional[str] = self.missing_parameter_part(
                 yaml_config, parameter
@@ -368,7 +1708,7 @@ cdef class Interpreter_1(Interpreter):
                 self._verbose, "Interpreter_1:missing_parameter_part", missing_part
             )
             if missing_part:
-                vInfo(self._verbose, f"missing parameter part `{missing_part}`")
+                vInfo(self._verbose, "missing parameter part `%s`", missing_part)
                 return missing_part
 
         return None
@@ -379,15 +1719,10 @@ cdef class Interpreter_1(Interpreter):
         """Analyse each part of a parameter looking for missing parts."""
 
         if "." not in parameter:
-            vInfo(
-                self._verbose, f"Parameter `{parameter}` doesn't have sub-paramenters"
-            )
+            vInfo(self._verbose, "Parameter `%s` doesn't have sub-paramenters", parameter)
             if parameter == "*":
                 if search_area is not None and len(search_area) > 0:
-                    vInfo(
-                        self._verbose,
-                        f"YAML file cointains {len(search_area)} parameters.",
-                    )
+                    vInfo(self._verbose, "YAML file cointains %s parameters.", len(search_area))
                     return None
                 elif search_area is not None:
                     vInfo(self._verbose, "YAML file cointains no parameters.")
@@ -396,26 +1731,20 @@ cdef class Interpreter_1(Interpreter):
                     vInfo(self._verbose, "YAML file cointains no parameters.")
                     return None
             elif parameter not in search_area.keys():
-                vInfo(
-                    self._verbose,
-                    f"Single parameter `{parameter}` not found in search area",
-                )
+                vInfo(self._verbose, "Single parameter `%s` not found in search area", parameter)
                 return parameter
         else:
-            vInfo(self._verbose, f"Parameter `{parameter}` have sub-paramenters")
+            vInfo(self._verbose, "Parameter `%s` have sub-paramenters", parameter)
             missing: Optional[str] = None
 
             parts = parameter.split(".", 1)
             vInfo(
-                self._verbose,
-                f"Search `{parts[0]}` in search_area {list(search_area.keys())}",
+                self._verbose, "Search `%s` in search_area %s", (parts[0], list(search_area.keys()))
             )
             if (parts[0] == "*" and len(search_area) > 0) or parts[
                 0
             ] in search_area.keys():
-                vInfo(
-                    self._verbose, f"Parameter part `{parts[0]}` found in search area."
-                )
+                vInfo(self._verbose, "Parameter part `%s` found in search area.", parts[0])
 
                 if parts[0] != "*":
                     vCall(self._verbose, "Interpreter_1:missing_parameter_part")
@@ -449,51 +1778,48 @@ cdef class Interpreter_1(Interpreter):
                 else:
                     return f"{parameter}"
             else:
-                vInfo(
-                    self._verbose,
-                    f"Parameter part `{parts[0]}` not found in search area",
-                )
+                vInfo(self._verbose, "Parameter part `%s` not found in search area", parts[0])
                 return parts[0]
 
         return None
 
-    def set_environment(self) -> bool:
+    def set_environment(
+        self, digests: Optional[Tuple[str, ...]] = None, storage: str = DEFAULT_STORAGE
+    ) -> bool:
         """
         Create the backup enviroment.
 
         Creates a directory `.runup` at context level. In it
-        creates a `.version` that only contains a number `1`
-        and creates a SQLite database named `runup.db`.
+        creates a `.version` that contains a number `1` (followed
+        by the digests used to sign the files and the storage, if
+        they are not the default ones) and creates a SQLite database
+        named `runup.db`.
         """
 
+        if digests is None or len(digests) == 0:
+            digests = DEFAULT_DIGESTS
+
         vInfo(self._verbose, "Setting environment.")
 
         # Create the directory `.runup`
         if not os.path.exists(f"{self._context}/.runup"):
             os.mkdir(f"{self._context}/.runup")
-            vInfo(self._verbose, f"Created directory {self._context}/.runup")
+            vInfo(self._verbose, "Created directory %s/.runup", self._context)
         else:
-            vInfo(
-                self._verbose, f"The directory `{self._context}/.runup` already exists."
-            )
+            vInfo(self._verbose, "The directory `%s/.runup` already exists.", self._context)
             click.echo("RunUp is already initiated.")
             return False
 
         # Create file `.version`
-        # TODO: Convert this into a function the `version.pyx` file.
-        with open(f"{str(self._context)}/.runup/.version", "w") as file:
-            file.write(self._version.decode())
-        vInfo(self._verbose, f"Created file `{self._context}/.runup/.version`")
+        write_repository_info(self._context, self._version.decode(), tuple(digests), storage)
+        vInfo(self._verbose, "Created file `%s/.runup/.version`", self._context)
 
         # Create the directory `.runup`
         if not os.path.exists(f"{self._context}/.runup/jobs"):
             os.mkdir(f"{self._context}/.runup/jobs")
-            vInfo(self._verbose, f"Created directory `{self._context}/.runup/jobs`")
+            vInfo(self._verbose, "Created directory `%s/.runup/jobs`", self._context)
         else:
-            vInfo(
-                self._verbose,
-                f"The directory `{self._context}/.runup/jobs` already exists.",
-            )
+            vInfo(self._verbose, "The directory `%s/.runup/jobs` already exists.", self._context)
             click.echo("RunUp is already initiated.")
             return False
 
@@ -517,96 +1843,45 @@ cdef class Interpreter_1(Interpreter):
             click.echo("RunUp has not been initialized.")
             return False
 
-        for project in yaml_config["project"].keys():
-            vCall(self._verbose, "RunupDB.insert_backup")
-            db = RunupDB(self._context, self._verbose)
-            db.insert_backup(str(project))
-            vResponse(self._verbose, "RunupDB.insert_backup", None)
+        vCall(self._verbose, "RunupDB.insert_backups")
+        db = RunupDB(self._context, self._verbose)
+        try:
+            db.insert_backups([str(project) for project in yaml_config["project"].keys()])
+        except SchemaError as e:
+            click.secho(str(e), fg="red")
+            return False
+        vResponse(self._verbose, "RunupDB.insert_backups", None)
 
         return True
 
-    cdef _working_directories(self, config: Dict[str, Any]): # -> Dict[str, str]:
-        """Select the working directories based on the `include` and `exclude` on the YAML file."""
-
-        # cdef char* filepath
-
-        cdef char* tmp_bytes
-        cdef dict directories = {}
-        cdef list exclude_list = []
-        cdef list exclude_list_slash = []
-        cdef dict include_dict = {}
+    cdef _changed_directories(
+        self, RunupDB db, config: Dict[str, Any], int previous_job, int job_id, list dirty
+    ):
+        """
+        Select the files to back up when only the `dirty` paths may have changed.
 
-        for inc in config["include"]:
-            inc_os = inc.replace("/", os.sep)
-            include_dict[os.path.join(self._context, inc_os)] = inc.replace(os.sep, "/")
+        The other files of the previous job are copied into the job
+        without being visited. Returns an iterator like the one of
+        `_working_directories()` with what is at the dirty paths.
+        """
 
-        if "exclude" in config:
-            exclude_list = [
-                os.path.join(self._context, exc.replace("/", os.sep))
-                for exc in config["exclude"]
-            ]
-            for element in exclude_list:
-                if element.endswith(os.sep):
-                    exclude_list_slash.append(element)
-                else:
-                    exclude_list_slash.append(element + os.sep)
+        scanner: Scanner = Scanner(str(self._context), config.get("exclude", []), self._verbose)
+        roots, parents = scanner.changed(dirty)
+        copied: int = db.copy_files(previous_job, job_id, roots, parents)
+        vInfo(
+            self._verbose,
+            "Job %s: %s unchanged entries copied from job %s, %s changed paths",
+            (job_id, copied, previous_job, len(roots)),
+        )
+        return scanner.rescan(config["include"], roots, parents)
 
-        exclude_tuple_slash: Tuple = tuple(exclude_list_slash)
+    cdef _working_directories(self, config: Dict[str, Any]):
+        """
+        Select the files to back up based on the `include` and `exclude` on the YAML file.
 
-        for include_str in include_dict.keys():
-            if os.path.isfile(include_str):
-                vInfo(
-                    self._verbose,
-                    f"`{include_str}` is a file. Including it into workspace.",
-                )
-                directories[include_str] = os.path.relpath(
-                    include_str, self._context
-                ).replace(os.sep, "/")
-            else:
-                # traverse root directory as root, and list directories as _ and files as files
-                for root, _, files in os.walk(include_str):
-                    if (
-                        not (root + os.sep).startswith(exclude_tuple_slash)
-                        and root not in exclude_list
-                        and ".runup" not in root.split(os.sep)
-                    ):
-                        vInfo(
-                            self._verbose,
-                            f"Including directory `{root}` into workspace.",
-                        )
-                        # directories[root] = include_dict[root]
-                        if len(files) == 0:
-                            vInfo(
-                                self._verbose,
-                                f"Including empty directory `{root}` into workspace",
-                            )
-                            directories[root] = os.path.relpath(
-                                root, self._context
-                            ).replace(os.sep, "/")
-                        else:
-                            for file in files:
-
-                                filepath:str = root + os.sep + file
-                                
-                                if filepath in exclude_list or file in [
-                                    b"runup.yml",
-                                    b"runup.yaml",
-                                ]:
-                                    vInfo(
-                                        self._verbose,
-                                        f"Ignoring file `{filepath}` from workspace.",
-                                    )
-                                else:
-                                    vInfo(
-                                        self._verbose,
-                                        f"Including file `{filepath}` into workspace.",
-                                    )
-                                    directories[filepath] = os.path.relpath(
-                                        filepath, self._context
-                                    ).replace(os.sep, "/")
-                    else:
-                        vInfo(
-                            self._verbose, f"Ignoring directory `{root}` from workspace"
-                        )
+        Returns an iterator of `(path_from_pwd, path_from_yaml_file, stat_result)`:
+        the workspace is scanned as the files are consumed.
+        """
 
-        return directories
+        scanner: Scanner = Scanner(str(self._context), config.get("exclude", []), self._verbose)
+        return scanner.scan(config["include"])
@@ -0,0 +1,31 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+cpdef str config_fingerprint(config)
+
+
+cdef class Journal:
+
+    cdef str _dbname
+    cdef bint _verbose
+    cdef _conn
+
+    cpdef void open(self)
+
+    cpdef void close(self)
+
+    cpdef start(self, list projects)
+
+    cpdef ready(self, list projects)
+
+    cpdef record(self, paths, double seen=*)
+
+    cpdef invalidate(self, list projects)
+
+    cpdef stop(self, list projects)
+
+    cpdef take(self, str project, str fingerprint, double since=*)
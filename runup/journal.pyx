@@ -0,0 +1,272 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import json
+import os
+from pathlib import Path
+import sqlite3
+from sqlite3 import Error
+import time
+
+# 3rd Party
+import click
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.utils cimport process_alive, vInfo
+
+
+# Bump this number every time the layout of the journal changes.
+# Like the stat cache, the journal is disposable: an outdated one is
+# dropped, and the next backup of every project scans it fully.
+JOURNAL_VERSION = 2
+
+# A project with more dirty paths than this is scanned fully
+JOURNAL_LIMIT = 100000
+
+# Seconds to wait for the other process (watcher or backup) to release the journal
+JOURNAL_TIMEOUT = 30
+
+# Seconds a backup waits for the watcher to write the changes made
+# before it started (the watcher writes them every second)
+JOURNAL_WAIT = 3
+
+
+cpdef str config_fingerprint(config):
+    """Identify the `include` and `exclude` of a project, to notice when they change."""
+    return json.dumps([config.get("include", []), config.get("exclude", [])])
+
+
+cdef class Journal:
+    """
+    Persistent journal of the paths changed since the last backup.
+
+    The journal lives in `.runup/journal.db`. It is written by
+    `runup watch`, which records the paths created, modified and
+    deleted in every project, and read by the backups, which then
+    only need to visit those paths.
+
+    The journal of a project can only be trusted if the watcher has
+    seen every change since the last backup: the watcher was running
+    (and done setting up its watches) when that backup took the
+    journal, and it has not lost events since then. Otherwise the
+    backup scans the whole project, as it does without a watcher.
+
+    The watcher holds the changes for a moment before writing them,
+    so it also records the time up to which every change is written
+    (`flushed`). A backup waits for it to pass its start.
+    """
+
+    def __init__(self, context: Path, bint verbose):
+
+        self._dbname = str(context) + "/.runup/journal.db"
+        self._verbose = verbose
+        self._conn = None
+
+    cpdef void open(self):
+        """Open the journal, creating (or rebuilding) it if needed."""
+
+        vInfo(self._verbose, "Opening journal: %s", self._dbname)
+
+        try:
+            # The watcher may be set up and run from different threads (never at once)
+            self._conn = sqlite3.connect(
+                self._dbname,
+                timeout=JOURNAL_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != JOURNAL_VERSION:
+                vInfo(self._verbose, "Rebuilding outdated journal")
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.execute("DROP TABLE IF EXISTS `dirty`")
+                self._conn.execute("DROP TABLE IF EXISTS `state`")
+                self._conn.execute("""
+                    CREATE TABLE `dirty` (
+                        `project` TEXT NOT NULL,
+                        `path` TEXT NOT NULL,
+                        PRIMARY KEY (`project`, `path`)
+                    ) WITHOUT ROWID;
+                """)
+                self._conn.execute("""
+                    CREATE TABLE `state` (
+                        `project` TEXT PRIMARY KEY,
+                        `pid` INTEGER NULL,
+                        `complete` INTEGER NOT NULL,
+                        `config` TEXT NULL,
+                        `flushed` REAL NULL
+                    );
+                """)
+                self._conn.execute(f"PRAGMA user_version = {JOURNAL_VERSION}")
+                self._conn.execute("COMMIT")
+        except Error as e:
+            click.echo(e)
+            self._conn = None
+
+    cpdef void close(self):
+        """Close the journal."""
+
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # ------- #
+    # WATCHER #
+    # ------- #
+
+    cpdef start(self, list projects):
+        """
+        Forget the changes seen by a previous watcher of the projects.
+
+        Until `ready()` is called, their backups keep scanning fully.
+        """
+
+        if self._conn is None:
+            return
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        for project in projects:
+            self._conn.execute("DELETE FROM dirty WHERE project = ?", (project,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO state (project, pid, complete, config, flushed) " + \
+                "VALUES (?, NULL, 0, NULL, NULL)",
+                (project,)
+            )
+        self._conn.execute("COMMIT")
+
+    cpdef ready(self, list projects):
+        """Every change of the projects is seen from now on."""
+
+        if self._conn is None:
+            return
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.executemany(
+            "UPDATE state SET pid = ? WHERE project = ?",
+            [(os.getpid(), project) for project in projects],
+        )
+        self._conn.execute("COMMIT")
+
+    cpdef record(self, paths, double seen=0):
+        """
+        Add `(project, path)` pairs to the dirty paths.
+
+        `seen` (if not zero) is the time (`time.time()`) up to which
+        every change is in them: it is recorded for the projects of
+        this watcher, even if nothing changed.
+        """
+
+        if self._conn is None or (len(paths) == 0 and seen <= 0):
+            return
+
+        vInfo(self._verbose, "Recording %s changed paths", len(paths))
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO dirty (project, path) VALUES (?, ?)",
+            list(paths),
+        )
+        if seen > 0:
+            self._conn.execute("UPDATE state SET flushed = ? WHERE pid = ?", (seen, os.getpid()))
+        self._conn.execute("COMMIT")
+
+    cpdef invalidate(self, list projects):
+        """Events were lost: the next backup of the projects must scan them fully."""
+
+        if self._conn is None:
+            return
+
+        vInfo(self._verbose, "Invalidating the journal of: %s", ", ".join(projects))
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.executemany(
+            "UPDATE state SET complete = 0 WHERE project = ?",
+            [(project,) for project in projects],
+        )
+        self._conn.execute("COMMIT")
+
+    cpdef stop(self, list projects):
+        """The watcher of the projects is gone."""
+
+        if self._conn is None:
+            return
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.executemany(
+            "UPDATE state SET pid = NULL, complete = 0 WHERE project = ? AND pid = ?",
+            [(project, os.getpid()) for project in projects],
+        )
+        self._conn.execute("COMMIT")
+
+    # ------ #
+    # BACKUP #
+    # ------ #
+
+    cpdef take(self, str project, str fingerprint, double since=0):
+        """
+        Take the dirty paths of a project, at the start of its backup.
+
+        Returns the list of paths changed since the last backup, or
+        `None` if the journal can't be trusted and the project has to
+        be scanned fully. If `since` is set (the start of the backup,
+        as `time.time()`), the changes made before it must have been
+        written: the watcher is given `JOURNAL_WAIT` seconds to do it.
+        The journal of the project is emptied, and starts to be
+        trusted if a watcher is running.
+        """
+
+        cdef list dirty = None
+        cdef double deadline = time.monotonic() + JOURNAL_WAIT
+
+        if self._conn is None:
+            return None
+
+        # Outside of a transaction, or the watcher couldn't write
+        while since > 0 and time.monotonic() < deadline:
+            row = self._conn.execute("SELECT pid, flushed FROM state WHERE project = ?", (project,)).fetchone()
+            if row is None or not process_alive(row[0]) or (row[1] or 0) >= since:
+                break
+            time.sleep(0.05)
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT pid, complete, config, flushed FROM state WHERE project = ?", (project,)
+            ).fetchone()
+            watched = row is not None and process_alive(row[0])
+
+            if watched and since > 0 and (row[3] or 0) < since:
+                vInfo(self._verbose, "The watcher of the project `%s` is late", project)
+            elif watched and row[1] == 1 and row[2] == fingerprint:
+                dirty = [
+                    path for (path,) in self._conn.execute(
+                        "SELECT path FROM dirty WHERE project = ? LIMIT ?",
+                        (project, JOURNAL_LIMIT + 1),
+                    )
+                ]
+                if len(dirty) > JOURNAL_LIMIT:
+                    vInfo(self._verbose, "Too many changes in the project `%s`", project)
+                    dirty = None
+
+            self._conn.execute("DELETE FROM dirty WHERE project = ?", (project,))
+            if watched:
+                self._conn.execute(
+                    "UPDATE state SET complete = 1, config = ? WHERE project = ?",
+                    (fingerprint, project),
+                )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+        if dirty is None:
+            vInfo(self._verbose, "No journal for the project `%s`: full scan", project)
+        else:
+            vInfo(self._verbose, "Journal of the project `%s`: %s changed paths", (project, len(dirty)))
+        return dirty
@@ -0,0 +1,17 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+cdef class RepositoryLock:
+
+    cdef str _path
+    cdef bint _exclusive
+    cdef bint _verbose
+    cdef object _file
+
+    cpdef acquire(self)
+
+    cpdef release(self)
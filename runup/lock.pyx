@@ -0,0 +1,86 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import os
+
+# 3rd Party
+import click
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Own
+from runup.utils cimport vInfo
+
+
+cdef class RepositoryLock:
+    """
+    Advisory lock of a repository, held by one `runup` process at a time.
+
+    The processes that change the repository (backups, prunes) take it
+    exclusively, so they run one after another, and the processes that
+    only read it (restores, exports) share it. A process waits until
+    the lock is available. The lock is released when it is closed or
+    the process exits, even if it crashes.
+
+    Concurrent backups from separate processes are not supported: they
+    only ever run one after another. The projects of one backup run at
+    the same time within its process. Without `fcntl` (i.e. on Windows)
+    there is no lock, and nothing stops two processes from changing
+    the repository at the same time.
+    """
+
+    def __init__(self, context, bint exclusive, bint verbose):
+
+        self._path = str(context) + "/.runup/lock"
+        self._exclusive = exclusive
+        self._verbose = verbose
+        self._file = None
+
+    cpdef acquire(self):
+        """Take the lock, waiting for the other processes to release it."""
+
+        # Not initialized yet: there is nothing to protect
+        if fcntl is None or self._file is not None or not os.path.isdir(os.path.dirname(self._path)):
+            return
+
+        operation = fcntl.LOCK_EX if self._exclusive else fcntl.LOCK_SH
+        self._file = open(self._path, "a")
+        try:
+            fcntl.flock(self._file.fileno(), operation | fcntl.LOCK_NB)
+        except BlockingIOError:
+            click.secho("Waiting for another RunUp process to finish...", fg="yellow")
+            try:
+                fcntl.flock(self._file.fileno(), operation)
+            except BaseException:
+                self._file.close()
+                self._file = None
+                raise
+
+        vInfo(
+            self._verbose,
+            "%s lock taken: %s",
+            ("Exclusive" if self._exclusive else "Shared", self._path),
+        )
+
+    cpdef release(self):
+        """Release the lock."""
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            vInfo(self._verbose, "Lock released: %s", self._path)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,88 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+cdef class PackIndex:
+
+    cdef str _path
+    cdef int _key_size
+    cdef Py_ssize_t _record_size
+    cdef _file
+    cdef _map
+    cdef readonly unsigned long long num_slots
+    cdef readonly unsigned long long items
+
+    cpdef open(self)
+
+    cpdef close(self)
+
+    cpdef sync(self)
+
+    cdef _write_table(self, str path, bytearray slots, unsigned long long num_slots, unsigned long long items)
+
+    cdef Py_ssize_t _find(self, slots, Py_ssize_t base, unsigned long long num_slots, bytes key)
+
+    cpdef tuple get(self, bytes key)
+
+    cpdef insert(self, bytes key, tuple entry)
+
+    cdef _grow(self)
+
+
+cdef class BlobReader:
+
+    cdef int _fd
+    cdef unsigned long long _position
+    cdef unsigned long long _end
+    cdef _decompressor
+    cdef bint _flushed
+    cdef bytes _buffer
+    cdef Py_ssize_t _buffer_pos
+
+
+cdef class PackStore:
+
+    cdef str _directory
+    cdef int _key_size
+    cdef bint _verbose
+    cdef PackIndex _index
+    cdef _lock
+    cdef dict _readers
+    cdef int _writer
+    cdef int _pack
+    cdef unsigned long long _pack_size
+
+    cpdef open(self)
+
+    cpdef close(self)
+
+    cpdef sync(self)
+
+    cpdef list packs(self)
+
+    cpdef str pack_path(self, int pack)
+
+    cpdef bint contains(self, bytes key)
+
+    cpdef unsigned long long blob_size(self, bytes key) except? 0
+
+    cpdef BlobReader open_blob(self, bytes key)
+
+    cdef int _reader(self, int pack) except -1
+
+    cdef unsigned long long _reserve(self) except? 0
+
+    cpdef put(self, bytes key, data, int method, unsigned long long size)
+
+    cpdef put_data(self, bytes key, data, int method, compresslevel)
+
+    cpdef put_file(self, bytes key, str fname, int method, compresslevel)
+
+    cpdef rebuild_index(self)
+
+    cdef _copy_blob(self, bytes key, tuple entry)
+
+    cpdef tuple repack(self, is_live, double threshold=*)
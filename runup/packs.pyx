@@ -0,0 +1,551 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import mmap
+import os
+import struct
+import threading
+import zipfile
+
+# 3rd Party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.utils cimport new_hasher, vInfo
+
+
+# A new pack is started once the current one reaches this size
+PACK_SIZE = 128 * 1024 * 1024
+
+# First bytes of every pack: magic and version
+PACK_MAGIC = b"RUPK\x01\x00\x00\x00"
+
+# Header of every blob in a pack, followed by its key and its data:
+# size of the key, compression method, stored length, original size
+BLOB_HEADER = struct.Struct("<BBQQ")
+
+# Header of the index: magic, version, size of the keys, number of slots, items
+INDEX_HEADER = struct.Struct("<4sBBxxQQ")
+INDEX_MAGIC = b"RUPI"
+INDEX_VERSION = 1
+
+# Slot of the index, after its key: pack (0 if empty), offset, length, size, method
+INDEX_ENTRY = struct.Struct("<IQQQB")
+
+# Slots of a new index, and maximum ratio of used slots before it is doubled
+INDEX_SLOTS = 1024
+INDEX_LOAD = 0.7
+
+# Size of the reads of the blobs
+READ_SIZE = 1024 * 1024
+
+# Packs with a lower ratio of live bytes are rewritten by `PackStore.repack()`
+REPACK_THRESHOLD = 0.5
+
+
+cdef class PackIndex:
+    """
+    On-disk hash table from the key of a blob to its location.
+
+    The file is mapped in memory, so opening it does not read it and a
+    lookup only touches the slots it probes (open addressing with linear
+    probing). The keys are digests, so their first bytes are already
+    uniformly distributed and are used as the hash. When the table gets
+    too full it is rebuilt with twice the slots.
+    """
+
+    def __init__(self, str path, int key_size):
+
+        self._path = path
+        self._key_size = key_size
+        self._record_size = key_size + INDEX_ENTRY.size
+        self._file = None
+        self._map = None
+        self.num_slots = 0
+        self.items = 0
+
+    cpdef open(self):
+        """Map the index, creating it if it doesn't exist."""
+
+        if not os.path.exists(self._path):
+            self._write_table(self._path, bytearray(INDEX_SLOTS * self._record_size), INDEX_SLOTS, 0)
+
+        self._file = open(self._path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, key_size, self.num_slots, self.items = INDEX_HEADER.unpack_from(self._map)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or key_size != self._key_size:
+            self.close()
+            raise ValueError(f"Invalid pack index: {self._path}")
+
+    cpdef close(self):
+        """Write the changes and unmap the index."""
+
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    cpdef sync(self):
+        """Write the changes to the disk, keeping the index open."""
+
+        if self._map is not None:
+            self._map.flush()
+
+    cdef _write_table(self, str path, bytearray slots, unsigned long long num_slots, unsigned long long items):
+        """Write a whole index, atomically."""
+
+        with open(path + ".tmp", "wb") as file:
+            file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self._key_size, num_slots, items))
+            file.write(slots)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+    cdef Py_ssize_t _find(self, slots, Py_ssize_t base, unsigned long long num_slots, bytes key):
+        """
+        Position of the slot of a key in a table that starts at `base` of
+        `slots`: its own slot or the empty one where it would go.
+        """
+
+        cdef unsigned long long slot = int.from_bytes(key[:8], "little") % num_slots
+        cdef Py_ssize_t position
+
+        while True:
+            position = base + slot * self._record_size
+            if slots[position + self._key_size:position + self._key_size + 4] == b"\0\0\0\0":
+                return position
+            if slots[position:position + self._key_size] == key:
+                return position
+            slot = (slot + 1) % num_slots
+
+    cpdef tuple get(self, bytes key):
+        """`(pack, offset, length, size, method)` of a blob, or `None` if it is not indexed."""
+
+        cdef Py_ssize_t position = self._find(self._map, INDEX_HEADER.size, self.num_slots, key)
+        cdef tuple entry = INDEX_ENTRY.unpack_from(self._map, position + self._key_size)
+
+        if entry[0] == 0:
+            return None
+        return entry
+
+    cpdef insert(self, bytes key, tuple entry):
+        """Index a blob. Keys already indexed keep their first location."""
+
+        cdef Py_ssize_t position
+
+        if (self.items + 1) > self.num_slots * INDEX_LOAD:
+            self._grow()
+
+        position = self._find(self._map, INDEX_HEADER.size, self.num_slots, key)
+        if INDEX_ENTRY.unpack_from(self._map, position + self._key_size)[0] != 0:
+            return
+
+        self._map[position:position + self._record_size] = key + INDEX_ENTRY.pack(*entry)
+        self.items += 1
+        INDEX_HEADER.pack_into(
+            self._map, 0, INDEX_MAGIC, INDEX_VERSION, self._key_size, self.num_slots, self.items
+        )
+
+    cdef _grow(self):
+        """Rebuild the index with twice the slots."""
+
+        cdef unsigned long long num_slots = self.num_slots * 2
+        cdef bytearray slots = bytearray(num_slots * self._record_size)
+        cdef Py_ssize_t position
+        cdef Py_ssize_t new_position
+        cdef unsigned long long slot
+
+        for slot in range(self.num_slots):
+            position = INDEX_HEADER.size + slot * self._record_size
+            record = self._map[position:position + self._record_size]
+            if record[self._key_size:self._key_size + 4] == b"\0\0\0\0":
+                continue
+            new_position = self._find(slots, 0, num_slots, record[:self._key_size])
+            slots[new_position:new_position + self._record_size] = record
+
+        items = self.items
+        self.close()
+        self._write_table(self._path, slots, num_slots, items)
+        self.open()
+
+    def entries(self):
+        """Iterate all the indexed blobs as `(key, entry)`."""
+
+        cdef unsigned long long slot
+        cdef Py_ssize_t position
+
+        for slot in range(self.num_slots):
+            position = INDEX_HEADER.size + slot * self._record_size
+            entry = INDEX_ENTRY.unpack_from(self._map, position + self._key_size)
+            if entry[0] != 0:
+                yield bytes(self._map[position:position + self._key_size]), entry
+
+
+cdef class BlobReader:
+    """Read-only file object with the (decompressed) content of a blob."""
+
+    def __init__(self, int fd, unsigned long long offset, unsigned long long length, int method):
+
+        self._fd = fd
+        self._position = offset
+        self._end = offset + length
+        self._decompressor = zipfile._get_decompressor(method)
+        self._flushed = self._decompressor is None
+        self._buffer = b""
+        self._buffer_pos = 0
+
+    def read(self, Py_ssize_t size=-1):
+        """Read `size` bytes (all the remaining ones if negative), fewer only at the end."""
+
+        cdef list parts = []
+        cdef Py_ssize_t remaining = size
+        cdef Py_ssize_t available
+
+        while remaining != 0:
+            available = len(self._buffer) - self._buffer_pos
+            if available > 0:
+                if 0 < remaining < available:
+                    available = remaining
+                parts.append(self._buffer[self._buffer_pos:self._buffer_pos + available])
+                self._buffer_pos += available
+                if remaining > 0:
+                    remaining -= available
+            elif self._position < self._end:
+                data = os.pread(self._fd, min(READ_SIZE, self._end - self._position), self._position)
+                if len(data) == 0:
+                    raise OSError("Unexpected end of pack")
+                self._position += len(data)
+                self._buffer = data if self._decompressor is None else self._decompressor.decompress(data)
+                self._buffer_pos = 0
+            elif not self._flushed:
+                self._flushed = True
+                self._buffer = getattr(self._decompressor, "flush", bytes)()
+                self._buffer_pos = 0
+            else:
+                break
+
+        return b"".join(parts)
+
+    def close(self):
+        """Nothing to release: the pack is owned by the store."""
+        self._buffer = b""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+cdef class PackStore:
+    """
+    Content-addressed storage shared by all the jobs of a repository.
+
+    Blobs (the content of a file or of a chunk) are appended to packs
+    of bounded size in `.runup/packs` and found through a `PackIndex`
+    by their first digest. Every blob is stored once, whatever the
+    number of jobs that reference it, and fetching one never depends
+    on the number of jobs: one index lookup and positional reads.
+    Each blob carries its own header, so the index can be rebuilt
+    from the packs.
+    """
+
+    def __init__(self, context, str algo, bint verbose):
+
+        self._directory = f"{context}/.runup/packs"
+        self._key_size = new_hasher(algo).digest_size
+        self._verbose = verbose
+        self._index = None
+        self._lock = threading.Lock()
+        self._readers = {}
+        self._writer = -1
+        self._pack = 0
+        self._pack_size = 0
+
+    cpdef open(self):
+        """Open the index (rebuilding it if it is missing or damaged)."""
+
+        os.makedirs(self._directory, exist_ok=True)
+        self._index = PackIndex(f"{self._directory}/index", self._key_size)
+        if not os.path.exists(f"{self._directory}/index"):
+            self.rebuild_index()
+        else:
+            try:
+                self._index.open()
+            except (ValueError, OSError, struct.error):
+                self.rebuild_index()
+
+        packs = self.packs()
+        self._pack = packs[-1] if len(packs) > 0 else 0
+
+    cpdef close(self):
+        """Make the new blobs durable and close the packs and the index."""
+
+        if self._writer >= 0:
+            os.fsync(self._writer)
+            os.close(self._writer)
+            self._writer = -1
+        for fd in self._readers.values():
+            os.close(fd)
+        self._readers = {}
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+    cpdef sync(self):
+        """Make the blobs stored so far durable, keeping the packs open."""
+
+        if self._writer >= 0:
+            os.fsync(self._writer)
+        if self._index is not None:
+            self._index.sync()
+
+    cpdef list packs(self):
+        """Numbers of the existing packs, sorted."""
+
+        return sorted([
+            int(name[5:-5]) for name in os.listdir(self._directory)
+            if name.startswith("pack-") and name.endswith(".pack")
+        ])
+
+    cpdef str pack_path(self, int pack):
+        """Path of a pack."""
+        return f"{self._directory}/pack-{pack:06d}.pack"
+
+    cpdef bint contains(self, bytes key):
+        """Check if a blob is stored."""
+        return self._index.get(key) is not None
+
+    cpdef unsigned long long blob_size(self, bytes key) except? 0:
+        """Original size of a blob. Raises `KeyError` if it is not stored."""
+
+        entry = self._index.get(key)
+        if entry is None:
+            raise KeyError(key.hex())
+        return entry[3]
+
+    cpdef BlobReader open_blob(self, bytes key):
+        """File object with the content of a blob. Raises `KeyError` if it is not stored."""
+
+        entry = self._index.get(key)
+        if entry is None:
+            raise KeyError(key.hex())
+        pack, offset, length, _, method = entry
+        return BlobReader(self._reader(pack), offset, length, method)
+
+    cdef int _reader(self, int pack) except -1:
+        """Read-only descriptor of a pack, shared by all the threads."""
+
+        if pack not in self._readers:
+            with self._lock:
+                if pack not in self._readers:
+                    self._readers[pack] = os.open(self.pack_path(pack), os.O_RDONLY)
+        return self._readers[pack]
+
+    cdef unsigned long long _reserve(self) except? 0:
+        """
+        Offset where the next blob is written, starting a new pack when needed.
+
+        Packs are never appended to once closed: a blob cut by a crash
+        can only be at the end of a pack, where it is easy to ignore.
+        """
+
+        if self._writer < 0 or self._pack_size >= PACK_SIZE:
+            if self._writer >= 0:
+                os.fsync(self._writer)
+                os.close(self._writer)
+            self._pack += 1
+            self._writer = os.open(
+                self.pack_path(self._pack), os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644
+            )
+            os.write(self._writer, PACK_MAGIC)
+            self._pack_size = len(PACK_MAGIC)
+            vInfo(self._verbose, "Writing pack %s", self._pack)
+        return self._pack_size
+
+    cpdef put(self, bytes key, data, int method, unsigned long long size):
+        """
+        Store a blob whose data is already compressed with `method`.
+
+        Returns the number of bytes stored, zero if it was already stored.
+        """
+
+        cdef unsigned long long offset
+
+        if self.contains(key):
+            return 0
+
+        offset = self._reserve()
+        os.pwrite(
+            self._writer, BLOB_HEADER.pack(len(key), method, len(data), size) + key, offset
+        )
+        offset += BLOB_HEADER.size + len(key)
+        os.pwrite(self._writer, data, offset)
+        self._pack_size = offset + len(data)
+        self._index.insert(key, (self._pack, offset, len(data), size, method))
+        return len(data)
+
+    cpdef put_data(self, bytes key, data, int method, compresslevel):
+        """Compress data with `method` and store it. Returns the number of bytes stored."""
+
+        if self.contains(key):
+            return 0
+
+        compressor = zipfile._get_compressor(method, compresslevel)
+        if compressor is None:
+            return self.put(key, bytes(data), method, len(data))
+        return self.put(key, compressor.compress(data) + compressor.flush(), method, len(data))
+
+    cpdef put_file(self, bytes key, str fname, int method, compresslevel):
+        """
+        Store the content of a file, compressing it while it is read.
+
+        Returns the number of bytes stored, zero if it was already stored.
+        """
+
+        cdef unsigned long long header
+        cdef unsigned long long offset
+        cdef unsigned long long size = 0
+
+        if self.contains(key):
+            return 0
+
+        compressor = zipfile._get_compressor(method, compresslevel)
+        header = self._reserve()
+        offset = header + BLOB_HEADER.size + len(key)
+
+        with open(fname, "rb") as afile:
+            while True:
+                data = afile.read(READ_SIZE)
+                if len(data) == 0:
+                    break
+                size += len(data)
+                if compressor is not None:
+                    data = compressor.compress(data)
+                os.pwrite(self._writer, data, offset)
+                offset += len(data)
+            if compressor is not None:
+                data = compressor.flush()
+                os.pwrite(self._writer, data, offset)
+                offset += len(data)
+
+        length = offset - header - BLOB_HEADER.size - len(key)
+        os.pwrite(self._writer, BLOB_HEADER.pack(len(key), method, length, size) + key, header)
+        self._pack_size = offset
+        self._index.insert(key, (self._pack, offset - length, length, size, method))
+        return length
+
+    cpdef rebuild_index(self):
+        """Index again all the blobs of the packs."""
+
+        cdef unsigned long long offset
+        cdef unsigned long long end
+
+        vInfo(self._verbose, "Rebuilding the index of the packs")
+        if self._index is not None:
+            self._index.close()
+        index_path = f"{self._directory}/index"
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        self._index = PackIndex(index_path, self._key_size)
+        self._index.open()
+
+        for pack in self.packs():
+            with open(self.pack_path(pack), "rb") as file:
+                if file.read(len(PACK_MAGIC)) != PACK_MAGIC:
+                    continue
+                offset = len(PACK_MAGIC)
+                end = os.fstat(file.fileno()).st_size
+                while offset + BLOB_HEADER.size <= end:
+                    key_size, method, length, size = BLOB_HEADER.unpack(file.read(BLOB_HEADER.size))
+                    key = file.read(key_size)
+                    offset += BLOB_HEADER.size + key_size
+                    # A blob cut by a crash is ignored
+                    if offset + length > end or key_size != self._key_size:
+                        break
+                    self._index.insert(key, (pack, offset, length, size, method))
+                    offset += length
+                    file.seek(offset)
+
+    cdef _copy_blob(self, bytes key, tuple entry):
+        """Append a blob of another pack to the current pack, without decompressing it."""
+
+        cdef unsigned long long offset
+        cdef unsigned long long position
+        cdef unsigned long long end
+
+        pack, position, length, size, method = entry
+        end = position + length
+        offset = self._reserve()
+        os.pwrite(self._writer, BLOB_HEADER.pack(len(key), method, length, size) + key, offset)
+        offset += BLOB_HEADER.size + len(key)
+
+        while position < end:
+            data = os.pread(self._reader(pack), min(READ_SIZE, end - position), position)
+            if len(data) == 0:
+                raise OSError("Unexpected end of pack")
+            os.pwrite(self._writer, data, offset)
+            position += len(data)
+            offset += len(data)
+        self._pack_size = offset
+
+    cpdef tuple repack(self, is_live, double threshold=REPACK_THRESHOLD):
+        """
+        Drop the blobs that are no longer used.
+
+        `is_live(key)` tells if a blob is still referenced. The packs
+        whose ratio of live bytes is below `threshold` are rewritten:
+        their live blobs are copied into new packs, then they are
+        deleted and the index is rebuilt. The other packs are kept as
+        they are, so a pack is only rewritten once it is mostly garbage.
+        Only per-pack counters are kept in memory.
+
+        Returns the number of packs deleted and the number of bytes freed.
+        """
+
+        cdef dict total = {}
+        cdef dict live = {}
+        cdef list doomed
+        cdef unsigned long long freed = 0
+
+        for pack in self.packs():
+            total[pack] = os.path.getsize(self.pack_path(pack))
+            live[pack] = 0
+        for key, entry in self._index.entries():
+            if entry[0] in live and is_live(key):
+                live[entry[0]] += BLOB_HEADER.size + len(key) + entry[2]
+
+        doomed = [pack for pack in total if live[pack] < total[pack] * threshold]
+        if len(doomed) == 0:
+            return 0, 0
+
+        vInfo(self._verbose, "Repacking %s packs", len(doomed))
+        for key, entry in self._index.entries():
+            if entry[0] in doomed and is_live(key):
+                self._copy_blob(key, entry)
+        if self._writer >= 0:
+            os.fsync(self._writer)
+            os.close(self._writer)
+            self._writer = -1
+
+        # The copies are durable: the old packs can go
+        self._index.close()
+        os.remove(f"{self._directory}/index")
+        for pack in doomed:
+            if pack in self._readers:
+                os.close(self._readers.pop(pack))
+            os.remove(self.pack_path(pack))
+            freed += total[pack] - live[pack]
+        self.rebuild_index()
+
+        return len(doomed), freed
@@ -0,0 +1,8 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+cpdef set jobs_to_keep(list jobs, int keep_last, int keep_daily, int keep_weekly)
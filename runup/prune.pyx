@@ -0,0 +1,42 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+from datetime import date
+from operator import itemgetter
+
+
+cpdef set jobs_to_keep(list jobs, int keep_last, int keep_daily, int keep_weekly):
+    """
+    Select the jobs of a project kept by a retention policy.
+
+    `jobs` is a list of `(job_id, time_start)`. A job is kept if it is
+    one of the `keep_last` newest jobs, the newest job of one of the
+    last `keep_daily` days that have jobs, or the newest job of one of
+    the last `keep_weekly` (ISO) weeks that have jobs. The newest job
+    is always kept.
+    """
+
+    cdef set keep = set()
+    cdef set days = set()
+    cdef set weeks = set()
+    cdef list newest_first = sorted(jobs, key=itemgetter(1, 0), reverse=True)
+
+    for position, (job_id, time_start) in enumerate(newest_first):
+        day = date.fromtimestamp(time_start)
+        week = tuple(day.isocalendar()[:2])
+
+        if position == 0 or position < keep_last:
+            keep.add(job_id)
+        if day not in days and len(days) < keep_daily:
+            days.add(day)
+            keep.add(job_id)
+        if week not in weeks and len(weeks) < keep_weekly:
+            weeks.add(week)
+            keep.add(job_id)
+
+    return keep
@@ -0,0 +1,135 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+import threading
+import zipfile
+
+# 3rd Party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.packs cimport PackStore
+from runup.utils cimport vInfo
+
+
+# Size of the buffer used to copy the data out of the jobs
+COPY_BUFFER = 1024 * 1024
+
+
+cdef class Restorer:
+    """
+    Extract files from many jobs at the same time.
+
+    The files are written by a pool of threads. Every thread keeps its
+    own `ZipFile` handle of each job it reads from, so the threads never
+    share (nor wait for) the position of a file. All the handles are
+    closed when the restoration ends. On repositories that store the
+    content in packs, the files are read from the `PackStore` instead,
+    identified by their digest.
+    """
+
+    def __init__(self, str context, bint verbose, PackStore packs=None):
+
+        self._context = context
+        self._verbose = verbose
+        self._packs = packs
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._handles = []
+
+    cdef _archive(self, int job_id):
+        """The `ZipFile` of a job, for the current thread."""
+
+        archives = getattr(self._local, "archives", None)
+        if archives is None:
+            archives = self._local.archives = {}
+
+        if job_id not in archives:
+            archive = zipfile.ZipFile(f"{self._context}.runup/jobs/{job_id}")
+            archives[job_id] = archive
+            with self._lock:
+                self._handles.append(archive)
+
+        return archives[job_id]
+
+    cdef _open(self, int job_id, str src):
+        """
+        File object with the content of an entry, `None` for directories.
+
+        `src` is the path of the entry in its job, or its digest if
+        the content is in the packs (empty for directories).
+        """
+
+        if self._packs is not None:
+            if src == "":
+                return None
+            return self._packs.open_blob(bytes.fromhex(src))
+
+        archive = self._archive(job_id)
+        try:
+            return archive.open(archive.getinfo(src))
+        except KeyError:
+            return None
+
+    def extract(self, int job_id, str src, str dst):
+        """Copy an entry of a job into `dst`. Entries without content are empty directories."""
+
+        source = self._open(job_id, src)
+        if source is None:
+            os.makedirs(dst, exist_ok=True)
+            return
+
+        vInfo(self._verbose, "Restoring file: %s", dst)
+        with source, open(dst, "wb") as output:
+            shutil.copyfileobj(source, output, COPY_BUFFER)
+
+    def reassemble(self, list chunks, str dst):
+        """Write a file stored as chunks, given its list of `(job_id, digest, size)`."""
+
+        vInfo(self._verbose, "Reassembling file: %s", dst)
+        with open(dst, "wb") as output:
+            for job_id, digest, _ in chunks:
+                src = digest if self._packs is not None else f".chunks/{digest}"
+                with self._open(job_id, src) as chunk:
+                    shutil.copyfileobj(chunk, output, COPY_BUFFER)
+
+    cpdef restore(self, list files, list chunked_files, int workers):
+        """
+        Restore files and wait until all of them are written.
+
+        `files` is a list of `(job_id, src, dst)` and `chunked_files`
+        a list of `(chunks, dst)`. The parent directories are created
+        before any file is written.
+        """
+
+        cdef set directories = set()
+
+        for _, _, dst in files:
+            directories.add(os.path.dirname(dst))
+        for _, dst in chunked_files:
+            directories.add(os.path.dirname(dst))
+        for directory in sorted(directories):
+            if directory != "":
+                os.makedirs(directory, exist_ok=True)
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(self.extract, job_id, src, dst) for job_id, src, dst in files]
+                futures += [pool.submit(self.reassemble, chunks, dst) for chunks, dst in chunked_files]
+                for future in futures:
+                    future.result()
+        finally:
+            for archive in self._handles:
+                archive.close()
+            self._handles = []
+            self._local = threading.local()
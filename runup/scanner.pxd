@@ -0,0 +1,33 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+cdef class PathMatcher:
+
+    cdef list _patterns
+    cdef bint _simple
+    cdef _any
+    cdef _any_dir
+
+    cpdef bint excluded(self, str path, bint is_dir)
+
+    cpdef bint excluded_tree(self, str path, bint is_dir)
+
+
+cpdef tuple path_filter(str pattern)
+
+
+cdef class Scanner:
+
+    cdef str _base
+    cdef PathMatcher _matcher
+    cdef bint _verbose
+
+    cdef str _relative(self, str path)
+
+    cpdef bint covers(self, list includes, str path, bint is_dir)
+
+    cpdef tuple changed(self, paths)
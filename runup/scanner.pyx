@@ -0,0 +1,337 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+from operator import attrgetter
+import os
+import re
+from stat import S_ISDIR
+
+# 3rd Party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.utils cimport vInfo
+
+
+# Files at the root of a project never included in its backups
+CONFIG_FILES = ("runup.yml", "runup.yaml")
+
+# Directories never scanned, wherever they are
+IGNORED_DIRECTORIES = (".runup",)
+
+
+cdef str _translate(str pattern):
+    """Regular expression (without anchors) of the body of a glob pattern."""
+
+    cdef list parts = []
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t n = len(pattern)
+    cdef Py_ssize_t end
+
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif c == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif c == "?":
+            parts.append("[^/]")
+            i += 1
+        elif c == "[" and pattern.find("]", i + 2) >= 0:
+            end = pattern.find("]", i + 2)
+            body = pattern[i + 1:end].replace("\\", "\\\\")
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            parts.append("[" + body + "]")
+            i = end + 1
+        else:
+            parts.append(re.escape(c))
+            i += 1
+
+    return "".join(parts)
+
+
+cdef class PathMatcher:
+    """
+    Compiled gitignore-style patterns.
+
+    Paths are relative to the root of the project and use `/`. A pattern
+    that starts with `/` or `./`, or that has a `/` in the middle, is
+    matched from the root; otherwise it is matched against the name at
+    any depth. `*` and `?` don't match `/`, `**` matches any number of
+    directories, a trailing `/` only matches directories and a leading
+    `!` includes again what an earlier pattern excluded: as in
+    `.gitignore`, the last pattern that matches a path wins.
+    """
+
+    def __init__(self, patterns):
+
+        cdef list regexes = []
+        cdef list dir_regexes = []
+
+        self._patterns = []
+        for pattern in patterns:
+            pattern = pattern.replace(os.sep, "/").strip()
+            negated = pattern.startswith("!")
+            if negated:
+                pattern = pattern[1:]
+
+            anchored = pattern.startswith("/") or pattern.startswith("./")
+            while pattern.startswith("./") or pattern.startswith("/"):
+                pattern = pattern[2:] if pattern.startswith("./") else pattern[1:]
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if pattern == "" or pattern == ".":
+                continue
+            anchored = anchored or "/" in pattern
+
+            regex = ("" if anchored else "(?:.*/)?") + _translate(pattern)
+            self._patterns.append((re.compile(regex + r"\Z"), negated, dir_only))
+            if dir_only:
+                dir_regexes.append(regex)
+            else:
+                regexes.append(regex)
+
+        # Without negations, the order doesn't matter: a single regex does it all
+        self._simple = not any([negated for _, negated, _ in self._patterns])
+        self._any = re.compile("(?:" + "|".join(regexes) + r")\Z") if regexes else None
+        self._any_dir = re.compile(
+            "(?:" + "|".join(regexes + dir_regexes) + r")\Z"
+        ) if regexes or dir_regexes else None
+
+    cpdef bint excluded(self, str path, bint is_dir):
+        """Check if a path is excluded (not if it is inside an excluded directory)."""
+
+        if self._simple:
+            regex = self._any_dir if is_dir else self._any
+            return regex is not None and regex.match(path) is not None
+
+        for regex, negated, dir_only in reversed(self._patterns):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(path) is not None:
+                return not negated
+        return False
+
+    cpdef bint excluded_tree(self, str path, bint is_dir):
+        """Check if a path or one of its parent directories is excluded."""
+
+        cdef Py_ssize_t position = path.find("/")
+
+        while position >= 0:
+            if self.excluded(path[:position], True):
+                return True
+            position = path.find("/", position + 1)
+        return self.excluded(path, is_dir)
+
+
+cpdef tuple path_filter(str pattern):
+    """
+    Literal prefix and regular expression of a pattern of paths of a job.
+
+    The pattern is matched from the root of the project, with the syntax
+    of `PathMatcher`, and also matches everything inside the directories
+    it matches. Every path that matches starts with the prefix, so it
+    can be searched in an index before the regex is tried.
+    """
+
+    pattern = pattern.replace(os.sep, "/").strip()
+    while pattern.startswith("./") or pattern.startswith("/"):
+        pattern = pattern[2:] if pattern.startswith("./") else pattern[1:]
+    pattern = pattern.rstrip("/")
+    if pattern == "" or pattern == ".":
+        return "", r".*\Z"
+
+    prefix = re.match(r"[^*?\[]*", pattern).group(0)
+    return prefix, _translate(pattern) + r"(?:/.*)?\Z"
+
+
+cdef class Scanner:
+    """
+    Walk the included paths of a project, skipping the excluded ones.
+
+    Built on `os.scandir`: the type of an entry comes with the listing,
+    an excluded directory is never opened, and the `stat` of every
+    entry is returned so it doesn't need to be done again.
+    """
+
+    def __init__(self, str base, excludes, bint verbose):
+
+        self._base = base
+        self._matcher = PathMatcher(excludes)
+        self._verbose = verbose
+
+    cdef str _relative(self, str path):
+        """Normalized path of an include, relative to the base, with `/`."""
+
+        path = os.path.normpath(path.replace("/", os.sep)).replace(os.sep, "/")
+        return "" if path == "." else path
+
+    cpdef bint covers(self, list includes, str path, bint is_dir):
+        """Check if a path (relative to the base, with `/`) would be found by `scan(includes)`."""
+
+        if path in CONFIG_FILES:
+            return False
+        for name in path.split("/"):
+            if name in IGNORED_DIRECTORIES:
+                return False
+
+        for inc in includes:
+            rel = self._relative(inc)
+            if rel == "" or path == rel or path.startswith(rel + "/"):
+                return not self._matcher.excluded_tree(path, is_dir)
+        return False
+
+    cpdef tuple changed(self, paths):
+        """
+        Split the paths that may have changed into `(roots, parents)`.
+
+        `roots` are the paths not inside another one of the paths, and
+        `parents` their parent directories (`.` for the base), which may
+        have become empty or stopped being empty.
+        """
+
+        cdef list roots = []
+        cdef set parents = set()
+
+        for path in sorted(set(paths)):
+            if len(roots) > 0 and path.startswith(roots[-1] + "/"):
+                continue
+            roots.append(path)
+            parents.add(path.rpartition("/")[0] or ".")
+
+        return roots, sorted(parents)
+
+    def rescan(self, includes, list roots, list parents):
+        """
+        Yield what `scan(includes)` would yield at the paths returned by `changed()`.
+
+        What is at (or inside) the `roots` is scanned again. The
+        `parents` are only yielded if they are now empty directories
+        (or their files are all excluded).
+        """
+
+        cdef list include_paths = [self._relative(inc) for inc in includes]
+
+        for path in roots:
+            # Includes inside a changed directory (i.e. it was renamed)
+            for inc in include_paths:
+                if inc.startswith(path + "/"):
+                    yield from self.scan([inc])
+            full_path = os.path.join(self._base, path.replace("/", os.sep))
+            if self.covers(includes, path, os.path.isdir(full_path)):
+                yield from self.scan([path])
+
+        for parent in parents:
+            # As in `scan()`, the root of the context is never an empty directory
+            if parent == "." or not self.covers(includes, parent, True):
+                continue
+
+            full_path = os.path.normpath(os.path.join(self._base, parent.replace("/", os.sep)))
+            try:
+                with os.scandir(full_path) as iterator:
+                    if any([
+                        not entry.is_dir() and not self._matcher.excluded(parent + "/" + entry.name, False)
+                        for entry in iterator
+                    ]):
+                        continue
+                stat_result = os.stat(full_path)
+            except OSError:
+                continue
+            vInfo(self._verbose, "Including empty directory `%s` into workspace.", full_path)
+            yield full_path, parent, stat_result
+
+    def scan(self, includes, bint all_dirs=False):
+        """
+        Yield `(path, relative_path, stat_result)` of the files found.
+
+        `path` can be opened from the current directory, and
+        `relative_path` is relative to the base and uses `/`.
+        Directories without files (or whose files are all excluded)
+        are yielded too, so they are restored, except the root of the
+        context. Every directory is yielded if `all_dirs` is set.
+        Symbolic links to directories are not followed.
+        """
+
+        cdef list stack
+        cdef bint has_files
+
+        for inc in includes:
+            rel = self._relative(inc)
+            root = os.path.normpath(os.path.join(self._base, rel.replace("/", os.sep)))
+
+            try:
+                stat_result = os.stat(root)
+            except FileNotFoundError:
+                vInfo(self._verbose, "`%s` does not exist. Ignoring it.", root)
+                continue
+
+            if rel != "" and self._matcher.excluded_tree(rel, S_ISDIR(stat_result.st_mode)):
+                vInfo(self._verbose, "Ignoring `%s` from workspace.", root)
+                continue
+
+            if not S_ISDIR(stat_result.st_mode):
+                vInfo(self._verbose, "`%s` is a file. Including it into workspace.", root)
+                yield root, rel, stat_result
+                continue
+
+            stack = [(root, rel, stat_result)]
+            while len(stack) > 0:
+                directory, rel_dir, dir_stat = stack.pop()
+                vInfo(self._verbose, "Including directory `%s` into workspace.", directory)
+
+                subdirectories = []
+                has_files = False
+                try:
+                    with os.scandir(directory) as iterator:
+                        entries = sorted(iterator, key=attrgetter("name"))
+                except OSError as e:
+                    vInfo(self._verbose, "Ignoring directory `%s`: %s", (directory, e))
+                    continue
+
+                for entry in entries:
+                    rel_path = entry.name if rel_dir == "" else rel_dir + "/" + entry.name
+                    is_dir = entry.is_dir()
+
+                    if (
+                        (is_dir and entry.name in IGNORED_DIRECTORIES)
+                        or (rel_path in CONFIG_FILES)
+                        or self._matcher.excluded(rel_path, is_dir)
+                    ):
+                        vInfo(self._verbose, "Ignoring `%s` from workspace.", entry.path)
+                        continue
+
+                    if is_dir:
+                        if entry.is_symlink():
+                            vInfo(self._verbose, "Ignoring link to directory `%s`.", entry.path)
+                            continue
+                        subdirectories.append((entry.path, rel_path, entry.stat()))
+                        continue
+
+                    try:
+                        entry_stat = entry.stat()
+                    except FileNotFoundError:
+                        vInfo(self._verbose, "Ignoring missing file `%s`.", entry.path)
+                        continue
+                    vInfo(self._verbose, "Including file `%s` into workspace.", entry.path)
+                    has_files = True
+                    yield entry.path, rel_path, entry_stat
+
+                # The root of the context always holds `runup.yaml` and `.runup`
+                if all_dirs or (not has_files and rel_dir != ""):
+                    yield directory, rel_dir or ".", dir_stat
+
+                # Reversed, so they are scanned in order
+                stack.extend(reversed(subdirectories))
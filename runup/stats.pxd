@@ -0,0 +1,18 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+cpdef str format_size(size)
+
+cpdef str format_duration(duration)
+
+cpdef str format_speed(size, duration)
+
+cpdef str format_time(timestamp)
+
+cpdef list job_lines(list summaries)
+
+cpdef list stats_lines(list totals)
@@ -0,0 +1,136 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+from datetime import datetime
+
+
+SIZE_UNITS = ("B", "KiB", "MiB", "GiB", "TiB", "PiB")
+
+JOB_COLUMNS = ("Job", "Project", "Started", "Duration", "Files", "New", "New data", "Deduped", "Stored", "Speed")
+
+
+cpdef str format_size(size):
+    """Human readable size of a number of bytes, `-` if it is unknown."""
+
+    cdef double value
+    cdef int unit = 0
+
+    if size is None:
+        return "-"
+
+    value = size
+    while value >= 1024 and unit < len(SIZE_UNITS) - 1:
+        value /= 1024
+        unit += 1
+
+    if unit == 0:
+        return f"{int(value)} B"
+    return f"{value:.1f} {SIZE_UNITS[unit]}"
+
+
+cpdef str format_duration(duration):
+    """Human readable duration of a number of seconds, `-` if it is unknown."""
+
+    cdef int seconds
+
+    if duration is None:
+        return "-"
+    if duration < 60:
+        return f"{duration:.1f}s"
+
+    seconds = int(round(duration))
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+
+cpdef str format_speed(size, duration):
+    """Bytes per second, `-` if unknown."""
+
+    if size is None or duration is None or duration <= 0:
+        return "-"
+    return format_size(size / duration) + "/s"
+
+
+cpdef str format_time(timestamp):
+    """Local date and time of a timestamp."""
+
+    if timestamp is None:
+        return "-"
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+
+cpdef list job_lines(list summaries):
+    """
+    Table of the jobs, one line per job.
+
+    `summaries` are the rows of `RunupDB.select_summaries()`. The jobs
+    that never finished are shown as interrupted.
+    """
+
+    cdef list table = [JOB_COLUMNS]
+
+    for (
+        job_id, project, time_start, time_finish, files_num,
+        new_files, new_bytes, deduped_bytes, stored_bytes, duration,
+    ) in summaries:
+        read_bytes = None if new_bytes is None else new_bytes + deduped_bytes
+        table.append((
+            str(job_id),
+            project,
+            format_time(time_start),
+            format_duration(duration) if time_finish is not None else "interrupted",
+            str(files_num),
+            str(new_files),
+            format_size(new_bytes),
+            format_size(deduped_bytes),
+            format_size(stored_bytes),
+            format_speed(read_bytes, duration),
+        ))
+
+    widths = [max([len(row[column]) for row in table]) for column in range(len(JOB_COLUMNS))]
+    return [
+        "  ".join([
+            # Text to the left, numbers to the right
+            value.ljust(width) if column in (1, 2) else value.rjust(width)
+            for column, (value, width) in enumerate(zip(row, widths))
+        ]).rstrip()
+        for row in table
+    ]
+
+
+cpdef list stats_lines(list totals):
+    """
+    Statistics of the projects, a few lines per project.
+
+    `totals` are the rows of `RunupDB.select_totals()`. The
+    deduplication ratio is the data backed up per byte of new data,
+    and the compression ratio the new data per byte stored.
+    """
+
+    cdef list lines = []
+
+    for (
+        project, jobs, last_finish, files_num, new_bytes, deduped_bytes, stored_bytes, duration,
+    ) in totals:
+        read_bytes = None if new_bytes is None else new_bytes + deduped_bytes
+        lines.append(f'Project "{project}"')
+        lines.append(f"  Jobs:              {jobs} (last finished {format_time(last_finish)})")
+        lines.append(f"  Files:             {files_num} in the latest job")
+        lines.append(
+            f"  Data backed up:    {format_size(read_bytes)} "
+            + f"(new {format_size(new_bytes)}, deduplicated {format_size(deduped_bytes)})"
+        )
+        lines.append(f"  Stored:            {format_size(stored_bytes)}")
+        if new_bytes:
+            lines.append(f"  Deduplication:     {read_bytes / new_bytes:.2f}x")
+        if new_bytes and stored_bytes:
+            lines.append(f"  Compression:       {new_bytes / stored_bytes:.2f}x")
+        lines.append(f"  Average speed:     {format_speed(read_bytes, duration)}")
+
+    return lines
@@ -0,0 +1,61 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+cdef class Tracer:
+
+    cdef readonly bint enabled
+    cdef str _path
+    cdef bint _prometheus
+    cdef _file
+    cdef _lock
+    cdef dict _counters
+    cdef dict _histograms
+    cdef double _origin
+
+    cpdef start(self, str path)
+
+    cpdef span(self, str name)
+
+    cpdef wrap(self, str name, func)
+
+    cpdef iterate(self, str name, iterable)
+
+    cpdef count(self, str name, long long value=*)
+
+    cpdef record(self, str name, double start, double duration)
+
+    cpdef stop(self)
+
+    cdef str _prometheus_text(self)
+
+
+cdef class Span:
+
+    cdef Tracer _tracer
+    cdef str _name
+    cdef double _start
+
+
+cdef class NoSpan:
+    pass
+
+
+cdef class TimedCall:
+
+    cdef Tracer _tracer
+    cdef str _name
+    cdef object _func
+
+
+cdef class TimedIterator:
+
+    cdef Tracer _tracer
+    cdef str _name
+    cdef object _iterator
+
+
+cpdef Tracer get_tracer()
@@ -0,0 +1,254 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import json
+import os
+import threading
+import time
+
+
+# Upper bounds, in seconds, of the buckets of the histograms of the spans
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+# Extension of the files written in the textfile format of Prometheus
+PROMETHEUS_EXTENSION = ".prom"
+
+
+cdef class Span:
+    """A timed part of the work, recorded by its tracer when it ends."""
+
+    def __init__(self, Tracer tracer, str name):
+
+        self._tracer = tracer
+        self._name = name
+        self._start = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._tracer.record(self._name, self._start, time.perf_counter() - self._start)
+        return False
+
+
+cdef class NoSpan:
+    """The span given while tracing is disabled: it does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+cdef NoSpan NO_SPAN = NoSpan()
+
+
+cdef class TimedCall:
+    """A function whose calls are recorded as spans."""
+
+    def __init__(self, Tracer tracer, str name, func):
+
+        self._tracer = tracer
+        self._name = name
+        self._func = func
+
+    def __call__(self, *args, **kwargs):
+        cdef double start = time.perf_counter()
+        try:
+            return self._func(*args, **kwargs)
+        finally:
+            self._tracer.record(self._name, start, time.perf_counter() - start)
+
+
+cdef class TimedIterator:
+    """An iterator whose steps are recorded as spans."""
+
+    def __init__(self, Tracer tracer, str name, iterable):
+
+        self._tracer = tracer
+        self._name = name
+        self._iterator = iter(iterable)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        cdef double start = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self._tracer.record(self._name, start, time.perf_counter() - start)
+
+
+cdef class Tracer:
+    """
+    Counters and timed spans of the work done by a command.
+
+    Tracing is disabled until `start()` is called, and then everything
+    asked of the tracer returns at once: `span()` gives a span that does
+    nothing, `wrap()` and `iterate()` give back what they get and
+    `count()` ignores the value. Once started, every span is added to
+    the histogram of its name (see `BUCKETS`) and, if the trace is
+    written as JSON lines, to the file as it ends. The counters and the
+    histograms are written by `stop()`: as JSON lines, or in the
+    textfile format of Prometheus if the file ends with `.prom`.
+
+    It can be used from any thread, and as a context manager that stops
+    it at the end. There is one tracer per process (see `get_tracer()`).
+    """
+
+    def __init__(self):
+
+        self.enabled = False
+        self._path = None
+        self._prometheus = False
+        self._file = None
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._origin = 0
+
+    cpdef start(self, str path):
+        """Trace everything from now on into the file `path`."""
+
+        self._path = path
+        self._prometheus = path.endswith(PROMETHEUS_EXTENSION)
+        self._counters = {}
+        self._histograms = {}
+        self._origin = time.perf_counter()
+        if not self._prometheus:
+            self._file = open(path, "w")
+        self.enabled = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    cpdef span(self, str name):
+        """A context manager that records the time spent in it as `name`."""
+
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name)
+
+    cpdef wrap(self, str name, func):
+        """`func`, recording the time spent in each call as `name`."""
+
+        if not self.enabled:
+            return func
+        return TimedCall(self, name, func)
+
+    cpdef iterate(self, str name, iterable):
+        """`iterable`, recording the time spent getting each item as `name`."""
+
+        if not self.enabled:
+            return iterable
+        return TimedIterator(self, name, iterable)
+
+    cpdef count(self, str name, long long value=1):
+        """Add `value` to the counter `name`."""
+
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    cpdef record(self, str name, double start, double duration):
+        """Record a span that began at `start` (`time.perf_counter()`) and lasted `duration`."""
+
+        cdef int bucket = 0
+        cdef list histogram
+
+        if not self.enabled:
+            return
+
+        while bucket < len(BUCKETS) and duration > BUCKETS[bucket]:
+            bucket += 1
+
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = [0, 0.0, [0] * (len(BUCKETS) + 1)]
+            histogram[0] += 1
+            histogram[1] += duration
+            histogram[2][bucket] += 1
+
+            if self._file is not None:
+                self._file.write(json.dumps({
+                    "type": "span",
+                    "name": name,
+                    "start": round(start - self._origin, 6),
+                    "duration": round(duration, 6),
+                    "thread": threading.current_thread().name,
+                }) + "\n")
+
+    cpdef stop(self):
+        """Write the counters and histograms, and stop tracing."""
+
+        if not self.enabled:
+            return
+
+        self.enabled = False
+        if self._prometheus:
+            # Written aside and renamed, so a collector never reads half a file
+            with open(self._path + ".tmp", "w") as afile:
+                afile.write(self._prometheus_text())
+            os.replace(self._path + ".tmp", self._path)
+        else:
+            for name in sorted(self._counters):
+                self._file.write(
+                    json.dumps({"type": "counter", "name": name, "value": self._counters[name]}) + "\n"
+                )
+            for name in sorted(self._histograms):
+                count, total, buckets = self._histograms[name]
+                self._file.write(json.dumps({
+                    "type": "histogram",
+                    "name": name,
+                    "count": count,
+                    "sum": round(total, 6),
+                    "buckets": dict(zip([str(bound) for bound in BUCKETS] + ["+Inf"], buckets)),
+                }) + "\n")
+            self._file.close()
+            self._file = None
+
+    cdef str _prometheus_text(self):
+        """The counters and histograms in the textfile format of Prometheus."""
+
+        cdef list lines = []
+        cdef long long cumulative
+
+        for name in sorted(self._counters):
+            lines.append(f"# TYPE runup_{name}_total counter")
+            lines.append(f"runup_{name}_total {self._counters[name]}")
+
+        if len(self._histograms) > 0:
+            lines.append("# HELP runup_span_seconds Time spent in each part of the work.")
+            lines.append("# TYPE runup_span_seconds histogram")
+        for name in sorted(self._histograms):
+            count, total, buckets = self._histograms[name]
+            cumulative = 0
+            for bound, bucket in zip([str(bound) for bound in BUCKETS] + ["+Inf"], buckets):
+                cumulative += bucket
+                lines.append(f'runup_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'runup_span_seconds_sum{{span="{name}"}} {total:.6f}')
+            lines.append(f'runup_span_seconds_count{{span="{name}"}} {count}')
+
+        return "\n".join(lines) + "\n"
+
+
+cdef Tracer _tracer = Tracer()
+
+
+cpdef Tracer get_tracer():
+    """The tracer of the process."""
+    return _tracer
@@ -5,12 +5,43 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 
-cdef void vInfo(bint verbose, str msg)
+cdef void vInfo(bint verbose, str msg, args=*)
 
 cdef void vCall(bint verbose, str func)
 
 cdef void vResponse(bint verbose, str func, res)
 
+cpdef long long memory_high_water(bint reset=*)
+
+cpdef bint process_alive(pid)
+
+cdef class FileHasher:
+
+    cdef bytearray _buffer
+    cdef object _view
+
+    cpdef tuple hash(self, str fname, tuple algos)
+
+cpdef FileHasher get_hasher()
+
+cpdef new_hasher(str algo)
+
+cpdef tuple hash_file(str fname, tuple algos)
+
 cpdef hash_bytestr_iter(bytesiter, hasher)
 
-cpdef hashfile(str fname, char* algo)
\ No newline at end of file
+cpdef hashfile(str fname, char* algo)
+
+cpdef tuple prepare_entry(str fname, str arcname, stat_result, tuple algos, int compress_type, compresslevel)
+
+cpdef int compression_for(str fname, data, int compress_type)
+
+cpdef double entropy(const unsigned char[:] data)
+
+cpdef void write_entry(my_zip, zinfo, bytes data) except *
+
+cpdef copy_entry(src_zip, zinfo, dst_zip, str arcname)
+
+cpdef dict read_repository_info(context)
+
+cpdef void write_repository_info(context, str version, tuple digests, str storage=*)
\ No newline at end of file
@@ -6,22 +6,45 @@
 
 
 # Built-in
+import copy
 import hashlib
-from os.path import isdir
+import mmap
+from os import fstat, kill
+from os.path import isdir, splitext
+from stat import S_ISDIR
+import struct
+import sys
+import threading
+import zipfile
+from zlib import crc32
 
 # 3rd party
 from click import echo
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 3rd party - C
+from libc.math cimport log2
+from libc.string cimport memset
+
 
 # ------- #
 # VERBOSE #
 # ------- #
 
 
-cdef void vInfo(bint verbose, str msg):
-    """Print verbose Info"""
+cdef void vInfo(bint verbose, str msg, args=None):
+    """
+    Print verbose Info
+
+    `msg` is formatted with `args` (as with `%`) only when it is shown,
+    so the messages of every file cost nothing unless `verbose` is set.
+    """
     if verbose:
-        echo(f"Info: {msg}")
+        echo("Info: " + (msg if args is None else msg % args))
 
 
 cdef void vCall(bint verbose, str func):
@@ -36,11 +59,151 @@ cdef void vResponse(bint verbose, str func, res):
         echo(f"Response: {func} => {res}")
 
 
+cpdef long long memory_high_water(bint reset=False):
+    """
+    Peak resident memory of the process, in bytes (-1 if unknown).
+
+    On Linux the peak can be reset with `reset`, so it can be measured
+    for a part of the run (a backup). Elsewhere it is the peak of the
+    whole process.
+    """
+
+    cdef long long peak = -1
+
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        if resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Kilobytes, but bytes on macOS
+            if sys.platform != "darwin":
+                peak *= 1024
+        return peak
+
+    if reset:
+        try:
+            with open("/proc/self/clear_refs", "w") as clear_refs:
+                clear_refs.write("5")
+        except OSError:
+            pass
+    return peak
+
+
+cpdef bint process_alive(pid):
+    """Check if a process is running."""
+
+    if pid is None or pid <= 0:
+        return False
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
 # -------------- #
 # HASH FUNCTIONS #
 # -------------- #
 
 
+# Algorithms that can be used to sign the files of a repository
+SUPPORTED_DIGESTS = ("sha256", "sha512", "blake2b", "blake2s")
+
+# Digests used by repositories that don't declare theirs
+DEFAULT_DIGESTS = ("sha256", "sha512")
+
+# Size of the buffer used to read the files
+cdef Py_ssize_t BLOCK_SIZE = 1024 * 1024
+
+# Files bigger than this are mapped in memory instead of read
+cdef Py_ssize_t MMAP_THRESHOLD = 64 * 1024 * 1024
+
+# One hasher (and buffer) per thread
+_hashers = threading.local()
+
+
+cdef class FileHasher:
+    """
+    Compute several digests of a file reading it only once.
+
+    The file is read into a buffer allocated once per hasher and
+    every block is fed to all the requested digests. Big files are
+    mapped in memory so the data is not copied at all. A hasher is
+    not thread-safe, use `get_hasher()` to get the one of the thread.
+    """
+
+    def __init__(self, Py_ssize_t blocksize=BLOCK_SIZE):
+        self._buffer = bytearray(blocksize)
+        self._view = memoryview(self._buffer)
+
+    cpdef tuple hash(self, str fname, tuple algos):
+        """Return the hex digests of the file, in the order of `algos`."""
+
+        cdef list hashers = [new_hasher(algo) for algo in algos]
+        cdef Py_ssize_t size
+        cdef Py_ssize_t offset
+        cdef Py_ssize_t length
+
+        if isdir(fname):
+            return tuple(["" for _ in algos])
+
+        with open(fname, "rb", buffering=0) as afile:
+            size = fstat(afile.fileno()).st_size
+
+            if size >= MMAP_THRESHOLD:
+                with mmap.mmap(afile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    view = memoryview(mapped)
+                    try:
+                        offset = 0
+                        size = len(mapped)
+                        while offset < size:
+                            block = view[offset:offset + len(self._buffer)]
+                            for hasher in hashers:
+                                hasher.update(block)
+                            offset += len(block)
+                        del block
+                    finally:
+                        view.release()
+            else:
+                length = afile.readinto(self._buffer)
+                while length > 0:
+                    block = self._view[:length]
+                    for hasher in hashers:
+                        hasher.update(block)
+                    length = afile.readinto(self._buffer)
+
+        return tuple([hasher.hexdigest() for hasher in hashers])
+
+
+cpdef FileHasher get_hasher():
+    """Get the `FileHasher` of the current thread."""
+
+    hasher = getattr(_hashers, "hasher", None)
+    if hasher is None:
+        hasher = FileHasher()
+        _hashers.hasher = hasher
+    return hasher
+
+
+cpdef new_hasher(str algo):
+    """Create a hash object of a supported algorithm."""
+
+    if algo not in SUPPORTED_DIGESTS:
+        raise ValueError(f"Unsupported hash algorithm: {algo}")
+    return hashlib.new(algo)
+
+
+cpdef tuple hash_file(str fname, tuple algos):
+    """Return the hex digests of a file, reading it only once."""
+    return get_hasher().hash(fname, algos)
+
+
 cpdef hash_bytestr_iter(bytesiter, hasher):
     for block in bytesiter:
         hasher.update(block)
@@ -56,16 +219,243 @@ def file_as_blockiter(afile, int blocksize=65536):
 
 
 cpdef hashfile(str fname, char* algo):
-    algorithm: hashlib._Hash
+    return hash_file(fname, (algo.decode("ascii"),))[0]
 
-    if algo == b"sha256":
-        algorithm = hashlib.sha256()
-    elif algo == b"sha512":
-        algorithm = hashlib.sha512()
-    else:
-        raise ValueError(f"Unsupported hash algorithm: {algo}")
 
-    if isdir(fname):
-        return ""
+# ------------- #
+# ZIP FUNCTIONS #
+# ------------- #
+
+
+# Compression methods accepted by `project.*.compression.method`
+COMPRESSION_METHODS = {
+    "stored": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+
+# Extensions of formats that are already compressed
+COMPRESSED_EXTENSIONS = frozenset([
+    ".7z", ".apk", ".avi", ".br", ".bz2", ".deb", ".docx", ".epub", ".flac",
+    ".gif", ".gz", ".heic", ".jar", ".jpeg", ".jpg", ".lz4", ".lzma", ".m4a",
+    ".mkv", ".mov", ".mp3", ".mp4", ".odt", ".ogg", ".png", ".pptx", ".rar",
+    ".rpm", ".tgz", ".webm", ".webp", ".whl", ".xlsx", ".xz", ".zip", ".zst",
+])
+
+# Bytes looked at to guess if the data is already compressed
+cdef Py_ssize_t PROBE_SIZE = 64 * 1024
+
+# Data with more entropy than this (bits per byte) is not compressed
+cdef double ENTROPY_LIMIT = 7.5
+
+# Files up to this size are read, hashed and compressed in memory by
+# the workers. Bigger files are hashed by the workers but compressed
+# while they are written, to keep the memory usage bounded.
+cdef Py_ssize_t PREPARE_LIMIT = 4 * 1024 * 1024
+
+
+cpdef tuple prepare_entry(str fname, str arcname, stat_result, tuple algos, int compress_type, compresslevel):
+    """
+    Hash a file and, if it is small, prepare its compressed zip entry.
+
+    Designed to run on a worker thread. Returns a tuple
+    `(signature, zinfo, data)`, where `zinfo` and `data` are `None`
+    when the file needs to be written with `ZipFile.write()`.
+    """
+
+    cdef list hashers
+    cdef bytes data
+
+    if S_ISDIR(stat_result.st_mode) or stat_result.st_size > PREPARE_LIMIT:
+        return hash_file(fname, algos), None, None
+
+    with open(fname, "rb") as afile:
+        data = afile.read()
+
+    hashers = [new_hasher(algo) for algo in algos]
+    for hasher in hashers:
+        hasher.update(data)
+
+    compress_type = compression_for(fname, data, compress_type)
+
+    zinfo = zipfile.ZipInfo.from_file(fname, arcname)
+    zinfo.compress_type = compress_type
+    zinfo.file_size = len(data)
+    zinfo.CRC = crc32(data)
+
+    compressor = zipfile._get_compressor(compress_type, compresslevel)
+    if compressor is not None:
+        data = compressor.compress(data) + compressor.flush()
+    zinfo.compress_size = len(data)
+
+    return tuple([hasher.hexdigest() for hasher in hashers]), zinfo, data
+
+
+cpdef int compression_for(str fname, data, int compress_type):
+    """
+    Compression method to use for some data.
+
+    Data that looks already compressed, by the extension of its file
+    or by the entropy of its first bytes, is stored as it is. If `data`
+    is `None`, the first bytes are read from the file.
+    """
+
+    if compress_type == zipfile.ZIP_STORED:
+        return compress_type
+
+    if splitext(fname)[1].lower() in COMPRESSED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+
+    if data is None:
+        with open(fname, "rb") as afile:
+            data = afile.read(PROBE_SIZE)
+
+    if entropy(data[:PROBE_SIZE]) > ENTROPY_LIMIT:
+        return zipfile.ZIP_STORED
+
+    return compress_type
+
+
+cpdef double entropy(const unsigned char[:] data):
+    """Shannon entropy of some data, in bits per byte (0 to 8)."""
+
+    cdef Py_ssize_t counts[256]
+    cdef Py_ssize_t i
+    cdef Py_ssize_t length = data.shape[0]
+    cdef double result = 0
+    cdef double p
+
+    if length == 0:
+        return 0
+
+    memset(counts, 0, sizeof(counts))
+    for i in range(length):
+        counts[data[i]] += 1
+
+    for i in range(256):
+        if counts[i] > 0:
+            p = <double>counts[i] / length
+            result -= p * log2(p)
+
+    return result
+
+
+cpdef void write_entry(my_zip, zinfo, bytes data) except *:
+    """Write an entry prepared by `prepare_entry()` into an open zip."""
+
+    my_zip._writecheck(zinfo)
+    my_zip._didModify = True
+
+    zinfo.header_offset = my_zip.fp.tell()
+    my_zip.fp.write(zinfo.FileHeader(False))
+    my_zip.fp.write(data)
+    my_zip.start_dir = my_zip.fp.tell()
+
+    my_zip.filelist.append(zinfo)
+    my_zip.NameToInfo[zinfo.filename] = zinfo
+
+
+cpdef copy_entry(src_zip, zinfo, dst_zip, str arcname):
+    """
+    Copy an entry of an open zip into another one as `arcname`.
+
+    The data is copied as it is stored, without decompressing it,
+    in blocks of `BLOCK_SIZE` bytes, so entries of any size fit.
+    """
+
+    cdef long long remaining = zinfo.compress_size
+
+    src_zip.fp.seek(zinfo.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, src_zip.fp.read(zipfile.sizeFileHeader))
+    src_zip.fp.seek(
+        header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], 1
+    )
+
+    new_info = copy.copy(zinfo)
+    new_info.filename = arcname
+    new_info.orig_filename = arcname
+    new_info.extra = b""
+    # Sizes and CRC go in the header, never in a data descriptor
+    new_info.flag_bits &= ~0x08
+
+    dst_zip._writecheck(new_info)
+    dst_zip._didModify = True
+
+    new_info.header_offset = dst_zip.fp.tell()
+    dst_zip.fp.write(new_info.FileHeader(None))
+    while remaining > 0:
+        data = src_zip.fp.read(min(BLOCK_SIZE, remaining))
+        if len(data) == 0:
+            raise zipfile.BadZipFile(f"Truncated entry: {zinfo.filename}")
+        dst_zip.fp.write(data)
+        remaining -= len(data)
+    dst_zip.start_dir = dst_zip.fp.tell()
+
+    dst_zip.filelist.append(new_info)
+    dst_zip.NameToInfo[new_info.filename] = new_info
+
+
+# ---------- #
+# REPOSITORY #
+# ---------- #
+
+
+# Where the content of the files is stored: one zip per job
+# or content-addressed packs shared by all the jobs
+STORAGE_BACKENDS = ("zip", "packs")
+
+# Storage of repositories that don't declare theirs
+DEFAULT_STORAGE = "zip"
+
+
+cpdef dict read_repository_info(context):
+    """
+    Read the `.runup/.version` file of a repository.
+
+    The first line is the version of the repository. The following
+    lines are optional `key: value` settings. Missing settings
+    (i.e. on repositories created by older versions) get their
+    default value.
+    """
+
+    cdef dict info = {"version": None, "digests": DEFAULT_DIGESTS, "storage": DEFAULT_STORAGE}
+
+    try:
+        with open(f"{context}/.runup/.version", "r") as file:
+            lines = file.read().splitlines()
+    except FileNotFoundError:
+        return info
+
+    if len(lines) > 0:
+        info["version"] = lines[0].strip()
+
+    for line in lines[1:]:
+        if ":" not in line:
+            continue
+        key, value = line.split(":", 1)
+        key = key.strip()
+        if key == "digests":
+            info["digests"] = tuple([algo.strip() for algo in value.split(",") if algo.strip()])
+        elif key == "storage":
+            info["storage"] = value.strip()
+
+    return info
+
+
+cpdef void write_repository_info(context, str version, tuple digests, str storage="zip"):
+    """Write the `.runup/.version` file of a repository."""
+
+    for algo in digests:
+        if algo not in SUPPORTED_DIGESTS:
+            raise ValueError(f"Unsupported hash algorithm: {algo}")
+    if storage not in STORAGE_BACKENDS:
+        raise ValueError(f"Unsupported storage: {storage}")
 
-    return hash_bytestr_iter(file_as_blockiter(open(fname, "rb")), algorithm)
+    with open(f"{context}/.runup/.version", "w") as file:
+        file.write(version)
+        # Keep the file as it was when the defaults are used
+        if digests != DEFAULT_DIGESTS:
+            file.write("\ndigests: " + ",".join(digests))
+        if storage != DEFAULT_STORAGE:
+            file.write("\nstorage: " + storage)
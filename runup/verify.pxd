@@ -0,0 +1,26 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Own
+from runup.packs cimport PackStore
+
+
+cdef class Verifier:
+
+    cdef str _context
+    cdef tuple _digests
+    cdef bint _verbose
+    cdef PackStore _packs
+    cdef _local
+    cdef _lock
+    cdef list _handles
+
+    cdef _archive(self, int job_id)
+
+    cdef _open(self, int job_id, str src)
+
+    cpdef list verify(self, list contents, int workers, double time_limit=*)
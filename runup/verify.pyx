@@ -0,0 +1,175 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import zipfile
+import zlib
+
+# 3rd Party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.packs cimport PackStore
+from runup.utils cimport new_hasher, vInfo
+
+
+# Size of the reads of the stored data
+READ_SIZE = 1024 * 1024
+
+# Contents being verified per worker, so the results come back in order
+# without submitting every content of the repository at once
+QUEUE_DEPTH = 4
+
+# Errors of a content that is stored but can't be read back
+READ_ERRORS = (OSError, EOFError, zipfile.BadZipFile, zlib.error, ValueError)
+
+
+cdef class Verifier:
+    """
+    Check the contents of a repository against the signatures in the DB.
+
+    Every content is read as it is stored (an entry of the zip of its
+    job, or a blob of the packs; the chunks of a chunked file one after
+    the other) and hashed with all the digests of the repository, by a
+    pool of threads. As in `Restorer`, every thread keeps its own
+    `ZipFile` handle of each job it reads from.
+    """
+
+    def __init__(self, str context, tuple digests, bint verbose, PackStore packs=None):
+
+        self._context = context
+        self._digests = digests
+        self._verbose = verbose
+        self._packs = packs
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._handles = []
+
+    cdef _archive(self, int job_id):
+        """The `ZipFile` of a job, for the current thread."""
+
+        archives = getattr(self._local, "archives", None)
+        if archives is None:
+            archives = self._local.archives = {}
+
+        if job_id not in archives:
+            archive = zipfile.ZipFile(f"{self._context}.runup/jobs/{job_id}")
+            archives[job_id] = archive
+            with self._lock:
+                self._handles.append(archive)
+
+        return archives[job_id]
+
+    cdef _open(self, int job_id, str src):
+        """
+        File object with the data of an entry, as it was stored.
+
+        `src` is the path of the entry in its job, or its digest if the
+        content is in the packs. Raises `KeyError` if it is missing.
+        """
+
+        if self._packs is not None:
+            if not self._packs.contains(bytes.fromhex(src)):
+                raise KeyError(src)
+            return self._packs.open_blob(bytes.fromhex(src))
+
+        archive = self._archive(job_id)
+        entry = archive.open(archive.getinfo(src))
+        # The digests are checked instead, so a damaged entry is reported as mismatched
+        entry._expected_crc = None
+        return entry
+
+    def check(self, tuple content, double deadline=0):
+        """
+        Verify a content: `(blob_id, job_id, src, signature, chunks)`.
+
+        `chunks` is the list of `(job_id, digest, size)` of a chunked
+        file, `None` otherwise. Returns `(status, size, detail)`, where
+        `status` is `ok`, `mismatched`, `missing` or `unreadable` and
+        `size` the bytes read, or `None` if the `deadline` (a time of
+        `time.monotonic()`) passed before it started.
+        """
+
+        cdef list hashers
+        cdef long long size = 0
+
+        if deadline > 0 and time.monotonic() >= deadline:
+            return None
+
+        _, job_id, src, signature, chunks = content
+        if chunks is None:
+            sources = [(job_id, signature[0] if self._packs is not None else src)]
+        else:
+            sources = [
+                (chunk_job, digest if self._packs is not None else f".chunks/{digest}")
+                for chunk_job, digest, _ in chunks
+            ]
+
+        vInfo(self._verbose, "Verifying content: %s", src)
+        hashers = [new_hasher(algo) for algo in self._digests]
+        try:
+            for source_job, source in sources:
+                with self._open(source_job, source) as data:
+                    while True:
+                        block = data.read(READ_SIZE)
+                        if len(block) == 0:
+                            break
+                        size += len(block)
+                        for hasher in hashers:
+                            hasher.update(block)
+        except (KeyError, FileNotFoundError):
+            return "missing", size, ""
+        except READ_ERRORS as e:
+            return "unreadable", size, str(e)
+
+        if tuple([hasher.hexdigest() for hasher in hashers]) != signature:
+            return "mismatched", size, ""
+        return "ok", size, ""
+
+    cpdef list verify(self, list contents, int workers, double time_limit=0):
+        """
+        Verify contents on `workers` threads and wait for them.
+
+        Returns the `(content, status, size, detail)` of every content
+        verified, in order (see `check()`). With a `time_limit` (in
+        seconds), the contents not started by then are left out.
+        """
+
+        cdef list results = []
+        cdef double deadline = time.monotonic() + time_limit if time_limit > 0 else 0
+
+        pending: deque = deque()
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for content in contents:
+                    pending.append((content, pool.submit(self.check, content, deadline)))
+                    if len(pending) >= workers * QUEUE_DEPTH:
+                        content, future = pending.popleft()
+                        result = future.result()
+                        if result is not None:
+                            results.append((content, *result))
+                    if deadline > 0 and time.monotonic() >= deadline:
+                        break
+                while len(pending) > 0:
+                    content, future = pending.popleft()
+                    result = future.result()
+                    if result is not None:
+                        results.append((content, *result))
+        finally:
+            for archive in self._handles:
+                archive.close()
+            self._handles = []
+            self._local = threading.local()
+
+        return results
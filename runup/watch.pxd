@@ -0,0 +1,51 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Own
+from runup.journal cimport Journal
+
+
+cdef class Inotify:
+
+    cdef _libc
+    cdef readonly int fd
+
+    cdef _raise(self)
+
+    cpdef int add_watch(self, str path, unsigned int mask) except -1
+
+    cpdef list read(self, double timeout)
+
+    cpdef close(self)
+
+
+cdef class Watcher:
+
+    cdef str _context
+    cdef dict _configs
+    cdef bint _verbose
+    cdef dict _scanners
+    cdef Inotify _inotify
+    cdef Journal _journal
+    cdef dict _paths
+    cdef set _pending
+    cdef double _last_flush
+    cdef double _seen
+
+    cpdef start(self)
+
+    cdef bint _watch(self, str rel)
+
+    cdef bint _watch_tree(self, str project, str rel)
+
+    cpdef run(self, stop=*, double timeout=*)
+
+    cdef _handle(self, int wd, unsigned int mask, str name)
+
+    cpdef flush(self)
+
+    cpdef close(self)
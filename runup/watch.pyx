@@ -0,0 +1,299 @@
+# cython: language_level=3
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+from stat import S_ISDIR
+import struct
+import sys
+import time
+
+# 3rd Party
+import click
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.journal cimport Journal
+from runup.scanner cimport Scanner
+from runup.utils cimport vInfo
+
+
+# Flags of inotify (see `man 7 inotify`)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+# Events that change what a backup would store
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+
+# Header of an event: watch descriptor, mask, cookie, length of the name
+EVENT_HEADER = struct.Struct("iIII")
+
+# Bytes read from inotify at once, and events read before handling them
+EVENTS_BUFFER = 64 * 1024
+EVENTS_LIMIT = 10000
+
+# Seconds between two writes of the journal, and paths that force one
+FLUSH_INTERVAL = 1.0
+FLUSH_SIZE = 10000
+
+
+cdef class Inotify:
+    """Minimal binding of the inotify API of Linux, through `ctypes`."""
+
+    def __init__(self):
+
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+
+    cdef _raise(self):
+        """Raise the error of the last call."""
+
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+
+    cpdef int add_watch(self, str path, unsigned int mask) except -1:
+        """Watch a path, returning its watch descriptor."""
+
+        cdef int wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+
+        if wd < 0:
+            self._raise()
+        return wd
+
+    cpdef list read(self, double timeout):
+        """
+        Wait up to `timeout` seconds for events: list of `(wd, mask, name)`.
+
+        The events queued are read until there are none left or
+        `EVENTS_LIMIT` have been read.
+        """
+
+        cdef list events = []
+        cdef Py_ssize_t offset
+
+        if len(select.select([self.fd], [], [], timeout)[0]) == 0:
+            return events
+
+        while len(events) < EVENTS_LIMIT:
+            data = os.read(self.fd, EVENTS_BUFFER)
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                events.append((wd, mask, name))
+            if len(select.select([self.fd], [], [], 0)[0]) == 0:
+                break
+        return events
+
+    cpdef close(self):
+        """Release the watches."""
+
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+cdef class Watcher:
+    """
+    Record in the journal the paths that change in the projects.
+
+    Every directory of the projects is watched, except the excluded
+    ones, and new directories are watched as soon as they are created.
+    The changed paths are written to the journal in batches, with the
+    time up to which they are complete (see `Journal.take()`). If the
+    kernel drops events (its queue overflows) or a directory can't be
+    watched, the journal of the projects involved is invalidated, so
+    their next backup scans them fully again.
+    """
+
+    def __init__(self, context, dict configs, bint verbose):
+
+        self._context = str(context)
+        self._configs = configs
+        self._verbose = verbose
+        self._scanners = {
+            project: Scanner(self._context, config.get("exclude", []), verbose)
+            for project, config in configs.items()
+        }
+        self._inotify = None
+        self._journal = Journal(context, verbose)
+        self._paths = {}
+        self._pending = set()
+        self._last_flush = 0
+        self._seen = 0
+
+    cpdef start(self):
+        """Watch every directory of the projects, then start trusting the journal."""
+
+        cdef list projects = list(self._configs.keys())
+        cdef set failed = set()
+
+        self._inotify = Inotify()
+        self._journal.open()
+        self._journal.start(projects)
+
+        for project, config in self._configs.items():
+            for inc in config["include"]:
+                rel = os.path.normpath(inc.replace("/", os.sep)).replace(os.sep, "/")
+                rel = "" if rel == "." else rel
+                full_path = os.path.join(self._context, rel.replace("/", os.sep))
+                if os.path.isdir(full_path):
+                    if not self._watch_tree(project, rel):
+                        failed.add(project)
+                # Files (and includes that don't exist yet) are watched through their directory
+                elif not self._watch(rel.rpartition("/")[0]):
+                    failed.add(project)
+
+        self._journal.ready([project for project in projects if project not in failed])
+        self._last_flush = time.monotonic()
+        click.echo(f"Watching {len(self._paths)} directories.")
+
+    cdef bint _watch(self, str rel):
+        """Watch a directory (relative to the context). `False` if it can't be watched."""
+
+        full_path = os.path.join(self._context, rel.replace("/", os.sep)) if rel else self._context
+        try:
+            wd = self._inotify.add_watch(full_path, WATCH_MASK)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return True
+            click.secho(f"Can't watch `{full_path}`: {e}", fg="red")
+            return False
+        self._paths[wd] = rel
+        return True
+
+    cdef bint _watch_tree(self, str project, str rel):
+        """Watch a directory and the directories inside it."""
+
+        cdef bint watched = True
+
+        scanner: Scanner = self._scanners[project]
+        for _, rel_path, stat_result in scanner.scan([rel or "."], all_dirs=True):
+            if S_ISDIR(stat_result.st_mode) and not self._watch("" if rel_path == "." else rel_path):
+                watched = False
+        return watched
+
+    cpdef run(self, stop=None, double timeout=0):
+        """
+        Record the changes until `stop` (a `threading.Event`) is set or
+        `timeout` seconds (if not zero) have elapsed.
+        """
+
+        cdef double end = time.monotonic() + timeout
+        cdef double before
+        cdef list events
+
+        while stop is None or not stop.is_set():
+            if timeout > 0 and time.monotonic() >= end:
+                break
+            # The changes made before the read are in it, unless there were too many
+            before = time.time()
+            events = self._inotify.read(FLUSH_INTERVAL / 4)
+            for wd, mask, name in events:
+                self._handle(wd, mask, name)
+            if len(events) < EVENTS_LIMIT:
+                self._seen = before
+            if len(self._pending) >= FLUSH_SIZE or (
+                time.monotonic() - self._last_flush >= FLUSH_INTERVAL
+            ):
+                self.flush()
+
+    cdef _handle(self, int wd, unsigned int mask, str name):
+        """Record an event."""
+
+        cdef set failed = set()
+
+        if mask & IN_Q_OVERFLOW:
+            click.secho("Too many changes: some of them were lost.", fg="yellow")
+            self.flush()
+            self._journal.invalidate(list(self._configs.keys()))
+            return
+
+        if mask & IN_IGNORED:
+            self._paths.pop(wd, None)
+            return
+
+        if wd not in self._paths:
+            return
+
+        # Metadata of directories is not part of the backups
+        is_dir = bool(mask & IN_ISDIR) or name == ""
+        if is_dir and mask & ~IN_ISDIR == IN_ATTRIB:
+            return
+
+        parent = self._paths[wd]
+        if name == "":
+            path = parent
+        elif parent == "":
+            path = name
+        else:
+            path = parent + "/" + name
+
+        for project, config in self._configs.items():
+            scanner: Scanner = self._scanners[project]
+            if not scanner.covers(config["include"], path, is_dir):
+                continue
+            vInfo(self._verbose, "Changed in `%s`: %s", (project, path))
+            self._pending.add((project, path))
+
+            # New directories are watched, and will be scanned fully by the backup
+            if is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                if not self._watch_tree(project, path):
+                    failed.add(project)
+
+        # Changes in the directories that aren't watched would be missed
+        if len(failed) > 0:
+            self._journal.stop(list(failed))
+
+    cpdef flush(self):
+        """Write the pending paths to the journal."""
+
+        self._journal.record(list(self._pending), self._seen)
+        self._pending = set()
+        self._last_flush = time.monotonic()
+
+    cpdef close(self):
+        """Stop watching: the journal can't be trusted anymore."""
+
+        try:
+            self.flush()
+            self._journal.stop(list(self._configs.keys()))
+        finally:
+            self._journal.close()
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
@@ -134,9 +134,7 @@ cdef class ParserYAML:
 
             # If it contains a dot (is a minor/specific version)
             if config["version"].find(".") > 0:
-                vInfo(
-                    self._verbose, f"Info: Version {config['version']} is minor version"
-                )
+                vInfo(self._verbose, "Info: Version %s is minor version", config["version"])
                 # Use the vesion defined by the user
                 return config["version"]
             # If doesn't contains a dot (is major/general)
@@ -186,7 +184,7 @@ cdef class ParserYAML:
             )
             return None
         else:
-            vInfo(self._verbose, f"`{file_found}` found.")
+            vInfo(self._verbose, "`%s` found.", file_found)
 
         # Return YAML file
         with open(yaml_path, "r") as stream:
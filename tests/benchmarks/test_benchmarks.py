@@ -0,0 +1,89 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import hashlib
+import os
+import tempfile
+from typing import Dict
+from unittest import TestCase
+
+# 3rd party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from benchmarks.generator import MTIME, generate, rename
+from benchmarks.run import compare, run_scenario
+
+
+def _fingerprint(root: str) -> Dict[str, str]:
+    """Digest of every file of a tree, by path."""
+
+    digests: Dict[str, str] = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path, "rb") as f:
+                digests[os.path.relpath(path, root)] = hashlib.sha256(f.read()).hexdigest()
+    return digests
+
+
+class TestGenerator(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.root: str = self._directory.name
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_deterministic(self):
+        files, size = generate(f"{self.root}/a", "duplicated", "small", seed=1)
+        self.assertEqual((files, size), generate(f"{self.root}/b", "duplicated", "small", seed=1))
+        self.assertEqual(files, 1000)
+        self.assertEqual(_fingerprint(f"{self.root}/a"), _fingerprint(f"{self.root}/b"))
+        self.assertEqual(len(set(_fingerprint(f"{self.root}/a").values())), 20)
+        self.assertEqual(os.stat(f"{self.root}/a/dir-0000/copy-000000.txt").st_mtime, MTIME)
+
+        generate(f"{self.root}/c", "duplicated", "small", seed=2)
+        self.assertNotEqual(_fingerprint(f"{self.root}/a"), _fingerprint(f"{self.root}/c"))
+
+    def test_rename(self):
+        generate(self.root, "renamed", "small")
+        before = _fingerprint(self.root)
+        moved = rename(self.root)
+        after = _fingerprint(self.root)
+
+        self.assertGreater(moved, 0)
+        self.assertLess(moved, len(before))
+        self.assertEqual(len(after), len(before))
+        self.assertEqual(sorted(after.values()), sorted(before.values()))
+        self.assertEqual(len([path for path in after if path.startswith("renamed/")]), moved)
+
+
+class TestRun(TestCase):
+    def test_scenario(self):
+        results = run_scenario("deep", "small", 0, 2)
+        self.assertEqual(list(results), ["scan", "hashfile", "backup", "backup_unchanged", "restore"])
+        for result in results.values():
+            self.assertEqual(result["files"], 360)
+            self.assertGreater(result["files_per_s"], 0)
+
+    def test_compare(self):
+        baseline = {"results": {
+            "tiny/backup": {"seconds": 1.0, "peak_rss": 100},
+            "tiny/restore": {"seconds": 1.0, "peak_rss": 100},
+            "huge/backup": {"seconds": 1.0, "peak_rss": 100},
+        }}
+        report = {"results": {
+            "tiny/backup": {"seconds": 1.1, "peak_rss": 100},
+            "tiny/restore": {"seconds": 1.5, "peak_rss": 130},
+            "db/insert": {"seconds": 1.0, "peak_rss": 100},
+        }}
+        self.assertEqual(
+            compare(report, baseline, 15),
+            {"tiny/backup": "+10.0%", "tiny/restore": "+50.0% REGRESSION (time) (memory)"},
+        )
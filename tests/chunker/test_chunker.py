@@ -0,0 +1,55 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import hashlib
+import os
+import tempfile
+from typing import List, Tuple
+from unittest import TestCase
+
+# 3rd party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.chunker import Chunker, chunk_file
+
+
+class TestChunker(TestCase):
+
+    _data: bytes = b"".join(hashlib.sha512(i.to_bytes(4, "little")).digest() for i in range(8192))
+
+    def _chunk(self, data: bytes) -> Tuple[Tuple[str, ...], List[Tuple[str, int, int]]]:
+        with tempfile.TemporaryDirectory() as directory:
+            path: str = os.path.join(directory, "file")
+            with open(path, "wb") as f:
+                f.write(data)
+            return chunk_file(path, ("sha256",), Chunker(1024, 4096, 16384))
+
+    def test_chunks_cover_the_file(self):
+        signature, chunks = self._chunk(self._data)
+
+        self.assertEqual(signature[0], hashlib.sha256(self._data).hexdigest())
+        offset: int = 0
+        for digest, chunk_offset, size in chunks:
+            self.assertEqual(chunk_offset, offset)
+            self.assertLessEqual(size, 16384)
+            self.assertEqual(digest, hashlib.sha256(self._data[offset:offset + size]).hexdigest())
+            offset += size
+        self.assertEqual(offset, len(self._data))
+
+    def test_insertion_keeps_most_chunks(self):
+        _, chunks = self._chunk(self._data)
+        _, edited_chunks = self._chunk(self._data[:100000] + b"inserted" + self._data[100000:])
+
+        digests = set(chunk[0] for chunk in chunks)
+        edited_digests = set(chunk[0] for chunk in edited_chunks)
+        self.assertGreaterEqual(len(digests & edited_digests), len(digests) - 2)
+
+    def test_invalid_sizes(self):
+        with self.assertRaises(ValueError):
+            Chunker(4096, 1024, 16384)
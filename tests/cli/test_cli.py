@@ -4,10 +4,13 @@
 
 
 # Built-in
+import hashlib
+import io
 import os
 from pathlib import Path
 from shutil import rmtree as rmdir_recursive
 import sqlite3
+import tarfile
 from typing import List
 import unittest
 from unittest import mock
@@ -37,6 +40,7 @@ class CLI_1_0(TestCaseExtended):
         runner: CliRunner = CliRunner()
         folders = [
             "create-backup-and-restore",
+            "create-backup-chunked",
             "create-backup-implicit",
         ]
         for folder in folders:
@@ -49,22 +53,27 @@ class CLI_1_0(TestCaseExtended):
         folders = [
             "create-backup-implicit",
             "create-backup-and-restore",
+            "create-backup-chunked",
             "init",
         ]
         for folder in folders:
             if os.path.exists(f"{self._context}/{folder}/.runup"):
                 rmdir_recursive(f"{self._context}/{folder}/.runup")
 
-        restored_backup_dir = f"{self._context}/create-backup-and-restore/restore-here"
-        for f in os.listdir(restored_backup_dir):
-            if f == ".keep":
-                continue
+        for folder in ["create-backup-and-restore", "create-backup-chunked"]:
+            restored_backup_dir = f"{self._context}/{folder}/restore-here"
+            for f in os.listdir(restored_backup_dir):
+                if f == ".keep":
+                    continue
 
-            path_to_delete: Path = Path(os.path.join(restored_backup_dir, f))
-            if Path.is_dir(path_to_delete):
-                rmdir_recursive(path_to_delete)
-            else:
-                os.remove(path_to_delete)
+                path_to_delete: Path = Path(os.path.join(restored_backup_dir, f))
+                if Path.is_dir(path_to_delete):
+                    rmdir_recursive(path_to_delete)
+                else:
+                    os.remove(path_to_delete)
+
+        if os.path.exists(f"{self._context}/create-backup-chunked/data"):
+            rmdir_recursive(f"{self._context}/create-backup-chunked/data")
 
     def test_help(self):
 
@@ -87,6 +96,28 @@ class CLI_1_0(TestCaseExtended):
         self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
         self.assertEqual(result.exit_code, 0)
 
+    def test_init_digest(self):
+
+        # Prepare
+        runner: CliRunner = CliRunner()
+        context: Path = f"{self._context}/init"
+        # Execute
+        result = runner.invoke(cli, ["--context", context, "init", "--digest", "blake2b"])
+        # Assert
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+        self.assertEqual(result.exit_code, 0)
+        with open(f"{context}/.runup/.version") as f:
+            self.assertEqual(f.read(), "1\ndigests: blake2b")
+        conn = sqlite3.connect(context + "/.runup/runup.db")
+        columns: List[str] = [row[1] for row in conn.execute("PRAGMA table_info(blobs)")]
+        conn.close()
+        self.assertIn("blake2b", columns)
+        self.assertNotIn("sha256", columns)
+
+        # Backups use the digest of the repository
+        result = runner.invoke(cli, ["--context", context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+
     @mock.patch("runup.cli.click.echo", return_value=None)
     def test_init_verbose(self, mock_click_echo):
 
@@ -157,7 +188,7 @@ class CLI_1_0(TestCaseExtended):
 
         # Test files in DB
         conn = sqlite3.connect(context + "/.runup/runup.db")
-        cursor = conn.execute("SELECT path FROM 'files'")
+        cursor = conn.execute("SELECT path FROM files JOIN paths USING (path_id)")
         included_db_files: List[str] = []
         expected_db_files: List[str] = [
             "dir-include/file.txt",
@@ -198,6 +229,364 @@ class CLI_1_0(TestCaseExtended):
         for file in expected_db_files:
             self.assertIsFile(location + os.sep + file)
 
+    def test_create_backup_stat_cache(self):
+
+        # Prepare
+        runner: CliRunner = CliRunner()
+        context: Path = f"{self._context}/create-backup-and-restore"
+        # Make the files old enough to be cached
+        for root, _, files in os.walk(context):
+            for file in files:
+                os.utime(os.path.join(root, file), (1600000000, 1600000000))
+
+        # Execute
+        for args in (["backup"], ["backup"], ["backup", "--rehash"]):
+            result = runner.invoke(cli, ["--context", context] + args)
+            self.assertEqual(result.output, "New backup created.\n")
+            self.assertEqual(result.exit_code, 0)
+
+        # Assert
+        self.assertIsFile(context + "/.runup/statcache.db")
+        conn = sqlite3.connect(context + "/.runup/statcache.db")
+        cached: int = conn.execute("SELECT COUNT(*) FROM stat_cache").fetchone()[0]
+        conn.close()
+        self.assertEqual(cached, 4)
+
+        # Nothing changed, so later jobs only point to the first one
+        conn = sqlite3.connect(context + "/.runup/runup.db")
+        new_files: int = conn.execute(
+            "SELECT COUNT(*) FROM files WHERE job_id > 1 AND file_loc IS NULL"
+        ).fetchone()[0]
+        conn.close()
+        self.assertEqual(new_files, 0)
+        with ZipFile(context + "/.runup/jobs/2", "r") as myzip:
+            self.assertListEqual(myzip.namelist(), [])
+
+    def test_create_backup_jobs(self):
+
+        # Prepare
+        runner: CliRunner = CliRunner()
+        context: Path = f"{self._context}/create-backup-and-restore"
+
+        # Execute
+        for jobs in ("1", "4"):
+            result = runner.invoke(cli, ["--context", context, "backup", "--rehash", "--jobs", jobs])
+            self.assertEqual(result.output, "New backup created.\n")
+            self.assertEqual(result.exit_code, 0)
+
+        # Assert: Same DB rows in the same order, whatever the number of workers
+        conn = sqlite3.connect(context + "/.runup/runup.db")
+        paths_1 = conn.execute(
+            "SELECT path FROM files JOIN paths USING (path_id) WHERE job_id = 1 ORDER BY file_id"
+        ).fetchall()
+        paths_2 = conn.execute(
+            "SELECT path FROM files JOIN paths USING (path_id) WHERE job_id = 2 ORDER BY file_id"
+        ).fetchall()
+        conn.close()
+        self.assertListEqual(paths_1, paths_2)
+
+        with ZipFile(context + "/.runup/jobs/1", "r") as myzip:
+            self.assertIsNone(myzip.testzip())
+
+    def test_create_backup_and_restore_quoted_path(self):
+
+        # Prepare
+        runner: CliRunner = CliRunner()
+        context: Path = f"{self._context}/create-backup-and-restore"
+        quoted_file: str = f"{context}/dir-include/it's a \"file\".txt"
+        with open(quoted_file, "w") as f:
+            f.write("'); DROP TABLE files; --")
+
+        try:
+            # Execute
+            result = runner.invoke(cli, ["--context", context, "backup"])
+            self.assertEqual(result.output, "New backup created.\n")
+            result = runner.invoke(
+                cli,
+                ["--context", context, "restore", "-f", "--location", f"{context}/restore-here"],
+            )
+            self.assertEqual(result.exit_code, 0)
+        finally:
+            os.remove(quoted_file)
+
+        # Assert
+        self.assertIsFile(f"{context}/restore-here/dir-include/it's a \"file\".txt")
+
+    def test_restore_from_many_jobs(self):
+
+        # Prepare
+        runner: CliRunner = CliRunner()
+        context: Path = f"{self._context}/create-backup-and-restore"
+        new_file: str = f"{context}/dir-include/new-file.txt"
+        result = runner.invoke(cli, ["--context", context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+        with open(new_file, "w") as f:
+            f.write("Only in the second job")
+
+        try:
+            result = runner.invoke(cli, ["--context", context, "backup"])
+            self.assertEqual(result.output, "New backup created.\n")
+
+            # Execute
+            result = runner.invoke(
+                cli,
+                [
+                    "--context",
+                    context,
+                    "restore",
+                    "-f",
+                    "--jobs",
+                    "4",
+                    "--location",
+                    f"{context}/restore-here",
+                ],
+            )
+            self.assertEqual(result.exit_code, 0)
+        finally:
+            os.remove(new_file)
+
+        # Assert: Files of both jobs restored with their content
+        with open(f"{context}/restore-here/dir-include/new-file.txt") as f:
+            self.assertEqual(f.read(), "Only in the second job")
+        for file in ["dir-include/file.txt", "include.txt"]:
+            with open(f"{context}/{file}", "rb") as original, open(
+                f"{context}/restore-here/{file}", "rb"
+            ) as restored:
+                self.assertEqual(original.read(), restored.read())
+
+    def test_prune(self):
+
+        # Prepare: Two jobs, the second one only adds a file
+        runner: CliRunner = CliRunner()
+        context: Path = f"{self._context}/create-backup-and-restore"
+        location: str = f"{context}/restore-here"
+        new_file: str = f"{context}/dir-include/new-file.txt"
+        rmdir_recursive(f"{context}/.runup")
+        result = runner.invoke(cli, ["--context", context, "init"])
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+        result = runner.invoke(cli, ["--context", context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+        with open(new_file, "w") as f:
+            f.write("Only in the second job")
+        try:
+            result = runner.invoke(cli, ["--context", context, "backup"])
+            self.assertEqual(result.output, "New backup created.\n")
+        finally:
+            os.remove(new_file)
+
+        # Execute: A dry run changes nothing
+        result = runner.invoke(cli, ["--context", context, "prune", "--keep-last", "1", "--dry-run"])
+        self.assertEqual(result.output, 'Project "myproject": keeping 1 jobs, pruning 1 (1)\n')
+        self.assertIsFile(f"{context}/.runup/jobs/1")
+
+        result = runner.invoke(cli, ["--context", context, "prune", "--keep-last", "1"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("1 jobs have been pruned.", result.output)
+
+        # Assert: The first job is gone, but the latest one is still complete
+        self.assertFalse(os.path.exists(f"{context}/.runup/jobs/1"))
+        result = runner.invoke(cli, ["--context", context, "restore", "-f", "--location", location])
+        self.assertEqual(result.exit_code, 0)
+        with open(f"{location}/dir-include/new-file.txt") as f:
+            self.assertEqual(f.read(), "Only in the second job")
+        for file in ["dir-include/file.txt", "include.txt"]:
+            with open(f"{context}/{file}", "rb") as original, open(
+                f"{location}/{file}", "rb"
+            ) as restored:
+                self.assertEqual(original.read(), restored.read())
+
+        # The first job can't be restored anymore
+        result = runner.invoke(
+            cli, ["--context", context, "restore", "-f", "-j", "1", "--location", location]
+        )
+        self.assertIn("is not part of the job 1", result.output)
+
+        # A policy is required
+        result = runner.invoke(cli, ["--context", context, "prune"])
+        self.assertIn("The backups have NOT been pruned.", result.output)
+
+    def test_restore_sync(self):
+
+        # Prepare
+        runner: CliRunner = CliRunner()
+        context: Path = f"{self._context}/create-backup-and-restore"
+        location: str = f"{context}/restore-here"
+        result = runner.invoke(cli, ["--context", context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+        result = runner.invoke(cli, ["--context", context, "restore", "-f", "--location", location])
+        self.assertEqual(result.exit_code, 0)
+
+        unchanged_mtime: int = os.stat(f"{location}/include.txt").st_mtime_ns
+        with open(f"{location}/dir-include/file.txt", "w") as f:
+            f.write("Modified after the restoration")
+        with open(f"{location}/dir-include/extra.txt", "w") as f:
+            f.write("Not part of the backup")
+        os.mkdir(f"{location}/dir/extra-dir")
+        with open(f"{location}/dir/file-ignore.txt", "w") as f:
+            f.write("Excluded from the backup")
+
+        # Execute
+        result = runner.invoke(
+            cli, ["--context", context, "restore", "-f", "--sync", "--location", location]
+        )
+        self.assertEqual(result.exit_code, 0)
+
+        # Assert
+        with open(f"{context}/dir-include/file.txt") as original, open(
+            f"{location}/dir-include/file.txt"
+        ) as restored:
+            self.assertEqual(original.read(), restored.read())
+        self.assertEqual(os.stat(f"{location}/include.txt").st_mtime_ns, unchanged_mtime)
+        self.assertFalse(os.path.exists(f"{location}/dir-include/extra.txt"))
+        self.assertFalse(os.path.exists(f"{location}/dir/extra-dir"))
+        self.assertIsFile(f"{location}/dir/file-ignore.txt")
+        self.assertIsFile(f"{location}/.keep")
+
+    def test_export(self):
+
+        # Prepare
+        runner: CliRunner = CliRunner()
+        context: Path = f"{self._context}/create-backup-and-restore"
+        new_file: str = f"{context}/dir-include/new-file.txt"
+        result = runner.invoke(cli, ["--context", context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+        with open(new_file, "w") as f:
+            f.write("Only in the second job")
+
+        try:
+            result = runner.invoke(cli, ["--context", context, "backup"])
+            self.assertEqual(result.output, "New backup created.\n")
+        finally:
+            os.remove(new_file)
+
+        for fmt in ("tar", "tar.gz"):
+            # Execute
+            result = runner.invoke(
+                cli, ["--context", context, "export", "myproject", "--format", fmt, "-"]
+            )
+            self.assertEqual(result.exit_code, 0)
+
+            # Assert: Files of both jobs in the stream
+            with tarfile.open(fileobj=io.BytesIO(result.stdout_bytes), mode="r:*") as tar:
+                self.assertIn("dir-include/new-file.txt", tar.getnames())
+                self.assertEqual(
+                    tar.extractfile("dir-include/new-file.txt").read(), b"Only in the second job"
+                )
+                with open(f"{context}/include.txt", "rb") as original:
+                    self.assertEqual(tar.extractfile("include.txt").read(), original.read())
+
+    @mock.patch("runup.db.EAGER_INDEX_LIMIT", 0)
+    def test_create_backup_bloom_index(self):
+
+        # Prepare
+        runner: CliRunner = CliRunner()
+        context: Path = f"{self._context}/create-backup-and-restore"
+
+        # Execute
+        for _ in range(3):
+            result = runner.invoke(cli, ["--context", context, "backup", "--rehash"])
+            self.assertEqual(result.output, "New backup created.\n")
+
+        # Assert
+        self.assertIsFile(context + "/.runup/bloom")
+        conn = sqlite3.connect(context + "/.runup/runup.db")
+        new_files: int = conn.execute(
+            "SELECT COUNT(*) FROM files WHERE job_id > 1 AND file_loc IS NULL"
+        ).fetchone()[0]
+        conn.close()
+        self.assertEqual(new_files, 0)
+
+    def test_create_backup_packs(self):
+
+        # Prepare: Repository that stores the content in packs
+        runner: CliRunner = CliRunner()
+        context: Path = f"{self._context}/create-backup-and-restore"
+        location: str = f"{context}/restore-here"
+        new_file: str = f"{context}/dir-include/new-file.txt"
+        rmdir_recursive(f"{context}/.runup")
+        result = runner.invoke(cli, ["--context", context, "init", "--storage", "packs"])
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+
+        # Execute
+        result = runner.invoke(cli, ["--context", context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+        with open(new_file, "w") as f:
+            f.write("Only in the second job")
+        try:
+            result = runner.invoke(cli, ["--context", context, "backup"])
+            self.assertEqual(result.output, "New backup created.\n")
+        finally:
+            os.remove(new_file)
+
+        # Assert: No zip per job, and files of both jobs restored and exported
+        self.assertFalse(os.path.exists(f"{context}/.runup/jobs/1"))
+        self.assertIsFile(f"{context}/.runup/packs/index")
+
+        result = runner.invoke(cli, ["--context", context, "restore", "-f", "--location", location])
+        self.assertEqual(result.exit_code, 0)
+        with open(f"{location}/dir-include/new-file.txt") as f:
+            self.assertEqual(f.read(), "Only in the second job")
+        with open(f"{context}/include.txt") as original, open(f"{location}/include.txt") as restored:
+            self.assertEqual(original.read(), restored.read())
+
+        result = runner.invoke(cli, ["--context", context, "export", "myproject"])
+        self.assertEqual(result.exit_code, 0)
+        with tarfile.open(fileobj=io.BytesIO(result.stdout_bytes), mode="r:") as tar:
+            self.assertEqual(
+                tar.extractfile("dir-include/new-file.txt").read(), b"Only in the second job"
+            )
+
+        # Prune the first job: the content still used is kept in the packs
+        result = runner.invoke(cli, ["--context", context, "prune", "--keep-last", "1"])
+        self.assertEqual(result.exit_code, 0)
+        result = runner.invoke(cli, ["--context", context, "restore", "-f", "--location", location])
+        self.assertEqual(result.exit_code, 0)
+        with open(f"{context}/include.txt") as original, open(f"{location}/include.txt") as restored:
+            self.assertEqual(original.read(), restored.read())
+
+    def test_create_backup_chunked(self):
+
+        # Prepare
+        runner: CliRunner = CliRunner()
+        context: Path = f"{self._context}/create-backup-chunked"
+        os.mkdir(f"{context}/data")
+        # 12 MiB of pseudo-random data
+        content: bytearray = bytearray(
+            b"".join(hashlib.sha512(i.to_bytes(4, "little")).digest() for i in range(196608))
+        )
+        with open(f"{context}/data/dump.sql", "wb") as f:
+            f.write(content)
+
+        # Execute: Backup, edit a few bytes and backup again
+        result = runner.invoke(cli, ["--context", context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+        content[5 * 1024 * 1024:5 * 1024 * 1024 + 3] = b"new"
+        with open(f"{context}/data/dump.sql", "wb") as f:
+            f.write(content)
+        result = runner.invoke(cli, ["--context", context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+
+        # Assert: Only the edited chunk is stored again
+        conn = sqlite3.connect(context + "/.runup/runup.db")
+        chunks_1: int = conn.execute("SELECT COUNT(*) FROM chunks WHERE job_id = 1").fetchone()[0]
+        chunks_2: int = conn.execute("SELECT COUNT(*) FROM chunks WHERE job_id = 2").fetchone()[0]
+        conn.close()
+        self.assertGreater(chunks_1, 2)
+        self.assertLessEqual(chunks_2, 2)
+
+        # Restore the latest job
+        location: str = context + "/restore-here"
+        result = runner.invoke(cli, ["--context", context, "restore", "-f", "--location", location])
+        self.assertEqual(result.exit_code, 0)
+        with open(f"{location}/data/dump.sql", "rb") as f:
+            self.assertEqual(f.read(), bytes(content))
+
+        # Export the latest job
+        result = runner.invoke(cli, ["--context", context, "export", "myproject"])
+        self.assertEqual(result.exit_code, 0)
+        with tarfile.open(fileobj=io.BytesIO(result.stdout_bytes), mode="r:") as tar:
+            self.assertEqual(tar.extractfile("data/dump.sql").read(), bytes(content))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,197 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import os
+import shutil
+import sqlite3
+import tempfile
+from typing import Set
+from unittest import TestCase, mock
+
+# 3rd party
+from click.testing import CliRunner
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.cli import cli
+from runup.db import RunupDB, SCHEMA_VERSION
+
+
+# A `runup.db` created before the schema was versioned
+LEGACY_DB: str = "./tests/cli/version-1.0/create-backup-implicit/.runup-test-restore/runup.db"
+
+# Files with their paths and signatures
+FILES_QUERY: str = (
+    "SELECT file_id, job_id, path, lower(hex(sha256)), lower(hex(sha512)), file_loc "
+    + "FROM files JOIN paths USING (path_id) JOIN blobs USING (blob_id) ORDER BY file_id"
+)
+
+
+class TestMigrations(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.context: str = self._directory.name
+        os.mkdir(f"{self.context}/.runup")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"{self.context}/.runup/runup.db")
+
+    def _schema(self) -> Set[str]:
+        conn: sqlite3.Connection = self._connect()
+        try:
+            return {
+                name
+                for (name,) in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"
+                )
+            }
+        finally:
+            conn.close()
+
+    def _open(self):
+        db: RunupDB = RunupDB(self.context, False)
+        db.open(False)
+        db.close()
+
+    def test_upgrade_legacy(self):
+        shutil.copy(LEGACY_DB, f"{self.context}/.runup/runup.db")
+        conn: sqlite3.Connection = self._connect()
+        conn.execute("INSERT INTO backups VALUES ('myproject', 0, NULL)")
+        conn.execute("INSERT INTO jobs VALUES (1, 'myproject', 0, NULL, 0)")
+        # 10 contents, the copies pointing to the first file that holds them
+        conn.executemany(
+            "INSERT INTO files VALUES (?, 1, ?, ?, ?, ?)",
+            [
+                (i, f"file-{i}", f"{i % 10:064x}", f"{i % 10:0128x}", None if i <= 10 else i % 10 or 10)
+                for i in range(1, 101)
+            ],
+        )
+        conn.commit()
+        files = conn.execute("SELECT * FROM files ORDER BY file_id").fetchall()
+        conn.close()
+
+        self._open()
+
+        conn = self._connect()
+        try:
+            self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], SCHEMA_VERSION)
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(conn.execute(FILES_QUERY).fetchall(), files)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0], 10)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM paths").fetchone()[0], 100)
+            # The summary of the job is rebuilt, without the sizes
+            self.assertEqual(
+                conn.execute(
+                    "SELECT time_finish, files_num, new_files, new_bytes, state FROM jobs"
+                ).fetchall(),
+                [(0, 100, 10, None, "finished")],
+            )
+            self.assertEqual(
+                [row[1] for row in conn.execute("PRAGMA table_info(files)")],
+                ["file_id", "job_id", "path_id", "blob_id", "file_loc"],
+            )
+            # Statistics for the query planner
+            self.assertGreater(conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0], 0)
+        finally:
+            conn.close()
+
+        # Same schema as a new DB
+        upgraded: Set[str] = self._schema()
+        os.remove(f"{self.context}/.runup/runup.db")
+        self._open()
+        self.assertEqual(upgraded, self._schema())
+        self.assertIn("idx_backup_jobs", upgraded)
+        self.assertIn("idx_file_loc", upgraded)
+        self.assertIn("idx_blob_signature", upgraded)
+        self.assertNotIn("idx_job_id", upgraded)
+        self.assertNotIn("idx_signature", upgraded)
+
+    def test_query_plans(self):
+        self._open()
+        conn: sqlite3.Connection = self._connect()
+        try:
+            plan: str = str(
+                conn.execute(
+                    "EXPLAIN QUERY PLAN SELECT MAX(job_id) FROM jobs WHERE backup_name = ?", ("p",)
+                ).fetchall()
+            )
+            self.assertIn("idx_backup_jobs", plan)
+            plan = str(
+                conn.execute(
+                    "EXPLAIN QUERY PLAN SELECT file_id FROM files WHERE file_loc = ?", (1,)
+                ).fetchall()
+            )
+            self.assertIn("idx_file_loc", plan)
+            plan = str(
+                conn.execute(
+                    "EXPLAIN QUERY PLAN SELECT MIN(file_id) FROM blobs JOIN files USING (blob_id) "
+                    + "WHERE sha256 = ? AND sha512 = ?",
+                    (b"", b""),
+                ).fetchall()
+            )
+            self.assertIn("idx_blob_signature", plan)
+            self.assertIn("idx_file_blob", plan)
+        finally:
+            conn.close()
+
+    def test_newer_schema(self):
+        os.rmdir(f"{self.context}/.runup")
+        with open(f"{self.context}/runup.yaml", "w") as f:
+            f.write("version: '1.0'\n\nproject:\n  myproject:\n    include:\n      - './'\n")
+        runner: CliRunner = CliRunner()
+        result = runner.invoke(cli, ["--context", self.context, "init"])
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+
+        conn: sqlite3.Connection = self._connect()
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+        conn.close()
+
+        result = runner.invoke(cli, ["--context", self.context, "backup"])
+        self.assertEqual(
+            result.output,
+            f"The repository was created by a newer version of RunUp (schema {SCHEMA_VERSION + 1}).\n"
+            + "The backup has NOT been created.\n",
+        )
+
+    def test_contents_and_paths_stored_once(self):
+        self._backup_twice()
+
+    def test_contents_stored_once_without_upsert(self):
+        # SQLite older than 3.24, as shipped with some builds of Python 3.7
+        with mock.patch("runup.db.UPSERT_VERSION", (99, 0, 0)):
+            self._backup_twice()
+
+    def _backup_twice(self):
+        os.rmdir(f"{self.context}/.runup")
+        with open(f"{self.context}/runup.yaml", "w") as f:
+            f.write("version: '1.0'\n\nproject:\n  myproject:\n    include:\n      - './dir'\n")
+        os.mkdir(f"{self.context}/dir")
+        for name in ("a.txt", "b.txt"):
+            with open(f"{self.context}/dir/{name}", "w") as f:
+                f.write("same content")
+        runner: CliRunner = CliRunner()
+        result = runner.invoke(cli, ["--context", self.context, "init"])
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+        for _ in range(2):
+            result = runner.invoke(cli, ["--context", self.context, "backup"])
+            self.assertEqual(result.output, "New backup created.\n")
+
+        conn: sqlite3.Connection = self._connect()
+        try:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM files").fetchone()[0], 4)
+            # The content of both files, in both jobs
+            self.assertEqual(conn.execute("SELECT size FROM blobs").fetchall(), [(12,)])
+            self.assertEqual(
+                conn.execute("SELECT path FROM paths ORDER BY path").fetchall(),
+                [("dir/a.txt",), ("dir/b.txt",)],
+            )
+        finally:
+            conn.close()
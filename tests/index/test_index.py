@@ -0,0 +1,128 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import hashlib
+import os
+import tempfile
+from typing import List
+from unittest import TestCase
+
+# 3rd party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.index import BloomFilter, DigestIndex, load_bloom, signature_key
+
+
+def _keys(start: int, count: int) -> List[bytes]:
+    """Keys shaped like signatures (SHA256 and SHA512 digests)."""
+    return [
+        hashlib.sha256(str(i).encode()).digest() + hashlib.sha512(str(i).encode()).digest()
+        for i in range(start, start + count)
+    ]
+
+
+class TestBloomFilter(TestCase):
+    def test_contains(self):
+        bloom: BloomFilter = BloomFilter(5000)
+        inserted: List[bytes] = _keys(0, 5000)
+        for key in inserted:
+            bloom.add(key)
+
+        # No false negatives, and about 1% of false positives
+        self.assertTrue(all([bloom.contains(key) for key in inserted]))
+        self.assertEqual(bloom.items, 5000)
+        false_positives: int = sum([bloom.contains(key) for key in _keys(5000, 10000)])
+        self.assertLess(false_positives, 300)
+
+    def test_contains_after_load(self):
+        bloom: BloomFilter = BloomFilter(1000)
+        inserted: List[bytes] = _keys(0, 1000)
+        for key in inserted:
+            bloom.add(key)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path: str = os.path.join(directory, "bloom")
+            bloom.save(path)
+            loaded: BloomFilter = load_bloom(path)
+
+        self.assertTrue(all([loaded.contains(key) for key in inserted]))
+        self.assertEqual(loaded.items, 1000)
+
+    def test_save_and_load(self):
+        bloom: BloomFilter = BloomFilter(1000)
+        bloom.covered = 42
+
+        with tempfile.TemporaryDirectory() as directory:
+            path: str = os.path.join(directory, "bloom")
+            bloom.save(path)
+            loaded: BloomFilter = load_bloom(path)
+
+        self.assertIsNotNone(loaded)
+        self.assertEqual(loaded.covered, 42)
+        self.assertEqual(loaded.num_bits, bloom.num_bits)
+        self.assertEqual(loaded.num_hashes, bloom.num_hashes)
+
+    def test_load_missing(self):
+        self.assertIsNone(load_bloom("./tests/index/missing-bloom"))
+
+    def test_signature_key(self):
+        self.assertEqual(signature_key(("00ff", "10")), b"\x00\xff\x10")
+        self.assertEqual(signature_key(("", "")), b"")
+
+
+class TestDigestIndex(TestCase):
+    def test_eager(self):
+        index: DigestIndex = DigestIndex(eager=True)
+        stored, new = _keys(0, 100), _keys(100, 10)
+        for file_id, key in enumerate(stored, 1):
+            index.add(key, file_id, False)
+
+        # Everything stored is in memory: the DB is never searched
+        for file_id, key in enumerate(stored, 1):
+            self.assertEqual(index.get(key), file_id)
+        for key in new:
+            self.assertEqual(index.get(key), 0)
+            self.assertFalse(index.needs_search(key))
+
+        # The first file holding a signature keeps it
+        index.add(stored[0], 1000)
+        self.assertEqual(index.get(stored[0]), 1)
+        index.add(new[0], 1001)
+        self.assertEqual(index.get(new[0]), 1001)
+
+    def test_bloom(self):
+        bloom: BloomFilter = BloomFilter(1000)
+        stored, new = _keys(0, 100), _keys(100, 100)
+        for key in stored:
+            bloom.add(key)
+        index: DigestIndex = DigestIndex(eager=False, bloom=bloom)
+
+        # Only the signatures that are probably stored are searched in the DB
+        for key in stored:
+            self.assertEqual(index.get(key), 0)
+            self.assertTrue(index.needs_search(key))
+        self.assertLess(sum([index.needs_search(key) for key in new]), 10)
+
+        # Found in the DB during the job: not added to the filter again
+        index.add(stored[0], 7, False)
+        self.assertEqual(index.get(stored[0]), 7)
+        self.assertEqual(bloom.items, 100)
+
+        # New in the job: added to the filter, for the next jobs
+        index.add(new[0], 8)
+        self.assertEqual(index.get(new[0]), 8)
+        self.assertTrue(bloom.contains(new[0]))
+        self.assertEqual(bloom.items, 101)
+
+    def test_lazy_without_bloom(self):
+        index: DigestIndex = DigestIndex(eager=False)
+        key: bytes = _keys(0, 1)[0]
+        self.assertTrue(index.needs_search(key))
+        index.add(key, 3)
+        self.assertEqual(index.get(key), 3)
@@ -0,0 +1,127 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import TestCase
+
+# 3rd party
+from click.testing import CliRunner
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.cli import cli
+from runup.lock import RepositoryLock
+
+
+PROJECTS = ["alpha", "beta", "gamma"]
+
+
+@unittest.skipIf(sys.platform.startswith("win"), "fcntl is not available on Windows")
+class TestRepositoryLock(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        os.mkdir(os.path.join(self._directory.name, ".runup"))
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _blocks(self, held: RepositoryLock, wanted: RepositoryLock) -> bool:
+        """Check if `wanted` has to wait for `held` to be released."""
+        acquired = threading.Event()
+
+        def acquire():
+            wanted.acquire()
+            acquired.set()
+
+        held.acquire()
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        blocked: bool = not acquired.wait(0.5)
+        held.release()
+        thread.join()
+        wanted.release()
+        return blocked
+
+    def test_exclusive(self):
+        exclusive = RepositoryLock(self._directory.name, True, False)
+        shared = RepositoryLock(self._directory.name, False, False)
+        self.assertTrue(self._blocks(exclusive, RepositoryLock(self._directory.name, True, False)))
+        self.assertTrue(self._blocks(shared, exclusive))
+        self.assertTrue(self._blocks(exclusive, shared))
+
+    def test_shared(self):
+        shared = RepositoryLock(self._directory.name, False, False)
+        self.assertFalse(self._blocks(shared, RepositoryLock(self._directory.name, False, False)))
+
+    def test_not_initialized(self):
+        with RepositoryLock(self._directory.name + "/missing", True, False):
+            pass
+        self.assertFalse(os.path.exists(self._directory.name + "/missing"))
+
+
+class TestConcurrentBackups(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.context: str = self._directory.name
+        config: str = "version: '1.0'\n\nproject:\n"
+        for project in PROJECTS:
+            config += f"  {project}:\n    include:\n      - './{project}'\n"
+            os.makedirs(f"{self.context}/{project}/dir")
+            for i in range(20):
+                with open(f"{self.context}/{project}/dir/file-{i}.txt", "w") as f:
+                    f.write(f"{project} {i}" * (i + 1))
+        with open(f"{self.context}/runup.yaml", "w") as f:
+            f.write(config)
+
+        self.runner: CliRunner = CliRunner()
+        result = self.runner.invoke(cli, ["--context", self.context, "init"])
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_all_projects(self):
+        result = self.runner.invoke(cli, ["--context", self.context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+
+        for project in PROJECTS:
+            location: str = os.path.relpath(f"{self.context}/restore-{project}")
+            result = self.runner.invoke(
+                cli, ["--context", self.context, "restore", project, "-f", "--location", location]
+            )
+            self.assertEqual(result.exit_code, 0)
+            for i in range(20):
+                with open(f"{location}/{project}/dir/file-{i}.txt") as f:
+                    self.assertEqual(f.read(), f"{project} {i}" * (i + 1))
+
+    @unittest.skipIf(sys.platform.startswith("win"), "fcntl is not available on Windows")
+    def test_other_backup_running(self):
+        # Another process is backing up the repository
+        held = RepositoryLock(self.context, True, False)
+        results = []
+        held.acquire()
+        thread = threading.Thread(
+            target=lambda: results.append(
+                self.runner.invoke(cli, ["--context", self.context, "backup", "beta"])
+            )
+        )
+        thread.start()
+        thread.join(1)
+        waited: bool = thread.is_alive()
+        held.release()
+        thread.join()
+
+        # The backup runs after it
+        self.assertTrue(waited)
+        self.assertEqual(
+            results[0].output, "Waiting for another RunUp process to finish...\nNew backup created.\n"
+        )
@@ -0,0 +1,150 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+# 3rd party
+from click.testing import CliRunner
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.cli import cli
+
+
+CONFIG = """
+version: '1.0'
+
+project:
+  myproject:
+    include:
+      - './src'
+      - './etc'
+"""
+
+
+class TestListAndDiff(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.context: str = self._directory.name
+        with open(f"{self.context}/runup.yaml", "w") as f:
+            f.write(CONFIG)
+        self._write("src/app.py", "app")
+        self._write("src/lib/util.py", "util")
+        self._write("src/lib/data.json", "{}")
+        self._write("etc/app/config.yaml", "config")
+        os.makedirs(f"{self.context}/etc/empty")
+
+        self.runner: CliRunner = CliRunner()
+        result = self.runner.invoke(cli, ["--context", self.context, "init"])
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+        self._backup()
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _write(self, path: str, content: str):
+        os.makedirs(os.path.dirname(f"{self.context}/{path}"), exist_ok=True)
+        with open(f"{self.context}/{path}", "w") as f:
+            f.write(content)
+
+    def _backup(self):
+        result = self.runner.invoke(cli, ["--context", self.context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+
+    def _run(self, *args: str) -> str:
+        result = self.runner.invoke(cli, ["--context", self.context, *args])
+        self.assertEqual(result.exit_code, 0)
+        return result.output
+
+    def test_ls(self):
+        self.assertEqual(
+            self._run("ls", "myproject"),
+            # `etc` has no files of its own, so it is stored as a directory too
+            "etc/\netc/app/config.yaml\netc/empty/\nsrc/app.py\nsrc/lib/data.json\nsrc/lib/util.py\n",
+        )
+        self.assertEqual(
+            self._run("ls", "myproject", "src/*.py", "etc/**"),
+            "etc/app/config.yaml\netc/empty/\nsrc/app.py\n",
+        )
+        self.assertEqual(self._run("ls", "myproject", "**/*.py"), "src/app.py\nsrc/lib/util.py\n")
+
+        lines = self._run("ls", "myproject", "-l", "src/app.py").splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].startswith("           3  "))
+        self.assertTrue(lines[0].endswith("  src/app.py"))
+
+    def test_ls_missing_job(self):
+        output: str = self._run("ls", "myproject", "--job", "7")
+        self.assertIn('The project "myproject" is not part of the job 7.', output)
+        self.assertIn("The files can NOT be listed.", output)
+
+    def test_diff(self):
+        self._write("src/app.py", "changed")
+        self._write("src/new.py", "new")
+        os.remove(f"{self.context}/src/lib/data.json")
+        shutil.rmtree(f"{self.context}/etc/empty")
+        self._backup()
+
+        self.assertEqual(
+            self._run("diff", "myproject", "1", "2"),
+            "- etc/empty\nM src/app.py\n- src/lib/data.json\n+ src/new.py\n"
+            + "1 added, 2 removed, 1 modified.\n",
+        )
+        self.assertEqual(
+            self._run("diff", "myproject", "2", "1"),
+            "+ etc/empty\nM src/app.py\n+ src/lib/data.json\n- src/new.py\n"
+            + "2 added, 1 removed, 1 modified.\n",
+        )
+        self.assertEqual(self._run("diff", "myproject", "2", "0"), "0 added, 0 removed, 0 modified.\n")
+
+    def test_restore_paths(self):
+        # `src/app.py` changes, so the files of the second job come from both jobs
+        self._write("src/app.py", "changed")
+        self._backup()
+        os.remove(f"{self.context}/.runup/jobs/2")
+
+        # The job that holds the files restored is the only one read
+        location: str = os.path.relpath(f"{self.context}/restore-here")
+        result = self.runner.invoke(
+            cli,
+            ["--context", self.context, "restore", "myproject", "-f", "--location", location]
+            + ["--path", "etc/**", "--path", "src/lib/util.py"],
+        )
+        self.assertEqual(result.exit_code, 0)
+        self.assertIsNone(result.exception)
+        restored = sorted(
+            os.path.relpath(os.path.join(root, name), location)
+            for root, dirs, files in os.walk(location)
+            for name in files + [d for d in dirs if not os.listdir(os.path.join(root, d))]
+        )
+        self.assertEqual(restored, ["etc/app/config.yaml", "etc/empty", "src/lib/util.py"])
+
+        result = self.runner.invoke(
+            cli,
+            ["--context", self.context, "restore", "myproject", "-f", "--location", location]
+            + ["--path", "missing/**"],
+        )
+        self.assertIn('No file of the project "myproject" matches the paths.', result.output)
+
+    def test_restore_paths_plan(self):
+        # The paths are found in their index, then the files of the job at those paths
+        with sqlite3.connect(f"{self.context}/.runup/runup.db") as conn:
+            plan: str = str(
+                conn.execute(
+                    "EXPLAIN QUERY PLAN SELECT files.file_id "
+                    + "FROM paths CROSS JOIN files ON files.path_id = paths.path_id "
+                    + "WHERE files.job_id = ? AND ((paths.path >= ? AND paths.path < ?))",
+                    (1, "etc/", "etc0"),
+                ).fetchall()
+            )
+        self.assertIn("SEARCH paths USING COVERING INDEX", plan)
+        self.assertIn("idx_job_path", plan)
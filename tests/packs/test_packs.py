@@ -0,0 +1,169 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import glob
+import hashlib
+import os
+import tempfile
+from typing import List, Tuple
+from unittest import TestCase
+import zipfile
+
+# 3rd party
+from click.testing import CliRunner
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.cli import cli
+from runup.packs import PackStore
+
+
+class TestPackStore(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        os.mkdir(os.path.join(self._directory.name, ".runup"))
+        # Enough blobs to make the index grow a few times
+        self.blobs: List[Tuple[bytes, bytes]] = []
+        for i in range(3000):
+            data: bytes = f"blob {i} ".encode() * (i % 40 + 1)
+            self.blobs.append((hashlib.sha256(data).digest(), data))
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _store(self) -> PackStore:
+        packs: PackStore = PackStore(self._directory.name, "sha256", False)
+        packs.open()
+        return packs
+
+    def test_put_and_read(self):
+        packs: PackStore = self._store()
+        for i, (key, data) in enumerate(self.blobs):
+            method: int = zipfile.ZIP_DEFLATED if i % 2 else zipfile.ZIP_STORED
+            packs.put_data(key, data, method, None)
+        packs.close()
+
+        packs = self._store()
+        try:
+            for key, data in self.blobs:
+                self.assertEqual(packs.open_blob(key).read(), data)
+                self.assertEqual(packs.blob_size(key), len(data))
+            with self.assertRaises(KeyError):
+                packs.open_blob(hashlib.sha256(b"missing").digest())
+        finally:
+            packs.close()
+
+    def test_put_file(self):
+        fname: str = os.path.join(self._directory.name, "big")
+        content: bytes = b"".join(
+            [hashlib.sha512(i.to_bytes(4, "little")).digest() for i in range(40000)]
+        )
+        with open(fname, "wb") as f:
+            f.write(content)
+        key: bytes = hashlib.sha256(content).digest()
+
+        packs: PackStore = self._store()
+        packs.put_file(key, fname, zipfile.ZIP_BZIP2, None)
+        packs.put_file(key, fname, zipfile.ZIP_BZIP2, None)
+        packs.close()
+
+        packs = self._store()
+        try:
+            reader = packs.open_blob(key)
+            self.assertEqual(reader.read(1000), content[:1000])
+            self.assertEqual(reader.read(), content[1000:])
+            self.assertEqual(reader.read(), b"")
+        finally:
+            packs.close()
+
+    def test_rebuild_index(self):
+        packs: PackStore = self._store()
+        for key, data in self.blobs:
+            packs.put_data(key, data, zipfile.ZIP_LZMA, None)
+        packs.close()
+        os.remove(os.path.join(self._directory.name, ".runup", "packs", "index"))
+
+        packs = self._store()
+        try:
+            for key, data in self.blobs:
+                self.assertEqual(packs.open_blob(key).read(), data)
+        finally:
+            packs.close()
+
+    def test_repack(self):
+        packs: PackStore = self._store()
+        for key, data in self.blobs:
+            packs.put_data(key, data, zipfile.ZIP_DEFLATED, None)
+        packs.close()
+
+        # Only one blob out of four is still used
+        live = set([key for key, _ in self.blobs[::4]])
+        packs = self._store()
+        try:
+            removed, freed = packs.repack(lambda key: key in live)
+            self.assertEqual(removed, 1)
+            self.assertGreater(freed, 0)
+            self.assertEqual(packs.packs(), [2])
+            for key, data in self.blobs:
+                if key in live:
+                    self.assertEqual(packs.open_blob(key).read(), data)
+                else:
+                    self.assertFalse(packs.contains(key))
+
+            # Nothing left to collect
+            self.assertEqual(packs.repack(lambda key: key in live), (0, 0))
+        finally:
+            packs.close()
+
+
+class TestPrunePacks(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.context: str = self._directory.name
+        with open(f"{self.context}/runup.yaml", "w") as f:
+            f.write("version: '1.0'\n\nproject:\n  myproject:\n    include:\n      - './data'\n")
+        os.mkdir(f"{self.context}/data")
+
+        self.runner: CliRunner = CliRunner()
+        result = self.runner.invoke(cli, ["--context", self.context, "init", "--storage", "packs"])
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _backup(self, content: str):
+        with open(f"{self.context}/data/file.txt", "w") as f:
+            f.write(content)
+        result = self.runner.invoke(cli, ["--context", self.context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+
+    def test_prune_repacks(self):
+        # The content of the first job is most of the pack
+        self._backup(os.urandom(100000).hex())
+        self._backup("new content")
+        old_packs: List[str] = glob.glob(f"{self.context}/.runup/packs/pack-*.pack")
+        size: int = sum([os.path.getsize(path) for path in old_packs])
+
+        result = self.runner.invoke(cli, ["--context", self.context, "prune", "--keep-last", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("packs have been rewritten", result.output)
+        self.assertTrue(result.output.endswith("1 jobs have been pruned.\n"), result.output)
+        self.assertNotIn("NOT", result.output)
+        remaining: int = sum(
+            [os.path.getsize(path) for path in glob.glob(f"{self.context}/.runup/packs/pack-*.pack")]
+        )
+        self.assertLess(remaining, size)
+
+        # The job kept is still whole
+        location: str = os.path.relpath(f"{self.context}/restored")
+        result = self.runner.invoke(
+            cli, ["--context", self.context, "restore", "myproject", "-f", "--location", location]
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+        with open(f"{location}/data/file.txt") as f:
+            self.assertEqual(f.read(), "new content")
@@ -0,0 +1,43 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+from datetime import datetime
+from typing import List, Tuple
+from unittest import TestCase
+
+# 3rd party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.prune import jobs_to_keep
+
+
+class TestJobsToKeep(TestCase):
+    def setUp(self):
+        # Two jobs a day, from Monday 2024-01-01 to Sunday 2024-01-14
+        self.jobs: List[Tuple[int, int]] = []
+        for day in range(14):
+            for hour in (9, 18):
+                start = datetime(2024, 1, day + 1, hour).timestamp()
+                self.jobs.append((len(self.jobs) + 1, int(start)))
+
+    def test_keep_last(self):
+        self.assertEqual(jobs_to_keep(self.jobs, 3, 0, 0), {26, 27, 28})
+
+    def test_keep_daily(self):
+        self.assertEqual(jobs_to_keep(self.jobs, 0, 3, 0), {24, 26, 28})
+
+    def test_keep_weekly(self):
+        self.assertEqual(jobs_to_keep(self.jobs, 0, 0, 5), {14, 28})
+
+    def test_combined(self):
+        self.assertEqual(jobs_to_keep(self.jobs, 2, 2, 2), {14, 26, 27, 28})
+
+    def test_newest_always_kept(self):
+        self.assertEqual(jobs_to_keep(self.jobs, 0, 0, 0), {28})
+        self.assertEqual(jobs_to_keep([], 1, 1, 1), set())
@@ -0,0 +1,239 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from typing import List
+from unittest import TestCase, mock
+import zipfile
+
+# 3rd party
+from click.testing import CliRunner
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.cli import cli
+import runup.interpreter
+
+
+NUM_FILES = 40
+
+# Backs up a context and dies, as if the computer was turned off, while
+# preparing the file number `CRASH_AT`. The DB is committed every 5 files.
+CRASH_AT = 26
+CRASH_SCRIPT = f"""
+import os
+import sys
+
+import pyximport
+pyximport.install()
+
+import runup.db
+import runup.interpreter
+from runup.cli import cli
+
+prepare_entry = runup.interpreter.prepare_entry
+calls = []
+
+def crashing_prepare_entry(*args):
+    calls.append(args)
+    if len(calls) == {CRASH_AT}:
+        os._exit(1)
+    return prepare_entry(*args)
+
+runup.db.CHECKPOINT_SIZE = 5
+runup.interpreter.prepare_entry = crashing_prepare_entry
+cli(["--context", sys.argv[1], "backup", "-j", "1"])
+"""
+
+
+class TestResume(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.context: str = self._directory.name
+        with open(f"{self.context}/runup.yaml", "w") as f:
+            f.write("version: '1.0'\n\nproject:\n  myproject:\n    include:\n      - './data'\n")
+        os.mkdir(f"{self.context}/data")
+        for i in range(NUM_FILES):
+            with open(f"{self.context}/data/file-{i:02d}.txt", "w") as f:
+                f.write(f"content {i}\n" * (i + 1))
+
+        self.runner: CliRunner = CliRunner()
+        result = self.runner.invoke(cli, ["--context", self.context, "init"])
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+
+        crashed = subprocess.run(
+            [sys.executable, "-c", CRASH_SCRIPT, self.context],
+            env={**os.environ, "PYTHONPATH": os.getcwd()},
+        )
+        self.assertEqual(crashed.returncode, 1)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _query(self, query: str) -> List[tuple]:
+        with sqlite3.connect(f"{self.context}/.runup/runup.db") as conn:
+            return conn.execute(query).fetchall()
+
+    def _restore(self, job: int = 0) -> str:
+        location: str = os.path.relpath(f"{self.context}/restore-{job}")
+        args: List[str] = ["--context", self.context, "restore", "myproject", "-f", "--location", location]
+        if job > 0:
+            args += ["--job", str(job)]
+        result = self.runner.invoke(cli, args)
+        self.assertEqual(result.exit_code, 0, result.output)
+        return location
+
+    def test_crash_leaves_checkpoint(self):
+        self.assertEqual(self._query("SELECT job_id, state FROM jobs"), [(1, "running")])
+        self.assertTrue(os.path.exists(f"{self.context}/.runup/jobs/1.partial"))
+        self.assertTrue(os.path.exists(f"{self.context}/.runup/jobs/1.checkpoints"))
+        self.assertFalse(os.path.exists(f"{self.context}/.runup/jobs/1"))
+
+    def test_resume(self):
+        prepare_entry = runup.interpreter.prepare_entry
+        prepared: List[str] = []
+
+        def counting_prepare_entry(*args):
+            prepared.append(args[1])
+            return prepare_entry(*args)
+
+        with mock.patch("runup.interpreter.prepare_entry", counting_prepare_entry):
+            result = self.runner.invoke(cli, ["--context", self.context, "backup", "--resume"])
+        self.assertEqual(
+            result.output,
+            "The previous backup of `myproject` was interrupted.\n"
+            + "Resuming job 1 of `myproject`.\n"
+            + "New backup created.\n",
+        )
+
+        # The files of the checkpoints were not backed up again
+        self.assertGreater(len(prepared), 0)
+        self.assertLess(len(prepared), NUM_FILES - 10)
+        self.assertEqual(len(prepared), len(set(prepared)))
+
+        # A single job, finished, with every file once
+        self.assertEqual(
+            self._query("SELECT job_id, state, files_num, new_files FROM jobs"),
+            [(1, "finished", NUM_FILES, NUM_FILES)],
+        )
+        self.assertEqual(os.listdir(f"{self.context}/.runup/jobs"), ["1"])
+        with zipfile.ZipFile(f"{self.context}/.runup/jobs/1") as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(len(archive.namelist()), NUM_FILES)
+
+        location: str = self._restore()
+        for i in range(NUM_FILES):
+            with open(f"{location}/data/file-{i:02d}.txt") as f:
+                self.assertEqual(f.read(), f"content {i}\n" * (i + 1))
+
+    def test_new_backup_after_crash(self):
+        result = self.runner.invoke(cli, ["--context", self.context, "backup"])
+        self.assertEqual(
+            result.output,
+            "The previous backup of `myproject` was interrupted.\n"
+            + "Job 1 of `myproject` was interrupted: `runup backup --resume` goes on with it.\n"
+            + "New backup created.\n",
+        )
+        self.assertEqual(
+            self._query("SELECT job_id, state FROM jobs"), [(1, "interrupted"), (2, "finished")]
+        )
+
+        # The interrupted job was cut back to its last checkpoint, and can be restored
+        kept: int = self._query("SELECT COUNT(*) FROM files WHERE job_id = 1")[0][0]
+        self.assertGreaterEqual(kept, 5)
+        self.assertLess(kept, CRASH_AT)
+        with zipfile.ZipFile(f"{self.context}/.runup/jobs/1") as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(len(archive.namelist()), kept)
+        location: str = self._restore(job=1)
+        self.assertEqual(len(os.listdir(f"{location}/data")), kept)
+
+        # The new job references the contents kept
+        location = self._restore()
+        for i in range(NUM_FILES):
+            with open(f"{location}/data/file-{i:02d}.txt") as f:
+                self.assertEqual(f.read(), f"content {i}\n" * (i + 1))
+
+        # Nothing left to resume
+        result = self.runner.invoke(cli, ["--context", self.context, "backup", "--resume"])
+        self.assertEqual(result.output, "New backup created.\n")
+
+
+class TestFailedBackup(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.context: str = self._directory.name
+        with open(f"{self.context}/runup.yaml", "w") as f:
+            f.write("version: '1.0'\n\nproject:\n  myproject:\n    include:\n      - './data'\n")
+        os.mkdir(f"{self.context}/data")
+        for i in range(NUM_FILES):
+            with open(f"{self.context}/data/file-{i:02d}.txt", "w") as f:
+                f.write(f"content {i}\n")
+
+        self.runner: CliRunner = CliRunner()
+        result = self.runner.invoke(cli, ["--context", self.context, "init"])
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_unreadable_file(self):
+        prepare_entry = runup.interpreter.prepare_entry
+
+        def failing_prepare_entry(*args):
+            if args[1].endswith("file-07.txt"):
+                raise PermissionError(13, "Permission denied", args[0])
+            return prepare_entry(*args)
+
+        with mock.patch("runup.interpreter.prepare_entry", failing_prepare_entry):
+            result = self.runner.invoke(cli, ["--context", self.context, "backup", "-j", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertTrue(result.output.startswith("Could not back up `data/file-07.txt`: "), result.output)
+        self.assertIn("Permission denied", result.output)
+        self.assertTrue(result.output.endswith("The backup has NOT been created.\n"), result.output)
+
+        # The job was rolled back
+        with sqlite3.connect(f"{self.context}/.runup/runup.db") as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM jobs").fetchall(), [(0,)])
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM files").fetchall(), [(0,)])
+
+        result = self.runner.invoke(cli, ["--context", self.context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+
+    def test_failed_commit(self):
+        connect = sqlite3.connect
+
+        class FailingConnection(sqlite3.Connection):
+            def execute(self, sql, *args):
+                # The last statement before the commit of the backup
+                if sql == "PRAGMA optimize":
+                    raise sqlite3.OperationalError("disk I/O error")
+                return super().execute(sql, *args)
+
+        def failing_connect(*args, **kwargs):
+            return connect(*args, factory=FailingConnection, **kwargs)
+
+        with mock.patch("runup.db.sqlite3.connect", failing_connect):
+            result = self.runner.invoke(cli, ["--context", self.context, "backup"])
+        self.assertIsInstance(result.exception, sqlite3.OperationalError)
+        self.assertNotIn("New backup created.", result.output)
+
+        # Nothing was committed, and the zip and its checkpoints were kept
+        with sqlite3.connect(f"{self.context}/.runup/runup.db") as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM jobs").fetchall(), [(0,)])
+        self.assertEqual(sorted(os.listdir(f"{self.context}/.runup/jobs")), ["1.checkpoints", "1.partial"])
+
+        result = self.runner.invoke(cli, ["--context", self.context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+        self.assertEqual(os.listdir(f"{self.context}/.runup/jobs"), ["1"])
+        with zipfile.ZipFile(f"{self.context}/.runup/jobs/1") as archive:
+            self.assertEqual(len(archive.namelist()), NUM_FILES)
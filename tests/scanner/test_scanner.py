@@ -0,0 +1,185 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import os
+import re
+import sqlite3
+import tempfile
+from typing import List
+from unittest import TestCase
+
+# 3rd party
+from click.testing import CliRunner
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.cli import cli
+from runup.scanner import PathMatcher, Scanner, path_filter
+
+
+class TestPathMatcher(TestCase):
+    def test_anchored_and_unanchored(self):
+        matcher: PathMatcher = PathMatcher(["./dir/file.txt", "node_modules", "/build"])
+
+        self.assertTrue(matcher.excluded("dir/file.txt", False))
+        self.assertFalse(matcher.excluded("other/dir/file.txt", False))
+        self.assertTrue(matcher.excluded("node_modules", True))
+        self.assertTrue(matcher.excluded("web/app/node_modules", True))
+        self.assertTrue(matcher.excluded("build", True))
+        self.assertFalse(matcher.excluded("src/build", True))
+
+    def test_globs(self):
+        matcher: PathMatcher = PathMatcher(["**/*.tmp", "logs/**", "cache/", "file-?.[ab]"])
+
+        self.assertTrue(matcher.excluded("a.tmp", False))
+        self.assertTrue(matcher.excluded("deep/down/a.tmp", False))
+        self.assertFalse(matcher.excluded("a.tmp.txt", False))
+        self.assertTrue(matcher.excluded("logs/2024/01.log", False))
+        self.assertTrue(matcher.excluded("src/cache", True))
+        self.assertFalse(matcher.excluded("src/cache", False))
+        self.assertTrue(matcher.excluded("file-1.a", False))
+        self.assertFalse(matcher.excluded("file-1.c", False))
+
+    def test_negation(self):
+        matcher: PathMatcher = PathMatcher(["*.log", "!keep.log"])
+
+        self.assertTrue(matcher.excluded("x/error.log", False))
+        self.assertFalse(matcher.excluded("x/keep.log", False))
+
+    def test_excluded_tree(self):
+        matcher: PathMatcher = PathMatcher(["vendor/"])
+
+        self.assertTrue(matcher.excluded_tree("lib/vendor/a/b.py", False))
+        self.assertFalse(matcher.excluded_tree("lib/vendors/b.py", False))
+
+
+class TestPathFilter(TestCase):
+    def _matches(self, pattern: str, path: str) -> bool:
+        prefix, regex = path_filter(pattern)
+        return path.startswith(prefix) and re.match(regex, path) is not None
+
+    def test_prefix(self):
+        self.assertEqual(path_filter("./etc/**")[0], "etc/")
+        self.assertEqual(path_filter("src/*.py")[0], "src/")
+        self.assertEqual(path_filter("**/*.py")[0], "")
+        self.assertEqual(path_filter("src/app.py")[0], "src/app.py")
+
+    def test_matches(self):
+        self.assertTrue(self._matches("etc/**", "etc/app/config.yaml"))
+        self.assertFalse(self._matches("etc/**", "etcetera"))
+        self.assertTrue(self._matches("src/*.py", "src/app.py"))
+        self.assertFalse(self._matches("src/*.py", "src/lib/util.py"))
+        self.assertTrue(self._matches("**/*.py", "src/lib/util.py"))
+        # Directories match with what is inside them
+        self.assertTrue(self._matches("etc", "etc"))
+        self.assertTrue(self._matches("etc/", "etc/app/config.yaml"))
+        self.assertFalse(self._matches("src/app.py", "src/app.pyc"))
+        self.assertTrue(self._matches(".", "anything"))
+
+
+class TestScanner(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        for path in [
+            "runup.yaml",
+            "src/main.py",
+            "src/main.tmp",
+            "src/keep.tmp",
+            "node_modules/pkg/index.js",
+            "docs/node_modules/pkg/index.js",
+            ".runup/runup.db",
+        ]:
+            full_path: str = os.path.join(self._directory.name, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "w") as f:
+                f.write(path)
+        os.mkdir(os.path.join(self._directory.name, "empty"))
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _scan(self, excludes: List[str], all_dirs: bool = False) -> List[str]:
+        scanner: Scanner = Scanner(self._directory.name, excludes, False)
+        return [rel for _, rel, _ in scanner.scan(["."], all_dirs)]
+
+    def test_scan(self):
+        found: List[str] = self._scan(["node_modules", "*.tmp", "!keep.tmp"])
+
+        # `docs` has no files left, so it is kept as an empty directory
+        self.assertEqual(found, ["docs", "empty", "src/keep.tmp", "src/main.py"])
+
+    def test_scan_all_files_excluded(self):
+        found: List[str] = self._scan(["node_modules", "*.tmp", "*.py"])
+
+        # Every file of `src` is excluded: it is kept as an empty directory
+        self.assertEqual(found, ["docs", "empty", "src"])
+
+    def test_scan_all_dirs(self):
+        found: List[str] = self._scan(["node_modules/", "src"], True)
+
+        self.assertEqual(found, [".", "docs", "empty"])
+
+    def test_stat_results(self):
+        scanner: Scanner = Scanner(self._directory.name, [], False)
+        for path, _, stat_result in scanner.scan(["./src"]):
+            self.assertEqual(os.stat(path), stat_result)
+
+    def test_excluded_include(self):
+        scanner: Scanner = Scanner(self._directory.name, ["src"], False)
+
+        self.assertEqual(list(scanner.scan(["src/main.py", "missing"])), [])
+
+    def test_scan_is_lazy(self):
+        scanner: Scanner = Scanner(self._directory.name, [], False)
+        files = scanner.scan(["."])
+
+        # Directories are only listed when the scan reaches them
+        self.assertEqual(next(files)[1], "docs")
+        with open(os.path.join(self._directory.name, "src", "late.py"), "w") as f:
+            f.write("late")
+        self.assertIn("src/late.py", [rel for _, rel, _ in files])
+
+    def test_rescan_changed(self):
+        scanner: Scanner = Scanner(self._directory.name, ["node_modules", "*.tmp"], False)
+        os.remove(os.path.join(self._directory.name, "src", "main.py"))
+        roots, parents = scanner.changed(["src/main.py", "empty", "empty/new", "src/main.py"])
+
+        self.assertEqual((roots, parents), (["empty", "src/main.py"], [".", "src"]))
+        # `src` only has excluded files left, so it is kept as an empty directory
+        self.assertEqual([rel for _, rel, _ in scanner.rescan(["."], roots, parents)], ["empty", "src"])
+        self.assertTrue(scanner.covers(["./src"], "src/main.py", False))
+        self.assertFalse(scanner.covers(["./src"], "src/main.tmp", False))
+        self.assertFalse(scanner.covers(["./src"], "docs/index.md", False))
+
+
+class TestScanContext(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.context: str = self._directory.name
+        with open(f"{self.context}/runup.yaml", "w") as f:
+            f.write("version: '1.0'\n\nproject:\n  myproject:\n    include:\n      - '.'\n")
+        os.makedirs(f"{self.context}/a")
+        with open(f"{self.context}/a/f", "w") as f:
+            f.write("content")
+
+        self.runner: CliRunner = CliRunner()
+        result = self.runner.invoke(cli, ["--context", self.context, "init"])
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_root_not_empty_directory(self):
+        scanner: Scanner = Scanner(self.context, [], False)
+        self.assertEqual([rel for _, rel, _ in scanner.scan(["."])], ["a/f"])
+
+        result = self.runner.invoke(cli, ["--context", self.context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+        with sqlite3.connect(f"{self.context}/.runup/runup.db") as conn:
+            paths = [path for (path,) in conn.execute("SELECT path FROM files JOIN paths USING (path_id)")]
+        self.assertEqual(paths, ["a/f"])
@@ -0,0 +1,106 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import os
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+# 3rd party
+from click.testing import CliRunner
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.cli import cli
+from runup.stats import format_duration, format_size, job_lines, stats_lines
+
+
+class TestFormat(TestCase):
+    def test_format_size(self):
+        self.assertEqual(format_size(None), "-")
+        self.assertEqual(format_size(0), "0 B")
+        self.assertEqual(format_size(1023), "1023 B")
+        self.assertEqual(format_size(1536), "1.5 KiB")
+        self.assertEqual(format_size(5 * 1024 ** 3), "5.0 GiB")
+
+    def test_format_duration(self):
+        self.assertEqual(format_duration(None), "-")
+        self.assertEqual(format_duration(2.25), "2.2s")
+        self.assertEqual(format_duration(65), "1m 05s")
+        self.assertEqual(format_duration(7380), "2h 03m")
+
+    def test_job_lines(self):
+        lines = job_lines(
+            [
+                (1, "alpha", 0, 10, 3, 3, 3072, 0, 1024, 2.0),
+                (2, "alpha", 20, None, 0, 0, 0, 0, 0, None),
+            ]
+        )
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith("Job  Project"))
+        self.assertTrue(lines[1].endswith("3.0 KiB      0 B  1.0 KiB  1.5 KiB/s"))
+        self.assertIn("interrupted", lines[2])
+
+    def test_stats_lines(self):
+        lines = stats_lines([("alpha", 2, 0, 3, 1024, 3072, 512, 2.0)])
+        self.assertEqual(lines[0], 'Project "alpha"')
+        self.assertIn("  Data backed up:    4.0 KiB (new 1.0 KiB, deduplicated 3.0 KiB)", lines)
+        self.assertIn("  Deduplication:     4.00x", lines)
+        self.assertIn("  Compression:       2.00x", lines)
+        self.assertIn("  Average speed:     2.0 KiB/s", lines)
+
+
+class TestJobSummaries(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.context: str = self._directory.name
+        with open(f"{self.context}/runup.yaml", "w") as f:
+            f.write("version: '1.0'\n\nproject:\n  myproject:\n    include:\n      - './dir'\n")
+        os.mkdir(f"{self.context}/dir")
+        for name, content in (("a.txt", "a" * 1000), ("b.txt", "a" * 1000), ("c.txt", "c" * 500)):
+            with open(f"{self.context}/dir/{name}", "w") as f:
+                f.write(content)
+
+        self.runner: CliRunner = CliRunner()
+        result = self.runner.invoke(cli, ["--context", self.context, "init"])
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _summaries(self):
+        with sqlite3.connect(f"{self.context}/.runup/runup.db") as conn:
+            return conn.execute(
+                "SELECT files_num, new_files, new_bytes, deduped_bytes, stored_bytes, "
+                + "time_finish IS NOT NULL, duration >= 0 FROM jobs ORDER BY job_id"
+            ).fetchall()
+
+    def test_summaries(self):
+        result = self.runner.invoke(cli, ["--context", self.context, "jobs"])
+        self.assertEqual(result.output, "There are no jobs yet.\n")
+
+        for _ in range(2):
+            result = self.runner.invoke(cli, ["--context", self.context, "backup"])
+            self.assertEqual(result.output, "New backup created.\n")
+
+        # `b.txt` has the content of `a.txt`; nothing is new in the second job
+        self.assertEqual(
+            self._summaries(),
+            [(3, 2, 1500, 1000, 1500, 1, 1), (3, 0, 0, 2500, 0, 1, 1)],
+        )
+
+        result = self.runner.invoke(cli, ["--context", self.context, "jobs"])
+        lines = result.output.splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith("  1  myproject"))
+
+        result = self.runner.invoke(cli, ["--context", self.context, "stats", "myproject"])
+        self.assertIn('Project "myproject"', result.output)
+        self.assertIn("  Jobs:              2", result.output)
+        self.assertIn("  Files:             3 in the latest job", result.output)
+        self.assertIn("  Deduplication:     3.33x", result.output)
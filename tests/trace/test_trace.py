@@ -0,0 +1,147 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import json
+import os
+import tempfile
+from typing import Any, Dict, List
+from unittest import TestCase
+
+# 3rd party
+from click.testing import CliRunner
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.cli import cli
+from runup.trace import Tracer, get_tracer
+
+
+CONFIG = """
+version: '1.0'
+
+project:
+  myproject:
+    include:
+      - './data'
+"""
+
+NUM_FILES = 5
+
+
+class TestTracer(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.context: str = self._directory.name
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_disabled(self):
+        tracer = Tracer()
+        self.assertFalse(tracer.enabled)
+        self.assertIs(tracer.wrap("hash", len), len)
+        items = [1, 2]
+        self.assertIs(tracer.iterate("scan", items), items)
+        with tracer.span("write"):
+            tracer.count("files")
+        tracer.stop()
+
+    def test_json_lines(self):
+        tracer = Tracer()
+        tracer.start(f"{self.context}/trace.jsonl")
+        self.assertTrue(tracer.enabled)
+        self.assertEqual(list(tracer.iterate("scan", "ab")), ["a", "b"])
+        self.assertEqual(tracer.wrap("hash", len)("abc"), 3)
+        with tracer.span("write"):
+            pass
+        tracer.count("files", 2)
+        tracer.count("files")
+        tracer.stop()
+        self.assertFalse(tracer.enabled)
+
+        with open(f"{self.context}/trace.jsonl") as f:
+            records = [json.loads(line) for line in f]
+        spans = [record["name"] for record in records if record["type"] == "span"]
+        self.assertEqual(spans, ["scan", "scan", "scan", "hash", "write"])
+        self.assertIn({"type": "counter", "name": "files", "value": 3}, records)
+        histograms = {record["name"]: record for record in records if record["type"] == "histogram"}
+        self.assertEqual(histograms["scan"]["count"], 3)
+        self.assertEqual(sum(histograms["scan"]["buckets"].values()), 3)
+        self.assertEqual(set(histograms), {"scan", "hash", "write"})
+
+    def test_prometheus(self):
+        tracer = Tracer()
+        tracer.start(f"{self.context}/runup.prom")
+        with tracer.span("commit"):
+            pass
+        tracer.count("files", 4)
+        self.assertFalse(os.path.exists(f"{self.context}/runup.prom"))
+        tracer.stop()
+
+        with open(f"{self.context}/runup.prom") as f:
+            lines = f.read().splitlines()
+        self.assertIn("# TYPE runup_files_total counter", lines)
+        self.assertIn("runup_files_total 4", lines)
+        self.assertIn("# TYPE runup_span_seconds histogram", lines)
+        self.assertIn('runup_span_seconds_bucket{span="commit",le="+Inf"} 1', lines)
+        self.assertIn('runup_span_seconds_count{span="commit"} 1', lines)
+        self.assertEqual(os.listdir(self.context), ["runup.prom"])
+
+
+class TestTraceOption(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.context: str = self._directory.name
+        with open(f"{self.context}/runup.yaml", "w") as f:
+            f.write(CONFIG)
+        os.mkdir(f"{self.context}/data")
+        for i in range(NUM_FILES):
+            with open(f"{self.context}/data/file-{i}.txt", "w") as f:
+                f.write("same content\n" if i > 2 else f"content {i}\n")
+            # Old enough for the stat cache to trust it
+            os.utime(f"{self.context}/data/file-{i}.txt", (1_600_000_000, 1_600_000_000))
+
+        self.runner: CliRunner = CliRunner()
+        result = self.runner.invoke(cli, ["--context", self.context, "init"])
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _records(self, path: str) -> List[Dict[str, Any]]:
+        with open(path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_backup(self):
+        trace: str = f"{self.context}/backup.jsonl"
+        result = self.runner.invoke(cli, ["--context", self.context, "--trace", trace, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+        self.assertFalse(get_tracer().enabled)
+
+        records = self._records(trace)
+        spans = {record["name"] for record in records if record["type"] == "span"}
+        self.assertEqual(spans, {"scan", "hash", "dedup", "write", "commit"})
+        counters = {record["name"]: record["value"] for record in records if record["type"] == "counter"}
+        self.assertEqual(counters["files"], NUM_FILES)
+        self.assertEqual(counters["new_contents"], 4)
+        self.assertEqual(counters["duplicate_contents"], 1)
+
+        # The stat cache spares the second backup the hashing
+        result = self.runner.invoke(cli, ["--context", self.context, "--trace", trace, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+        counters = {
+            record["name"]: record["value"] for record in self._records(trace) if record["type"] == "counter"
+        }
+        self.assertEqual(counters["unchanged_files"], NUM_FILES)
+        self.assertEqual(counters.get("hashed_bytes", 0), 0)
+
+    def test_no_trace(self):
+        result = self.runner.invoke(cli, ["--context", self.context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+        self.assertFalse(get_tracer().enabled)
+        self.assertEqual(sorted(os.listdir(self.context)), [".runup", "data", "runup.yaml"])
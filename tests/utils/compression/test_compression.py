@@ -0,0 +1,60 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import hashlib
+from unittest import TestCase
+import zipfile
+
+# 3rd party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.utils import compression_for, entropy
+
+
+class TestCompression(TestCase):
+    def setUp(self):
+        self.random_data: bytes = b"".join(
+            [hashlib.sha512(str(i).encode()).digest() for i in range(1024)]
+        )
+
+    def test_entropy(self):
+        self.assertEqual(entropy(b""), 0)
+        self.assertEqual(entropy(b"a" * 100), 0)
+        self.assertAlmostEqual(entropy(bytes(range(256))), 8)
+        self.assertGreater(entropy(self.random_data), 7.5)
+
+    def test_compression_for_text(self):
+        self.assertEqual(
+            compression_for("notes.txt", b"hello world " * 100, zipfile.ZIP_DEFLATED),
+            zipfile.ZIP_DEFLATED,
+        )
+
+    def test_compression_for_compressed_extension(self):
+        self.assertEqual(
+            compression_for("photo.JPG", b"hello world " * 100, zipfile.ZIP_DEFLATED),
+            zipfile.ZIP_STORED,
+        )
+
+    def test_compression_for_random_data(self):
+        self.assertEqual(
+            compression_for("data.bin", self.random_data, zipfile.ZIP_LZMA),
+            zipfile.ZIP_STORED,
+        )
+
+    def test_compression_for_stored(self):
+        self.assertEqual(
+            compression_for("notes.txt", b"hello world " * 100, zipfile.ZIP_STORED),
+            zipfile.ZIP_STORED,
+        )
+
+    def test_compression_for_file(self):
+        self.assertEqual(
+            compression_for("./tests/utils/hash/hello_world.txt", None, zipfile.ZIP_BZIP2),
+            zipfile.ZIP_BZIP2,
+        )
@@ -12,7 +12,7 @@ import pyximport  # type: ignore
 pyximport.install()
 
 # Own
-from runup.utils import hashfile
+from runup.utils import FileHasher, hash_file, hashfile
 
 
 class TestInterpreter_1(TestCase):
@@ -33,3 +33,16 @@ class TestInterpreter_1(TestCase):
     def test_invalid_hash(self):
         with self.assertRaises(ValueError):
             hashfile("./tests/utils/hash/hello_world.txt", b"md1")
+
+    def test_hash_file_single_read(self):
+        fname: str = "./tests/utils/hash/hello_world.txt"
+        signature = hash_file(fname, ("sha256", "sha512", "blake2b"))
+        self.assertEqual(signature[0], hashfile(fname, b"sha256"))
+        self.assertEqual(signature[1], hashfile(fname, b"sha512"))
+        self.assertEqual(len(signature[2]), 128)
+
+    def test_hash_file_small_buffer(self):
+        fname: str = "./tests/utils/hash/hello_world.txt"
+        algos = ("sha256", "blake2b")
+        # A buffer smaller than the file to read it in several blocks
+        self.assertEqual(FileHasher(3).hash(fname, algos), hash_file(fname, algos))
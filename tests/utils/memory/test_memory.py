@@ -0,0 +1,27 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import sys
+from unittest import TestCase, skipIf
+
+# 3rd party
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.utils import memory_high_water
+
+
+class TestMemoryHighWater(TestCase):
+    @skipIf(sys.platform == "win32", "Not available on Windows")
+    def test_peak_grows(self):
+        before: int = memory_high_water(reset=True)
+        data: bytearray = bytearray(64 * 1024 * 1024)
+        data[::4096] = b"x" * len(data[::4096])
+
+        self.assertGreater(before, 0)
+        self.assertGreaterEqual(memory_high_water(), 64 * 1024 * 1024)
@@ -0,0 +1,160 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import glob
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from typing import Any, List, Tuple
+import unittest
+from unittest import TestCase
+
+# 3rd party
+from click.testing import CliRunner
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.cli import cli
+from runup.lock import RepositoryLock
+
+
+CONFIG = """
+version: '1.0'
+
+project:
+  myproject:
+    include:
+      - './data'
+"""
+
+NUM_FILES = 6
+
+
+class TestVerify(TestCase):
+    def _setUp(self, storage: str):
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.context: str = self._directory.name
+        with open(f"{self.context}/runup.yaml", "w") as f:
+            f.write(CONFIG)
+        os.mkdir(f"{self.context}/data")
+        for i in range(NUM_FILES):
+            with open(f"{self.context}/data/file-{i}.txt", "w") as f:
+                f.write(f"verified content number {i}\n" * 10)
+
+        self.runner: CliRunner = CliRunner()
+        result = self.runner.invoke(cli, ["--context", self.context, "init", "--storage", storage])
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+        result = self.runner.invoke(cli, ["--context", self.context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+
+    def _verify(self, *args: str):
+        return self.runner.invoke(cli, ["--context", self.context, "verify", *args])
+
+    def _verified(self) -> List[tuple]:
+        with sqlite3.connect(f"{self.context}/.runup/runup.db") as conn:
+            return conn.execute("SELECT verified FROM blobs WHERE verified IS NOT NULL").fetchall()
+
+    def _corrupt(self, pattern: str, content: bytes):
+        """Flip a byte of `content` in the stored data."""
+        for path in glob.glob(f"{self.context}/.runup/{pattern}"):
+            with open(path, "r+b") as f:
+                data = f.read()
+                position = data.find(content)
+                if position >= 0:
+                    f.seek(position)
+                    f.write(b"X")
+                    return
+        self.fail("Content not found")
+
+    def test_intact(self):
+        self._setUp("zip")
+        result = self._verify("myproject")
+        self.assertEqual(result.exit_code, 0)
+        self.assertTrue(result.output.startswith(f"{NUM_FILES} contents verified ("))
+        self.assertIn(f": {NUM_FILES} intact, 0 mismatched, 0 missing, 0 unreadable.\n", result.output)
+        self.assertTrue(result.output.endswith("The backups are intact.\n"))
+        self.assertEqual(len(self._verified()), NUM_FILES)
+
+    def test_mismatched(self):
+        self._setUp("zip")
+        self._corrupt("jobs/*", b"verified content number 3")
+        result = self._verify()
+        self.assertIn("Mismatched: data/file-3.txt (job 1)\n", result.output)
+        self.assertIn(f": {NUM_FILES - 1} intact, 1 mismatched, 0 missing, 0 unreadable.\n", result.output)
+        self.assertTrue(result.output.endswith("The backups are NOT intact.\n"))
+        self.assertEqual(len(self._verified()), NUM_FILES - 1)
+
+    def test_missing(self):
+        self._setUp("zip")
+        os.remove(f"{self.context}/.runup/jobs/1")
+        result = self._verify("myproject", "--job", "1")
+        self.assertIn("Missing: data/file-0.txt (job 1)\n", result.output)
+        self.assertIn(f": 0 intact, 0 mismatched, {NUM_FILES} missing, 0 unreadable.\n", result.output)
+        self.assertEqual(self._verified(), [])
+
+    def test_sample(self):
+        self._setUp("zip")
+        result = self._verify("--sample", "0.0001")
+        self.assertTrue(result.output.startswith("0 contents verified ("))
+
+    def test_time_limit(self):
+        self._setUp("zip")
+        result = self._verify("--time-limit", "0.000001")
+        self.assertIn(" contents left for the next verification.\n", result.output)
+
+    def test_packs(self):
+        self._setUp("packs")
+        result = self._verify()
+        self.assertIn(f": {NUM_FILES} intact, 0 mismatched, 0 missing, 0 unreadable.\n", result.output)
+
+        self._corrupt("packs/*", b"verified content number 2")
+        result = self._verify()
+        self.assertIn("Mismatched: data/file-2.txt (job 1)\n", result.output)
+
+    def test_unknown_job(self):
+        self._setUp("zip")
+        result = self._verify("myproject", "--job", "7")
+        self.assertEqual(
+            result.output,
+            'The project "myproject" is not part of the job 7.\nThe backups are NOT intact.\n',
+        )
+
+    def _verify_while_locked(self, exclusive: bool) -> Tuple[bool, Any]:
+        """Verify while another process holds the lock. Returns if it waited, and its result."""
+        held = RepositoryLock(self.context, exclusive, False)
+        results: List[Any] = []
+        held.acquire()
+        thread = threading.Thread(target=lambda: results.append(self._verify("myproject")))
+        thread.start()
+        thread.join(1)
+        waited: bool = thread.is_alive()
+        held.release()
+        thread.join()
+        return waited, results[0]
+
+    @unittest.skipIf(sys.platform.startswith("win"), "fcntl is not available on Windows")
+    def test_waits_for_backup(self):
+        self._setUp("zip")
+
+        # A backup or a prune holds the lock exclusively
+        waited, result = self._verify_while_locked(True)
+        self.assertTrue(waited)
+        self.assertTrue(result.output.startswith("Waiting for another RunUp process to finish...\n"))
+        self.assertTrue(result.output.endswith("The backups are intact.\n"))
+
+    @unittest.skipIf(sys.platform.startswith("win"), "fcntl is not available on Windows")
+    def test_waits_for_restore(self):
+        self._setUp("zip")
+
+        # A restore only shares the lock, but the verification writes to the DB
+        waited, result = self._verify_while_locked(False)
+        self.assertTrue(waited)
+        self.assertTrue(result.output.endswith("The backups are intact.\n"))
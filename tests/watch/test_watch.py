@@ -0,0 +1,215 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+# Built-in
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+import unittest
+from unittest import TestCase, mock
+
+# 3rd party
+from click.testing import CliRunner
+import pyximport  # type: ignore
+
+pyximport.install()
+
+# Own
+from runup.cli import cli
+from runup.journal import Journal, config_fingerprint
+from runup.watch import Watcher
+
+
+CONFIG = """
+version: '1.0'
+
+project:
+  myproject:
+    include:
+      - './include.txt'
+      - './dir'
+    exclude:
+      - '*.log'
+"""
+
+FILES: Dict[str, str] = {
+    "include.txt": "included",
+    "dir/file-1.txt": "one",
+    "dir/file-2.txt": "two",
+    "dir/sub/file-3.txt": "three",
+    "dir/sub/ignored.log": "log",
+}
+
+
+class TestJournal(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        os.mkdir(os.path.join(self._directory.name, ".runup"))
+        self.journal: Journal = Journal(self._directory.name, False)
+        self.journal.open()
+
+    def tearDown(self):
+        self.journal.close()
+        self._directory.cleanup()
+
+    def test_not_watched(self):
+        self.journal.record([("myproject", "file.txt")])
+        self.assertIsNone(self.journal.take("myproject", "config"))
+
+    def test_trusted_after_first_backup(self):
+        self.journal.start(["myproject"])
+        self.journal.ready(["myproject"])
+        # Changes before the first backup since the watcher started may be missing
+        self.journal.record([("myproject", "before.txt")])
+        self.assertIsNone(self.journal.take("myproject", "config"))
+
+        self.journal.record([("myproject", "after.txt"), ("other", "other.txt")])
+        self.assertEqual(self.journal.take("myproject", "config"), ["after.txt"])
+        self.assertEqual(self.journal.take("myproject", "config"), [])
+
+    def test_untrusted(self):
+        self.journal.start(["myproject"])
+        self.journal.ready(["myproject"])
+        self.journal.take("myproject", "config")
+
+        # The configuration changed
+        self.assertIsNone(self.journal.take("myproject", "other config"))
+
+        # Events were lost
+        self.journal.take("myproject", "config")
+        self.journal.invalidate(["myproject"])
+        self.assertIsNone(self.journal.take("myproject", "config"))
+
+        # The watcher is gone
+        self.journal.take("myproject", "config")
+        self.journal.stop(["myproject"])
+        self.assertIsNone(self.journal.take("myproject", "config"))
+
+    def test_waits_for_watcher(self):
+        self.journal.start(["myproject"])
+        self.journal.ready(["myproject"])
+        self.journal.take("myproject", "config")
+
+        # The changes made before the backup started are not all written yet
+        since: float = time.time()
+        self.journal.record([("myproject", "before.txt")], since - 1)
+        with mock.patch("runup.journal.JOURNAL_WAIT", 0.1):
+            self.assertIsNone(self.journal.take("myproject", "config", since))
+
+        self.journal.record([("myproject", "after.txt")], since + 1)
+        self.assertEqual(self.journal.take("myproject", "config", since), ["after.txt"])
+
+
+@unittest.skipIf(not sys.platform.startswith("linux"), "inotify is only available on Linux")
+class TestWatcher(TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.context: str = self._directory.name + "/"
+        with open(self.context + "runup.yaml", "w") as f:
+            f.write(CONFIG)
+        for path, content in FILES.items():
+            self._write(path, content)
+
+        self.runner: CliRunner = CliRunner()
+        result = self.runner.invoke(cli, ["--context", self.context, "init"])
+        self.assertEqual(result.output, "RunUp has been initialized successfully.\n")
+
+        self.config: Dict[str, List[str]] = {"include": ["./include.txt", "./dir"], "exclude": ["*.log"]}
+        self.watcher: Watcher = Watcher(self.context, {"myproject": self.config}, False)
+        self.watcher.start()
+        self._stop: threading.Event = threading.Event()
+        self._thread: threading.Thread = threading.Thread(target=self.watcher.run, args=(self._stop,))
+        self._thread.start()
+
+    def tearDown(self):
+        self._stop.set()
+        self._thread.join()
+        self.watcher.close()
+        self._directory.cleanup()
+
+    def _write(self, path: str, content: str):
+        full_path: str = self.context + path
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w") as f:
+            f.write(content)
+
+    def _take(self) -> List[str]:
+        """Wait for the watcher to write the changes, and take them."""
+        time.sleep(1.5)
+        journal: Journal = Journal(self.context, False)
+        journal.open()
+        try:
+            return journal.take("myproject", config_fingerprint(self.config))
+        finally:
+            journal.close()
+
+    def test_records_changes(self):
+        self.assertIsNone(self._take())
+
+        self._write("dir/file-1.txt", "changed")
+        self._write("dir/sub/ignored.log", "changed")
+        self._write("dir/new/file-4.txt", "four")
+        self._write("not-included.txt", "new")
+        os.remove(self.context + "dir/file-2.txt")
+        # The file may be created before its new directory is watched
+        dirty: List[str] = self._take()
+        self.assertEqual(
+            set(dirty) - {"dir/new/file-4.txt"}, {"dir/file-1.txt", "dir/file-2.txt", "dir/new"}
+        )
+
+        # The new directory is watched too
+        self._write("dir/new/file-4.txt", "changed")
+        self.assertEqual(self._take(), ["dir/new/file-4.txt"])
+
+    def test_take_right_after_change(self):
+        self.assertIsNone(self._take())
+
+        # Taken before the watcher writes it: the backup waits for it
+        self._write("dir/file-1.txt", "changed")
+        journal: Journal = Journal(self.context, False)
+        journal.open()
+        try:
+            dirty: List[str] = journal.take("myproject", config_fingerprint(self.config), time.time())
+        finally:
+            journal.close()
+        self.assertEqual(dirty, ["dir/file-1.txt"])
+
+    def test_incremental_backup(self):
+        result = self.runner.invoke(cli, ["--context", self.context, "backup"])
+        self.assertEqual(result.output, "New backup created.\n")
+
+        self._write("dir/file-1.txt", "changed")
+        self._write("dir/new/file-4.txt", "four")
+        os.remove(self.context + "dir/sub/file-3.txt")
+        os.remove(self.context + "dir/sub/ignored.log")
+        time.sleep(1.5)
+        result = self.runner.invoke(cli, ["--context", self.context, "--verbose", "backup"])
+        self.assertIn("unchanged entries copied from job 1", result.output)
+
+        # Locations are relative to the current directory
+        location: str = os.path.relpath(self.context + "restore-here")
+        result = self.runner.invoke(
+            cli, ["--context", self.context, "restore", "-f", "--location", location]
+        )
+        self.assertEqual(result.exit_code, 0)
+        restored: Dict[str, str] = {}
+        for root, _, files in os.walk(location):
+            for name in files:
+                with open(os.path.join(root, name)) as f:
+                    restored[os.path.relpath(os.path.join(root, name), location)] = f.read()
+        self.assertEqual(
+            restored,
+            {
+                "include.txt": "included",
+                "dir/file-1.txt": "changed",
+                "dir/file-2.txt": "two",
+                "dir/new/file-4.txt": "four",
+            },
+        )
+        # `dir/sub` is now empty, and restored as such
+        self.assertTrue(os.path.isdir(location + "/dir/sub"))